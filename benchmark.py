@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+Benchmark reprodutível da extração, com faturas sintéticas no estilo Endesa geradas pelo PyMuPDF:
+- digital: layout com bloco "TOTALS" (caminho normal de script_digital)
+- rectificativa: layout especial "Factura Rectificativa"
+- escaneada: cópia rasterizada (somente imagem) de uma fatura digital, para o caminho OCR
+Mede separadamente detect_pdf_type, extract_invoice_fields, pdf_to_img_ocr, run_ocr_task e
+extract_fields_from_text, e a extração de ponta a ponta (por arquivo e em lote com run_extraction).
+Relata arquivos/s, latência p50/p95 e pico de memória (RSS); grava os resultados em JSON e compara
+com uma execução anterior (--compare). Roda offline em CPU; sem os modelos do PaddleOCR, a etapa
+run_ocr_task é marcada como ignorada e extract_fields_from_text usa as linhas da camada de texto.
+
+    python benchmark.py --digital 40 --special 10 --scanned 10 --json bench.json
+    python benchmark.py --json novo.json --compare bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource # Somente Unix
+except ImportError:
+    resource = None
+
+import fitz  # PyMuPDF
+
+PAGE_W, PAGE_H = 595, 842
+RASTER_DPI = 150
+
+
+# --- Gerador de faturas sintéticas ---
+def _fmt_eur(valor):
+    """ 1234.5 -> '1.234,50' """
+    return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _fatura_digital(page, n, rng, special=False):
+    def t(x, y, s, fs=9):
+        page.insert_text((x, y), s, fontsize=fs)
+
+    itens = [round(rng.uniform(5, 400), 2) for _ in range(rng.randint(20, 30))]
+    base = round(sum(itens), 2)
+    iva = round(base * 0.21, 2)
+    total = round(base + iva, 2)
+
+    t(40, 40, "Endesa Energía, S.A.U." if n % 2 else "ENDESA ENERGIA XXI, S.L.U.")
+    t(40, 60, "Nº Cliente:"); t(200, 60, f"{rng.randint(10**7, 10**8 - 1)}")
+    t(40, 80, "Nombre:"); t(120, 80, f"EMPRESA SINTETICA {n:04d} S.L."); t(350, 80, "NIF/CIF: B12345678")
+    t(40, 100, "Nº Factura:"); t(200, 100, f"FT {24 + n % 2}/{n:07d}")
+    t(40, 115, "Fecha emisión:"); t(200, 115, f"{1 + n % 28:02d}/{1 + n % 12:02d}/2024")
+    if special:
+        t(40, 130, "Factura Rectificativa")
+    t(40, 150, "Descripción")
+    for k, valor in enumerate(itens):
+        y = 165 + k * 12 # Espaçamento suficiente para cada item virar um bloco de texto próprio
+        t(40, y, f"Concepto consumo periodo {k + 1} ({rng.randint(50, 900)} kWh)", 7)
+        t(420, y, _fmt_eur(valor), 7); t(480, y, "EUR", 7)
+    y = 165 + len(itens) * 12 + 20
+    if special:
+        t(40, y, "BASE IMPONIBLE"); t(300, y, _fmt_eur(base))
+        t(40, y + 18, "IVA repercutido 21%"); t(300, y + 18, _fmt_eur(iva))
+        t(40, y + 36, "TOTAL Importe Factura"); t(300, y + 36, f"{_fmt_eur(total)} EUR")
+    else:
+        t(40, y, "TOTALS")
+        t(40, y + 18, "BASE IMPONIBLE"); t(450, y + 18, f"{_fmt_eur(base)} EUR")
+        t(40, y + 36, "IVA repercutido 21%"); t(450, y + 36, f"{_fmt_eur(iva)} EUR")
+        t(40, y + 54, "TOTAL importe Factura"); t(450, y + 54, f"{_fmt_eur(total)} EUR")
+    t(40, 740, "Observaciones")
+    t(40, 755, f"Pago por domiciliación bancaria. Referencia {rng.randint(1000, 9999)}.")
+    t(40, 800, "Pag. 1/1", 7)
+    return {"BASE IMPONIBLE": base, "IMPUESTOS": iva, "IMPORTE TOTAL": total}
+
+
+def generate_corpus(out_dir, n_digital=20, n_special=5, n_scanned=5, seed=1234) -> dict:
+    """
+    Gera o corpus em out_dir (determinístico para a mesma semente).
+    Retorna {"digital": [...], "special": [...], "scanned": [...]} com os caminhos por categoria.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    corpus = {"digital": [], "special": [], "scanned": []}
+    n = 0
+    for categoria, quantidade in (("digital", n_digital), ("special", n_special), ("scanned", n_scanned)):
+        for _ in range(quantidade):
+            n += 1
+            path = out_dir / f"{categoria}_{n:05d}.pdf"
+            doc = fitz.open()
+            page = doc.new_page(width=PAGE_W, height=PAGE_H)
+            _fatura_digital(page, n, rng, special=(categoria == "special"))
+            if categoria == "scanned":
+                # Rasteriza e substitui por uma página somente imagem
+                pix = page.get_pixmap(dpi=RASTER_DPI, colorspace=fitz.csGRAY)
+                scan = fitz.open()
+                scan.new_page(width=PAGE_W, height=PAGE_H).insert_image(fitz.Rect(0, 0, PAGE_W, PAGE_H), pixmap=pix)
+                doc.close()
+                doc = scan
+            doc.save(str(path), garbage=3, deflate=True)
+            doc.close()
+            corpus[categoria].append(path)
+    return corpus
+
+
+# --- Medição ---
+def _peak_rss_mb():
+    """ Pico de RSS do processo e dos filhos (MB); None fora do Unix. """
+    if resource is None:
+        return None
+    fator = 1 / 1024 if sys.platform != "darwin" else 1 / (1024 * 1024) # ru_maxrss: KB no Linux, bytes no macOS
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * fator
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * fator
+    return {"self": round(proprio, 1), "children": round(filhos, 1)}
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(ordenados) - 1)
+    return ordenados[lo] + (ordenados[hi] - ordenados[lo]) * (k - lo)
+
+
+def summarize(latencias, wall=None) -> dict:
+    """ Estatísticas de uma etapa a partir das latências por item (segundos). """
+    wall = wall if wall is not None else sum(latencias)
+    return {
+        "items": len(latencias),
+        "wall_seconds": round(wall, 4),
+        "files_per_sec": round(len(latencias) / wall, 2) if wall > 0 else None,
+        "p50_ms": round(_percentil(latencias, 0.50) * 1000, 2) if latencias else None,
+        "p95_ms": round(_percentil(latencias, 0.95) * 1000, 2) if latencias else None,
+        "mean_ms": round(statistics.mean(latencias) * 1000, 2) if latencias else None,
+        "max_ms": round(max(latencias) * 1000, 2) if latencias else None,
+    }
+
+
+def _medir(func, itens, repeat=1):
+    """ Chama func(item) para cada item, repeat vezes; retorna (latências, resultados da última rodada). """
+    latencias, resultados = [], []
+    for _ in range(repeat):
+        resultados = []
+        for item in itens:
+            inicio = time.perf_counter()
+            resultados.append(func(item))
+            latencias.append(time.perf_counter() - inicio)
+    return latencias, resultados
+
+
+@contextlib.contextmanager
+def _silenciar(ativo=True):
+    """ Descarta a saída padrão (prints de debug dos extratores, inclusive nos processos filhos). """
+    if not ativo:
+        yield
+        return
+    sys.stdout.flush()
+    original = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(original, 1)
+        os.close(original)
+        os.close(devnull)
+
+
+def run_benchmark(corpus, repeat=1, jobs=1) -> dict:
+    """ Executa todas as etapas sobre o corpus gerado; retorna o dicionário de resultados. """
+    import main_processor
+    import script_digital
+    import script_ocr
+
+    digitais = corpus["digital"] + corpus["special"]
+    escaneadas = corpus["scanned"]
+    todos = digitais + escaneadas
+    etapas = {}
+
+    lat, tipos = _medir(main_processor.detect_pdf_type, todos, repeat)
+    etapas["detect_pdf_type"] = summarize(lat)
+    esperado = ["Digital"] * len(digitais) + ["OCR"] * len(escaneadas)
+    etapas["detect_pdf_type"]["misdetected"] = sum(t != e for t, e in zip(tipos, esperado))
+
+    lat, extraidos = _medir(lambda p: script_digital.extract_invoice_fields(str(p)), digitais, repeat)
+    etapas["extract_invoice_fields"] = summarize(lat)
+    etapas["extract_invoice_fields"]["missing_total"] = sum(1 for d in extraidos if d.get("IMPORTE TOTAL") is None)
+
+    lat, imagens = _medir(lambda p: script_ocr.pdf_to_img_ocr(str(p)), escaneadas, repeat)
+    etapas["pdf_to_img_ocr"] = summarize(lat)
+
+    engine_ok = script_ocr.get_ocr_engine() is not None if escaneadas else False
+    if engine_ok:
+        lat, linhas_ocr = _medir(script_ocr.run_ocr_task, [img for img in imagens if img is not None], repeat)
+        etapas["run_ocr_task"] = summarize(lat)
+        fonte_linhas = "ocr"
+    else:
+        etapas["run_ocr_task"] = {"skipped": "engine PaddleOCR indisponível (modelos ausentes ou paddle não instalado)"}
+        # Sem OCR: as linhas da camada de texto das faturas digitais alimentam o parser OCR
+        linhas_ocr = []
+        for p in digitais:
+            with fitz.open(p) as doc:
+                linhas_ocr.append([l for l in doc[0].get_text("text").splitlines() if l.strip()])
+        fonte_linhas = "text_layer"
+    imagens = None
+    lat, _ = _medir(lambda linhas: script_ocr.extract_fields_from_text(linhas, "benchmark.pdf"), linhas_ocr, repeat)
+    etapas["extract_fields_from_text"] = summarize(lat)
+    etapas["extract_fields_from_text"]["lines_source"] = fonte_linhas
+
+    # Ponta a ponta por arquivo (detecção + extração, mesmo caminho da GUI com 1 worker)
+    lat, _ = _medir(main_processor.process_single_pdf, todos, repeat)
+    etapas["end_to_end_per_file"] = summarize(lat)
+
+    # Ponta a ponta em lote (run_extraction com jobs workers, sem cache nem diário)
+    inicio = time.perf_counter()
+    resumo = main_processor.run_extraction(None, None, jobs=jobs, cache=False, journal=False, pdf_files=todos)
+    wall = time.perf_counter() - inicio
+    etapas["end_to_end_batch"] = {
+        "items": resumo["files"], "jobs": jobs, "wall_seconds": round(wall, 4),
+        "files_per_sec": round(resumo["files"] / wall, 2) if wall > 0 else None,
+        "errors": resumo["errors"],
+    }
+    return etapas
+
+
+def compare(atual, anterior) -> list:
+    """ Linhas de comparação (p50 e arquivos/s) entre duas execuções. """
+    linhas = []
+    for nome, st in atual["stages"].items():
+        antes = anterior.get("stages", {}).get(nome)
+        if not antes or "skipped" in st or "skipped" in antes:
+            continue
+        for chave in ("p50_ms", "files_per_sec"):
+            a, b = antes.get(chave), st.get(chave)
+            if a and b:
+                linhas.append(f"{nome:26s} {chave:14s} {a:>10} -> {b:>10} ({(b - a) / a * 100:+.1f}%)")
+    return linhas
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark da extração de faturas (corpus sintético).")
+    parser.add_argument("--digital", type=int, default=20, help="Faturas digitais com TOTALS")
+    parser.add_argument("--special", type=int, default=5, help="Faturas rectificativas (layout especial)")
+    parser.add_argument("--scanned", type=int, default=5, help="Cópias rasterizadas (caminho OCR)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=1, help="Rodadas por etapa")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Workers da etapa em lote")
+    parser.add_argument("--corpus-dir", help="Pasta do corpus (padrão: temporária)")
+    parser.add_argument("--json", help="Grava os resultados neste arquivo JSON")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Mostra avisos e erros dos extratores")
+    args = parser.parse_args(argv)
+
+    import main_processor # Configura o logging na importação; o nível é ajustado em seguida
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix="bench_faturas_") as tmp:
+        corpus_dir = Path(args.corpus_dir or tmp)
+        inicio = time.perf_counter()
+        corpus = generate_corpus(corpus_dir, args.digital, args.special, args.scanned, args.seed)
+        geracao = time.perf_counter() - inicio
+        with _silenciar():
+            etapas = run_benchmark(corpus, args.repeat, args.jobs)
+
+    resultado = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pymupdf": fitz.VersionBind,
+            "cpu_count": os.cpu_count(),
+            "corpus": {"digital": args.digital, "special": args.special, "scanned": args.scanned, "seed": args.seed},
+            "repeat": args.repeat,
+            "corpus_generation_seconds": round(geracao, 3),
+        },
+        "stages": etapas,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+    for nome, st in etapas.items():
+        if "skipped" in st:
+            print(f"{nome:26s} ignorada: {st['skipped']}")
+        elif "p50_ms" in st:
+            print(f"{nome:26s} {st['items']:5d} itens  {st['files_per_sec'] or 0:9.2f} arq/s  "
+                  f"p50 {st['p50_ms']} ms  p95 {st['p95_ms']} ms")
+        else:
+            print(f"{nome:26s} {st['items']:5d} itens  {st['files_per_sec'] or 0:9.2f} arq/s  ({st['jobs']} worker(s))")
+    print(f"Pico de RSS (MB): {resultado['peak_rss_mb']}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            for linha in compare(resultado, json.load(f)):
+                print(linha)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
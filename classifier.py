@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+classifier.py
+Classificação Digital/OCR de um PDF (página 0) com sinais baratos antes da análise completa:
+1. fontes na página (get_fonts: só recursos, sem extrair texto) — sem fontes não há texto: OCR
+2. tamanho do texto bruto: strings dos operadores de texto (BT...ET) do content stream e dos
+   Form XObjects, sem análise de layout
+3. cobertura de imagens: área das imagens / área da página (get_image_info)
+4. metadados producer/creator (software de digitalização)
+Só quando os sinais são ambíguos roda a análise completa de antes (blocos de texto e imagens,
+limiares 70/20). As decisões são memoizadas por hash do conteúdo (em memória e, com um
+result_cache.ResultCache, em disco); classify_many classifica uma pasta inteira numa passada.
+"""
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+from pdf_context import open_context
+
+# Limiares dos sinais baratos
+DIGITAL_MIN_TEXT_BYTES = 400  # texto bruto a partir do qual a página é digital (se pouco coberta por imagens)
+DIGITAL_MAX_COVERAGE = 0.5
+SCAN_MIN_COVERAGE = 0.8       # página praticamente toda imagem
+SCAN_MAX_TEXT_BYTES = 50      # ...e quase sem texto: OCR
+SCANNER_PRODUCER_RE = re.compile(
+    r"scan|canon|xerox|ricoh|kyocera|konica|brother|epson|sharp|lexmark|toshiba|hp digital sending|twain|wia|naps2",
+    re.IGNORECASE)
+
+# Limiares da análise completa (mesmos da detect_pdf_type original)
+FULL_DIGITAL_BLOCKS = 70
+FULL_MIN_BLOCKS = 20
+
+# classify_many só abre um pool de processos a partir deste número de arquivos (a classificação é rápida)
+POOL_MIN_FILES = int(os.environ.get("EXTRATOR_CLASSIFY_POOL_MIN", "64"))
+
+_BT_ET_RE = re.compile(rb"\bBT\b(.*?)\bET\b", re.S)
+_STRING_RE = re.compile(rb"\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>")
+_WS_RE = re.compile(rb"\s")
+
+_memo = {} # hash do conteúdo (ou (caminho, tamanho, mtime), sem cache em disco) -> tipo
+
+
+def _raw_text_bytes(doc, page):
+    """ Bytes de texto nos operadores de texto da página e dos seus Form XObjects (sem layout). """
+    streams = [page.read_contents()]
+    for xref, *_ in page.get_xobjects():
+        try:
+            streams.append(doc.xref_stream(xref))
+        except Exception:
+            pass
+    total = 0
+    for data in streams:
+        for bloco in _BT_ET_RE.finditer(data or b""):
+            for m in _STRING_RE.finditer(bloco.group(1)):
+                s = m.group()
+                total += len(s) - 2 if s[:1] == b"(" else len(_WS_RE.sub(b"", s[1:-1])) // 2
+    return total
+
+
+def _image_coverage(page):
+    area_pagina = abs(page.rect) or 1
+    coberta = 0.0
+    for info in page.get_image_info():
+        r = page.rect & info["bbox"]
+        if not r.is_empty:
+            coberta += abs(r)
+    return min(1.0, coberta / area_pagina)
+
+
+def cheap_signals(ctx) -> dict:
+    """ Sinais baratos da página 0 de um PdfContext. """
+    page = ctx.page(0)
+    meta = ctx.doc.metadata or {}
+    return {
+        "fonts": len(page.get_fonts()),
+        "text_bytes": _raw_text_bytes(ctx.doc, page),
+        "image_coverage": round(_image_coverage(page), 3),
+        "producer": f"{meta.get('producer') or ''} {meta.get('creator') or ''}".strip(),
+    }
+
+
+def _decidir_barato(s):
+    """ Decisão pelos sinais baratos: (tipo, motivo) ou None se ambíguo. """
+    if s["fonts"] == 0:
+        return "OCR", "sem fontes na página"
+    if s["text_bytes"] >= DIGITAL_MIN_TEXT_BYTES and s["image_coverage"] < DIGITAL_MAX_COVERAGE:
+        return "Digital", f"texto bruto {s['text_bytes']} bytes, cobertura de imagem {s['image_coverage']:.0%}"
+    if s["image_coverage"] >= SCAN_MIN_COVERAGE:
+        if s["text_bytes"] < SCAN_MAX_TEXT_BYTES:
+            return "OCR", f"página coberta por imagem ({s['image_coverage']:.0%}) e quase sem texto"
+        if s["text_bytes"] < DIGITAL_MIN_TEXT_BYTES and SCANNER_PRODUCER_RE.search(s["producer"]):
+            return "OCR", f"digitalizado por '{s['producer']}' com pouco texto"
+    return None
+
+
+def _analise_completa(ctx):
+    """ Análise completa (blocos de texto e imagens da página 0), como na detect_pdf_type original. """
+    num_text_elements = len(ctx.text_blocks(0))
+    num_images = len(ctx.images(0))
+    if num_text_elements > FULL_DIGITAL_BLOCKS:
+        return "Digital", f"textos: {num_text_elements}"
+    if num_images > 0 and num_text_elements < FULL_MIN_BLOCKS:
+        return "OCR", f"textos: {num_text_elements}, imagens: {num_images}"
+    if num_text_elements >= FULL_MIN_BLOCKS:
+        return "Digital", f"fallback - algum texto: {num_text_elements}"
+    return "OCR", f"fallback final - pouco texto: {num_text_elements}"
+
+
+def classify(pdf_path, ctx=None):
+    """
+    Classifica um PDF em 'Digital' ou 'OCR'. Retorna (tipo, motivo, completa), onde completa indica
+    se a análise completa foi necessária. Erros propagam (o chamador decide o fallback).
+    """
+    ctx, owned = open_context(pdf_path, ctx)
+    try:
+        if not ctx.page_count:
+            return "OCR", "PDF sem páginas", False
+        sinais = cheap_signals(ctx)
+        decisao = _decidir_barato(sinais)
+        if decisao is not None:
+            return decisao[0], decisao[1], False
+        tipo, motivo = _analise_completa(ctx)
+        return tipo, motivo, True
+    finally:
+        if owned:
+            ctx.close()
+
+
+def _classificar_arquivo(pdf_path):
+    """
+    Versão para o pool de processos: nunca levanta exceção. Retorna (tipo, classificado); em caso de erro,
+    ("OCR", False): OCR como fallback, como na detecção, mas sem valer como decisão do classificador.
+    """
+    try:
+        return classify(pdf_path)[0], True
+    except Exception as e:
+        logging.error(f"Erro ao classificar '{Path(pdf_path).name}': {e}. Assumindo OCR como fallback.")
+        return "OCR", False
+
+
+def _chave_memo(pdf_path, cache):
+    """
+    Chave da decisão memoizada: com cache (result_cache.ResultCache), o hash do conteúdo, memoizado pelo
+    próprio cache por (caminho, tamanho, mtime); sem cache, só (caminho, tamanho, mtime), sem ler o arquivo.
+    """
+    if cache is not None:
+        return cache.file_hash(pdf_path)
+    st = pdf_path.stat()
+    return (str(pdf_path.resolve()), st.st_size, st.st_mtime)
+
+
+def classify_many(pdf_paths, jobs=1, cache=None, memo_only=False) -> dict:
+    """
+    Classifica vários PDFs numa passada: {pdf_path: tipo}. As decisões ficam memoizadas por conteúdo
+    (em memória e, se cache for um result_cache.ResultCache, também em disco; ver _chave_memo); o OCR de
+    fallback de um arquivo que não pôde ser classificado não é memoizado (o erro pode ser transitório).
+    Com jobs > 1 e pelo menos POOL_MIN_FILES arquivos não memoizados, classifica num pool de processos.
+    memo_only: só consulta as decisões memoizadas; os demais arquivos ficam com None e não são abertos
+    (a detecção fica com o worker da extração, que reaproveita o mesmo PdfContext).
+    """
+    inicio = time.perf_counter()
+    pdf_paths = [Path(p) for p in pdf_paths]
+    hashes, tipos, faltantes = {}, {}, []
+    for p in pdf_paths:
+        try:
+            hashes[p] = _chave_memo(p, cache)
+        except OSError:
+            hashes[p] = None
+        tipo = _memo.get(hashes[p]) if hashes[p] else None
+        if tipo is None and cache is not None and hashes[p]:
+            tipo = cache.get_classification(hashes[p])
+        if tipo is None:
+            faltantes.append(p)
+        else:
+            tipos[p] = tipo
+    memoizados = len(tipos)
+
+    if memo_only:
+        tipos.update(dict.fromkeys(faltantes))
+        faltantes, novos = [], []
+    elif jobs > 1 and len(faltantes) >= POOL_MIN_FILES:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(faltantes))) as executor:
+            novos = list(executor.map(_classificar_arquivo, [str(p) for p in faltantes], chunksize=8))
+    else:
+        novos = [_classificar_arquivo(p) for p in faltantes]
+
+    for p, (tipo, classificado) in zip(faltantes, novos):
+        tipos[p] = tipo
+        if hashes[p] and classificado:
+            _memo[hashes[p]] = tipo
+            if cache is not None:
+                cache.put_classification(hashes[p], tipo)
+    logging.info(f"[Classificador] {len(pdf_paths)} arquivo(s) em {time.perf_counter() - inicio:.2f}s "
+                 f"({memoizados} memoizado(s)).")
+    return tipos
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cli.py
+Execução em lote sem interface gráfica (servidores, tarefas agendadas).
+Reutiliza main_processor.run_extraction; tkinter não é importado.
+
+Exemplos:
+    python cli.py /dados/faturas -o saida.xlsx
+    python cli.py "/dados/2025/**/*.pdf" -r -o saida.parquet -j 8 --summary resumo.json
+    python cli.py pasta1 pasta2 -o saida.csv --mode ocr --summary -
+    python cli.py /dados/faturas -o reparse.csv --reparse   # só o parse, sobre o cache de OCR bruto
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+
+MODES = {"auto": None, "digital": "Digital", "ocr": "OCR"}
+
+
+def discover_pdfs(inputs, recursive=False) -> list:
+    """ PDFs de pastas, arquivos ou padrões glob; sem duplicatas, em ordem. A extensão não diferencia maiúsculas. """
+    encontrados = set()
+    for entrada in inputs:
+        caminho = Path(entrada)
+        if caminho.is_dir():
+            candidatos = caminho.rglob("*") if recursive else caminho.glob("*")
+        elif caminho.is_file():
+            candidatos = [caminho]
+        else:
+            candidatos = (Path(p) for p in glob.glob(entrada, recursive=recursive))
+        for p in candidatos:
+            if p.suffix.lower() == ".pdf" and p.is_file():
+                encontrados.add(p.resolve())
+    return sorted(encontrados)
+
+
+def build_summary(resumo, seconds, output=None) -> dict:
+    """ Resumo da execução (a partir do resumo de run_extraction): vazão, contagens por tipo e arquivos com erro. """
+    arquivos = resumo.get("files", 0)
+    return {
+        "files": arquivos,
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(arquivos / seconds, 3) if seconds > 0 else None,
+        "by_detection": dict(resumo.get("by_detection", {})),
+        "by_extraction": dict(resumo.get("by_extraction", {})),
+        "errors": resumo.get("errors", 0),
+        "error_files": list(resumo.get("error_files", [])),
+        "output": output,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extração de dados de faturas em PDF (modo lote, sem GUI).")
+    parser.add_argument("inputs", nargs="+", help="Pastas, arquivos PDF ou padrões glob")
+    parser.add_argument("-o", "--output", required=True, help="Arquivo de saída (.xlsx, .csv ou .parquet)")
+    parser.add_argument("-f", "--format", choices=["xlsx", "csv", "parquet"], help="Formato da saída (padrão: pela extensão)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Busca PDFs nas subpastas (e '**' nos globs)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Processos em paralelo (padrão: núcleos da máquina)")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="Workers do pool OCR (padrão: EXTRATOR_OCR_WORKERS)")
+    parser.add_argument("--pipeline", action="store_true", default=None, help="Usa o pipeline em streaming")
+    parser.add_argument("--mode", choices=sorted(MODES), default="auto", help="Força Digital/OCR para todos os arquivos")
+    parser.add_argument("--ocr-warmup", action="store_true", default=None,
+                        help="Carrega o PaddleOCR em segundo plano enquanto os arquivos são classificados "
+                             "(padrão: EXTRATOR_OCR_WARMUP; útil nos modos sequencial e pipeline)")
+    parser.add_argument("--no-cache", action="store_true", help="Não usa o cache de resultados")
+    parser.add_argument("--resume", action="store_true", help="Retoma a execução anterior a partir do diário")
+    parser.add_argument("--reparse", action="store_true",
+                        help="Só refaz o parse dos PDFs OCR sobre o cache de OCR bruto (sem OCR; ignora --mode e os caches)")
+    parser.add_argument("--summary", help="Grava o resumo JSON neste arquivo ('-' para a saída padrão)")
+    parser.add_argument("--metrics-json", help="Grava as métricas da execução (JSON) neste arquivo")
+    parser.add_argument("--metrics-prom", help="Grava as métricas no formato textfile do Prometheus")
+    parser.add_argument("--metrics-columns", action="store_true", help="Inclui os tempos por estágio (T_*_MS) na saída")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Só avisos e erros no log")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """ Executa a extração descrita pelos argumentos; retorna (código de saída, resumo ou None). """
+    import main_processor
+    from journal import default_journal_path
+    from output_sinks import open_sink, default_columns
+
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    pdf_files = discover_pdfs(args.inputs, args.recursive)
+    if not pdf_files:
+        logging.error(f"Nenhum arquivo PDF encontrado em: {', '.join(args.inputs)}")
+        return 2, None
+
+    # Pré-carregamento do OCR: só quando pode haver PDFs OCR (não em --mode digital nem no re-parse)
+    aquecer = main_processor.OCR_WARMUP if args.ocr_warmup is None else args.ocr_warmup
+    if aquecer and not args.reparse and MODES[args.mode] != "Digital":
+        import script_ocr
+        script_ocr.warmup_ocr_engine()
+
+    inicio = time.perf_counter()
+    colunas = default_columns(True) if args.metrics_columns else None
+    with open_sink(args.output, args.format, colunas) as sink:
+        if args.reparse:
+            resumo = main_processor.run_reparse(pdf_files, sink=sink, metrics_json=args.metrics_json,
+                                                 metrics_prom=args.metrics_prom)
+        else:
+            resumo = main_processor.run_extraction(
+                ", ".join(args.inputs), args.output, jobs=args.jobs, ocr_workers=args.ocr_workers,
+                pipeline=args.pipeline, cache=False if args.no_cache else None, resume=args.resume,
+                sink=sink, pdf_files=pdf_files, tipo_fatura=MODES[args.mode],
+                metrics_json=args.metrics_json, metrics_prom=args.metrics_prom,
+            )
+    try:
+        os.remove(default_journal_path(args.output))
+    except OSError:
+        pass
+
+    summary = build_summary(resumo, time.perf_counter() - inicio, args.output)
+    if main_processor.CACHE_STATS:
+        summary["cache"] = dict(main_processor.CACHE_STATS)
+    summary["metrics"] = dict(main_processor.RUN_METRICS)
+    logging.info(f"{summary['files']} arquivo(s) em {summary['seconds']}s ({summary['files_per_sec']} arquivos/s), "
+                 f"{summary['errors']} com erro. Saída: {args.output}")
+    return 0, summary
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Com o resumo na saída padrão, os prints das bibliotecas e dos extratores (inclusive nos workers) vão para stderr
+    stdout_original = None
+    if args.summary == "-":
+        sys.stdout.flush()
+        stdout_original = os.dup(1)
+        os.dup2(2, 1)
+    try:
+        codigo, summary = run(args)
+    finally:
+        if stdout_original is not None:
+            sys.stdout.flush()
+            os.dup2(stdout_original, 1)
+            os.close(stdout_original)
+
+    if summary is not None and args.summary == "-":
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    elif summary is not None and args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return codigo
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
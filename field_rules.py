@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+field_rules.py
+Motor de regras de campo compartilhado por script_digital e script_ocr.
+Cada campo é descrito por uma FieldRule (rótulos, padrão do valor, região e normalizador),
+compilada uma única vez na importação do módulo que define a tabela de regras.
+Os rótulos de todas as regras são localizados numa única passada pelo texto
+(alternância combinada em lookahead, que encontra inclusive ocorrências sobrepostas).
+"""
+import re
+
+
+class FieldRule:
+    """
+    Regra declarativa de um campo.
+    - labels: rótulos literais (literal=True, busca tipo search_for) ou alternativas regex (literal=False)
+    - pattern: regex do valor. Com literal=False é concatenada ao rótulo (rótulo + valor)
+    - region: região onde o valor é procurado ("line", "totals", "right"...), interpretada pelo extrator
+    - margin: folga vertical (pt) da região
+    - normalizer: função aplicada ao valor capturado (ou ao match, conforme o extrator)
+    """
+    __slots__ = ("name", "labels", "pattern", "region", "margin", "normalizer", "literal", "label_re", "regex")
+
+    def __init__(self, name, labels, pattern=None, region="line", margin=2, normalizer=None, flags=0, literal=True):
+        self.name = name
+        self.labels = tuple(labels)
+        self.region = region
+        self.margin = margin
+        self.normalizer = normalizer
+        self.literal = literal
+        if literal:
+            alternatives = [re.escape(l.lower()) for l in self.labels]
+            self.regex = re.compile(pattern, flags) if pattern else None
+        else:
+            alternatives = list(self.labels)
+            self.regex = re.compile("(?:" + "|".join(alternatives) + ")" + (pattern or ""), flags)
+        self.label_re = re.compile("(?:" + "|".join(alternatives) + ")", flags if not literal else 0)
+        self.pattern = pattern
+
+    def __repr__(self):
+        return f"FieldRule({self.name!r})"
+
+
+class LabelMatcher:
+    """
+    Autômato de rótulos literais (minúsculos): uma regex de lookahead com todos os rótulos
+    encontra cada posição onde algum rótulo começa; os rótulos que casam naquela posição
+    são confirmados por startswith, agrupados pela primeira letra.
+    """
+
+    def __init__(self, labels):
+        self.labels = sorted({l.lower() for l in labels}, key=len, reverse=True)
+        self.regex = re.compile("(?=" + "|".join(re.escape(l) for l in self.labels) + ")") if self.labels else None
+        self._by_first = {}
+        for l in self.labels:
+            self._by_first.setdefault(l[0], []).append(l)
+
+    def scan(self, text_lower):
+        """ Retorna [(posição, rótulo)] para todas as ocorrências (inclusive sobrepostas). """
+        hits = []
+        if not self.regex:
+            return hits
+        for m in self.regex.finditer(text_lower):
+            pos = m.start()
+            for label in self._by_first.get(text_lower[pos], ()):
+                if text_lower.startswith(label, pos):
+                    hits.append((pos, label))
+        return hits
+
+
+def literal_matcher(rules, *extra_labels):
+    """ LabelMatcher com os rótulos de todas as regras literais mais rótulos avulsos (âncoras, fins de região). """
+    labels = [l for r in rules for l in r.labels]
+    for group in extra_labels:
+        labels.extend(group)
+    return LabelMatcher(labels)
+
+
+class TextScanner:
+    """
+    Aplica várias regras regex (literal=False) num texto com uma passada de rótulos.
+    O resultado de cada regra é o mesmo de rule.regex.search(text): o primeiro ponto onde o rótulo
+    começa e o valor casa.
+    """
+
+    def __init__(self, rules, flags=re.IGNORECASE):
+        self.rules = list(rules)
+        self.regex = re.compile("(?=" + "|".join(r.label_re.pattern for r in self.rules) + ")", flags)
+
+    def scan(self, text):
+        """ Retorna {nome da regra: match ou None}. """
+        results = {r.name: None for r in self.rules}
+        pending = list(self.rules)
+        for m in self.regex.finditer(text):
+            pos = m.start()
+            for rule in list(pending):
+                if rule.label_re.match(text, pos):
+                    match = rule.regex.match(text, pos)
+                    if match:
+                        results[rule.name] = match
+                        pending.remove(rule)
+            if not pending:
+                break
+        return results
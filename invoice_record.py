@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+invoice_record.py
+Registro de uma fatura (uma linha da saída), produzido pelos dois extratores (script_digital e script_ocr)
+e completado pelo main_processor. Os campos têm ordem fixa (FIELDS) e valores tipados: importes em float,
+demais campos em texto. O acesso continua no estilo dict (registro["IMPORTE TOTAL"], get, items, update).
+- __slots__: sem __dict__ por registro; colunas fora do esquema (tempos T_*_MS, WORKER_PID) ficam em extras
+- todos os campos de FIELDS existem sempre (None = sem valor), como no dict do extrator digital; já
+  `campo in registro` só é True com valor: "ERRO" in registro continua significando "o registro tem erro",
+  como no dict que ele substitui
+- to_tuple() / to_row(columns): valores na ordem de FIELDS / das colunas de um destino (output_sinks)
+- column_values(registros, coluna): uma coluna de um lote inteiro (DataFrame do postprocess)
+- to_dict() / InvoiceRecord(dict): JSON do cache de resultados, do diário e do serviço
+- NO_CACHE: extra com o motivo de o registro não poder ir ao cache de resultados (depende do estado da
+  execução, ex.: DPI reduzido pelo orçamento de memória, OCR híbrido sem engine)
+- pickle pela tupla de valores (pools de processos)
+"""
+import re
+from collections.abc import MutableMapping
+from operator import attrgetter
+
+FIELDS = (
+    "ARQUIVO", "SOURCE_DETECTION", "SOURCE_EXTRACTION",
+    "EMISOR", "Nº CLIENTE", "CLIENTE", "REFERENCIA FACTURA", "DESCRIPCIÓN",
+    "BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL", "MOEDA",
+    "FECHA FACTURA", "FECHA VENCIMIENTO", "OBSERVACIONES", "ERRO",
+)
+AMOUNT_FIELDS = ("BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL")
+NO_CACHE = "SEM_CACHE"
+
+_SLOTS = (
+    "arquivo", "source_detection", "source_extraction",
+    "emisor", "num_cliente", "cliente", "referencia_factura", "descripcion",
+    "base_imponible", "impuestos", "importe_total", "moeda",
+    "fecha_factura", "fecha_vencimiento", "observaciones", "erro",
+)
+_SLOT_OF = dict(zip(FIELDS, _SLOTS))
+_AMOUNT_SLOTS = frozenset(_SLOT_OF[c] for c in AMOUNT_FIELDS)
+_NON_NUMERIC_RE = re.compile(r"[^\d,.\-]")
+
+
+def to_amount(valor):
+    """
+    Importe em float (None se não for número). Números passam direto; textos seguem as regras de
+    script_ocr.clean_value: com vírgula depois do último ponto a vírgula é o decimal ('1.234,56'),
+    senão as vírgulas são milhares ('1,234.56'); hífen no início ou no fim é sinal ('12,50-').
+    """
+    if valor is None or isinstance(valor, float):
+        return valor
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return float(valor)
+    texto = _NON_NUMERIC_RE.sub("", str(valor))
+    negativo = texto.startswith("-") or texto.endswith("-")
+    texto = texto.strip("-")
+    if texto.rfind(",") > texto.rfind("."):
+        texto = texto.replace(".", "").replace(",", ".")
+    else:
+        texto = texto.replace(",", "")
+    try:
+        numero = float(texto)
+    except ValueError:
+        return None
+    return -numero if negativo else numero
+
+
+def _from_state(valores, extras):
+    registro = InvoiceRecord.__new__(InvoiceRecord)
+    for slot, valor in zip(_SLOTS, valores):
+        setattr(registro, slot, valor)
+    registro._extras = extras
+    return registro
+
+
+class InvoiceRecord(MutableMapping):
+    """
+    Registro de fatura com acesso por nome de coluna:
+        registro = InvoiceRecord({"ARQUIVO": "fatura.pdf"})
+        registro["IMPORTE TOTAL"] = "1.210,00"   # guardado como 1210.0
+        registro.to_row(["ARQUIVO", "IMPORTE TOTAL"])
+    """
+    __slots__ = _SLOTS + ("_extras",)
+
+    def __init__(self, dados=None):
+        for slot in _SLOTS:
+            setattr(self, slot, None)
+        self._extras = None
+        if dados:
+            self.update(dados)
+
+    def __getitem__(self, chave):
+        slot = _SLOT_OF.get(chave)
+        if slot is not None:
+            return getattr(self, slot)
+        if self._extras is not None and chave in self._extras:
+            return self._extras[chave]
+        raise KeyError(chave)
+
+    def get(self, chave, padrao=None):
+        slot = _SLOT_OF.get(chave)
+        if slot is not None:
+            return getattr(self, slot)
+        return self._extras.get(chave, padrao) if self._extras is not None else padrao
+
+    def __setitem__(self, chave, valor):
+        slot = _SLOT_OF.get(chave)
+        if slot is None:
+            if self._extras is None:
+                self._extras = {}
+            self._extras[chave] = valor
+        elif slot in _AMOUNT_SLOTS:
+            setattr(self, slot, to_amount(valor))
+        else:
+            setattr(self, slot, None if valor is None else str(valor))
+
+    def __delitem__(self, chave):
+        slot = _SLOT_OF.get(chave)
+        if slot is not None:
+            setattr(self, slot, None)
+        elif self._extras is not None and chave in self._extras:
+            del self._extras[chave]
+        else:
+            raise KeyError(chave)
+
+    def __contains__(self, chave):
+        slot = _SLOT_OF.get(chave)
+        if slot is not None:
+            return getattr(self, slot) is not None
+        return self._extras is not None and chave in self._extras
+
+    def __iter__(self):
+        yield from FIELDS
+        if self._extras:
+            yield from list(self._extras)
+
+    def __len__(self):
+        return len(FIELDS) + (len(self._extras) if self._extras else 0)
+
+    def merge(self, outro):
+        """ Copia só os campos com valor de outro registro/dict (o resultado de um extrator). """
+        for chave, valor in outro.items():
+            if valor is not None:
+                self[chave] = valor
+        return self
+
+    def to_tuple(self):
+        """ Valores dos campos na ordem de FIELDS (sem os extras). """
+        return tuple(getattr(self, slot) for slot in _SLOTS)
+
+    def to_row(self, columns):
+        """ Valores na ordem das colunas pedidas (campos ou extras; None se ausente). """
+        extras = self._extras or {}
+        return [getattr(self, _SLOT_OF[c]) if c in _SLOT_OF else extras.get(c) for c in columns]
+
+    def extra_keys(self):
+        """ Nomes das colunas fora de FIELDS presentes no registro. """
+        return self._extras.keys() if self._extras else ()
+
+    def to_dict(self):
+        dados = dict(zip(FIELDS, self.to_tuple()))
+        if self._extras:
+            dados.update(self._extras)
+        return dados
+
+    def copy(self):
+        return _from_state(self.to_tuple(), dict(self._extras) if self._extras else None)
+
+    def __reduce__(self):
+        return _from_state, (self.to_tuple(), self._extras)
+
+    def __repr__(self):
+        return f"InvoiceRecord({self.to_dict()!r})"
+
+
+def column_values(registros, coluna):
+    """ Valores de uma coluna (campo ou extra) numa lista de InvoiceRecord, None onde faltar. """
+    slot = _SLOT_OF.get(coluna)
+    if slot is not None:
+        return list(map(attrgetter(slot), registros))
+    return [r.get(coluna) for r in registros]
+
+
+def as_record(dados):
+    """ O próprio registro, ou um InvoiceRecord com os dados de um dict (ex.: lido de JSON). """
+    return dados if isinstance(dados, InvoiceRecord) else InvoiceRecord(dados)
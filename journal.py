@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+journal.py
+Diário (JSONL, somente acréscimo) dos registros finais de uma execução longa.
+Cada arquivo concluído vira uma linha gravada com flush + fsync, de modo que uma queda da máquina
+perde no máximo o arquivo em andamento. No modo de retomada, load_journal devolve os registros já
+concluídos e run_extraction processa apenas o restante.
+Formato da linha: {"caminho": ..., "tamanho": ..., "mtime": ..., "registro": {...}}
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from invoice_record import InvoiceRecord
+
+
+def _chave(pdf_path):
+    return str(Path(pdf_path).resolve())
+
+
+def default_journal_path(output_file):
+    """ Diário ao lado do arquivo de saída: <saida>.journal.jsonl """
+    return str(output_file) + ".journal.jsonl"
+
+
+class ResultJournal:
+    """
+    Diário de resultados.
+        with ResultJournal(caminho, resume=True) as journal:
+            journal.append(pdf_path, dados_fatura)
+    resume=False começa um diário novo; um diário anterior não vazio (ex.: de uma execução que caiu) é
+    preservado, renomeado para <diário>.<data-hora>.
+    """
+
+    def __init__(self, path, resume=False, fsync=True):
+        self.path = str(path)
+        self.fsync = fsync
+        self.count = 0
+        self._lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        precisa_quebra = False
+        if not resume and os.path.exists(self.path) and os.path.getsize(self.path):
+            anterior = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+            os.replace(self.path, anterior)
+            logging.warning(f"[Journal] Diário anterior preservado em '{anterior}' (use a retomada para aproveitá-lo).")
+        if resume and os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                precisa_quebra = f.read(1) != b"\n" # Última linha truncada por uma queda
+        self._file = open(self.path, "a", encoding="utf-8")
+        if precisa_quebra:
+            self._file.write("\n")
+
+    def append(self, pdf_path, registro):
+        st = Path(pdf_path).stat()
+        linha = json.dumps({"caminho": _chave(pdf_path), "tamanho": st.st_size, "mtime": st.st_mtime,
+                            "registro": dict(registro)}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(linha + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def load_journal(path, pdf_files, retry_errors=True):
+    """
+    Registros já concluídos de um diário, para os arquivos de pdf_files: {pdf_path: registro}.
+    Entradas de arquivos alterados desde então (tamanho/mtime) são ignoradas, assim como linhas
+    corrompidas. Com retry_errors, registros com ERRO são reprocessados.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    por_chave = {_chave(p): p for p in pdf_files}
+    concluidos = {}
+    invalidas = 0
+    with open(path, encoding="utf-8") as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                entrada = json.loads(linha)
+                pdf_path = por_chave.get(entrada["caminho"])
+                registro = entrada["registro"]
+            except (ValueError, KeyError, TypeError):
+                invalidas += 1
+                continue
+            if pdf_path is None:
+                continue
+            st = pdf_path.stat()
+            if entrada.get("tamanho") != st.st_size or entrada.get("mtime") != st.st_mtime:
+                continue
+            if retry_errors and registro.get("ERRO"):
+                concluidos.pop(pdf_path, None)
+                continue
+            concluidos[pdf_path] = InvoiceRecord(registro)
+    if invalidas:
+        logging.warning(f"[Journal] {invalidas} linha(s) inválida(s) ignorada(s) em '{path}'.")
+    logging.info(f"[Journal] {len(concluidos)} arquivo(s) já concluído(s) em '{path}'.")
+    return concluidos
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+layout_templates.py
+Modelos de layout aprendidos para as faturas digitais (script_digital). Cada layout é identificado por uma
+impressão digital: emissor + tamanho da página + posições (em grade de EXTRATOR_TEMPLATE_GRID pt) dos
+primeiros rótulos-âncora do cabeçalho + assinatura das regras de campo. Na primeira extração completa de
+um layout que valida (importes conferem), a região onde cada campo foi lido fica guardada; as faturas
+seguintes com a mesma impressão digital são lidas direto nessas regiões, sem procurar rótulos. Se a
+leitura direta não validar, o extrator volta à busca completa e o modelo é reaprendido; depois de
+EXTRATOR_TEMPLATE_MAX_FAILURES falhas seguidas o layout fica desativado (sempre busca completa).
+Regiões dos importes ficam relativas à âncora TOTALS (o bloco de totais desce com o número de itens);
+as demais, em coordenadas da página.
+Configuração: EXTRATOR_TEMPLATES (0 desativa), EXTRATOR_TEMPLATES_DB (caminho), EXTRATOR_TEMPLATE_MAX_FAILURES.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+TEMPLATES_ENABLED = os.environ.get("EXTRATOR_TEMPLATES", "1") == "1"
+TEMPLATES_PATH = os.environ.get("EXTRATOR_TEMPLATES_DB") or str(Path.home() / ".extratorfaturas" / "layout_templates.sqlite")
+TEMPLATE_GRID_PT = float(os.environ.get("EXTRATOR_TEMPLATE_GRID", "4"))
+TEMPLATE_MAX_FAILURES = int(os.environ.get("EXTRATOR_TEMPLATE_MAX_FAILURES", "3"))
+
+
+def layout_fingerprint(emisor, page_size, anchors, rules_signature=""):
+    """
+    Impressão digital do layout.
+    - emisor: nome do emissor (normalizado aqui: minúsculas, espaços simples)
+    - page_size: (largura, altura) da página em pt
+    - anchors: [(rótulo, x0, y0)] da primeira ocorrência dos rótulos-âncora usados
+    - rules_signature: muda quando as regras de campo mudam (modelos antigos deixam de casar)
+    """
+    h = hashlib.sha256(" ".join(str(emisor).lower().split()).encode())
+    h.update(f"|{round(page_size[0])}x{round(page_size[1])}|{rules_signature}".encode())
+    for label, x0, y0 in sorted(anchors):
+        h.update(f"|{label}@{round(x0 / TEMPLATE_GRID_PT)},{round(y0 / TEMPLATE_GRID_PT)}".encode())
+    return h.hexdigest()[:16]
+
+
+class TemplateStore:
+    """
+    Modelos de layout persistidos em SQLite.
+        store = TemplateStore()
+        campos = store.get(fp)            # {campo: {"rect": [x0, y0, x1, y1], "ancora_y": y ou None}} ou None
+        store.put(fp, "Endesa Energía, S.A.U.", campos, "fatura.pdf")
+        store.record_success(fp)          # leitura direta validou: zera as falhas seguidas
+        store.record_failure(fp)          # não validou: modelo descartado até ser reaprendido
+        store.close()
+    Um layout com max_failures falhas seguidas fica desativado: get devolve None e put não o reaprende.
+    Pode ser usado por várias threads (lock) e por vários processos (WAL + timeout). Modelos lidos ficam
+    em memória; os aprendidos por outros processos são vistos na primeira consulta que não os tiver.
+    """
+
+    def __init__(self, path=None, max_failures=None):
+        self.path = path or TEMPLATES_PATH
+        self.max_failures = max(1, max_failures or TEMPLATE_MAX_FAILURES)
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.learned = 0
+        self.disabled = 0
+        self._memo = {} # fingerprint -> [campos, falhas seguidas]
+        self._lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS layouts (
+                fingerprint TEXT PRIMARY KEY, emisor TEXT, campos TEXT NOT NULL, arquivo TEXT,
+                criado REAL NOT NULL, falhas INTEGER NOT NULL DEFAULT 0);
+        """)
+        self._conn.commit()
+
+    def get(self, fingerprint):
+        """ Campos do modelo do layout, ou None (sem modelo ou layout desativado). """
+        with self._lock:
+            memo = self._memo.get(fingerprint)
+            if memo is None:
+                row = self._conn.execute("SELECT campos, falhas FROM layouts WHERE fingerprint = ? AND falhas < ?",
+                                         (fingerprint, self.max_failures)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                memo = self._memo[fingerprint] = [json.loads(row[0]), row[1]]
+            self.hits += 1
+        return memo[0]
+
+    def put(self, fingerprint, emisor, campos, arquivo=None):
+        """ Guarda (ou substitui) o modelo do layout; layouts desativados não são reaprendidos. Retorna True se guardou. """
+        dados = json.dumps(campos, ensure_ascii=False)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO layouts (fingerprint, emisor, campos, arquivo, criado) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(fingerprint) DO UPDATE SET campos = excluded.campos, arquivo = excluded.arquivo, criado = excluded.criado "
+                "WHERE layouts.falhas < ?",
+                (fingerprint, emisor, dados, arquivo, time.time(), self.max_failures))
+            self._conn.commit()
+            if cursor.rowcount < 1:
+                return False
+            self._memo.pop(fingerprint, None) # Relido na próxima consulta, com as falhas seguidas atuais
+            self.learned += 1
+        return True
+
+    def record_success(self, fingerprint):
+        """ Leitura direta validou: zera as falhas seguidas (só grava se havia alguma). """
+        with self._lock:
+            memo = self._memo.get(fingerprint)
+            if memo is None or not memo[1]:
+                return
+            self._conn.execute("UPDATE layouts SET falhas = 0 WHERE fingerprint = ?", (fingerprint,))
+            self._conn.commit()
+            memo[1] = 0
+
+    def record_failure(self, fingerprint):
+        """
+        Conta a falha da leitura direta (coluna falhas) e tira o modelo da memória. Retorna True se o layout
+        chegou a max_failures falhas seguidas e foi desativado.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE layouts SET falhas = falhas + 1 WHERE fingerprint = ?", (fingerprint,))
+            row = self._conn.execute("SELECT falhas FROM layouts WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            self._conn.commit()
+            self._memo.pop(fingerprint, None)
+            self.failures += 1
+            desativado = row is not None and row[0] == self.max_failures
+            if desativado:
+                self.disabled += 1
+        return desativado
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "failures": self.failures, "learned": self.learned,
+                "disabled": self.disabled}
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -5,21 +5,31 @@ main_processor.py
 Script principal com interface Tkinter para selecionar pasta de PDFs e arquivo de saída,
 e extrair dados usando script_digital.py ou script_ocr.py conforme tipo de fatura.
 """
-import tkinter as tk
-from tkinter import filedialog, messagebox, Listbox, Scrollbar
+import time
+_T_INICIO = time.perf_counter() # Referência para as medições de startup
+
 import threading
 import os
+import multiprocessing
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 import logging
-import fitz  # PyMuPDF
-import pandas as pd
-import numpy
-import paddleocr
+from pdf_context import PdfContext
+from journal import ResultJournal, load_journal, default_journal_path
+from output_sinks import OrderedWriter, open_sink
+from invoice_record import InvoiceRecord
+import metrics
+import classifier
+# pandas e paddleocr são importados sob demanda (gravação do Excel / primeiro PDF OCR)
+# tkinter só é importado pelas funções da GUI (o modo de linha de comando, cli.py, não o carrega)
 
 
 # Import módulos de extração
 import script_digital  # Seu script para faturas digitais
-import script_ocr    # Seu script para faturas OCR
+import script_ocr    # Seu script para faturas OCR (o engine PaddleOCR é carregado no primeiro uso)
 
 # Configuração logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(funcName)s - %(message)s')
@@ -32,9 +42,57 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+# Número padrão de processos para a extração em paralelo
+DEFAULT_JOBS = os.cpu_count() or 1
+
+# Pré-carregamento do PaddleOCR em segundo plano após a janela abrir (opcional: EXTRATOR_OCR_WARMUP=1).
+# Só ajuda a extração com 1 worker: os processos do pool carregam o próprio engine.
+OCR_WARMUP = os.environ.get("EXTRATOR_OCR_WARMUP", "0") == "1"
+
+# Modo pipeline (estágios sobrepostos com filas limitadas): EXTRATOR_PIPELINE=1
+# Profundidade das filas de entrada dos estágios detecção/renderização, OCR e parse/saída
+USE_PIPELINE = os.environ.get("EXTRATOR_PIPELINE", "0") == "1"
+
+
+def _profundidades_filas(valor, padrao=(8, 2, 8)):
+    """ EXTRATOR_PIPELINE_QUEUES: três inteiros >= 1 separados por vírgula; valor inválido usa o padrão. """
+    try:
+        profundidades = [int(d) for d in valor.split(",")]
+    except (AttributeError, ValueError):
+        profundidades = []
+    if len(profundidades) != len(padrao) or min(profundidades) < 1:
+        logging.warning(f"EXTRATOR_PIPELINE_QUEUES inválido ({valor!r}); usando {','.join(map(str, padrao))}.")
+        return list(padrao)
+    return profundidades
+
+
+PIPELINE_QUEUE_DEPTHS = _profundidades_filas(os.environ.get("EXTRATOR_PIPELINE_QUEUES", "8,2,8"))
+PIPELINE_STATS = None # Ocupação por estágio da última execução em modo pipeline
+# Pool OCR: arquivos iniciados à frente do primeiro ainda não gravado (limite dos registros adiantados em memória)
+OUTPUT_REORDER_WINDOW = int(os.environ.get("EXTRATOR_REORDER_WINDOW", "256"))
+# Cache de resultados por conteúdo do PDF (result_cache); EXTRATOR_CACHE=0 desativa
+USE_CACHE = os.environ.get("EXTRATOR_CACHE", "1") == "1"
+CACHE_STATS = {} # hits/misses da última execução
+# Métricas da última execução (metrics.RunMetrics.summary) e exportação opcional ao final de cada execução
+RUN_METRICS = {}
+METRICS_JSON_PATH = os.environ.get("EXTRATOR_METRICS_JSON")
+METRICS_PROM_PATH = os.environ.get("EXTRATOR_METRICS_PROM")
+
+# Tempos de inicialização por fase (segundos)
+STARTUP_TIMINGS = {}
+
+def registrar_fase_startup(fase: str, inicio: float):
+    """ Registra e loga a duração de uma fase de inicialização. """
+    STARTUP_TIMINGS[fase] = time.perf_counter() - inicio
+    logging.info(f"[Startup] {fase}: {STARTUP_TIMINGS[fase] * 1000:.0f} ms")
+
+registrar_fase_startup("imports", _T_INICIO)
+
 # Variáveis de controle globais para GUI
 pasta_pdfs_var = None
 arquivo_saida_var = None
+jobs_var = None
+resume_var = None
 file_listbox = None
 status_label = None
 root = None # Adicionado para acesso global, se necessário para root.update_idletasks()
@@ -43,6 +101,7 @@ root = None # Adicionado para acesso global, se necessário para root.update_idl
 
 def selecionar_pasta_pdfs():
     global pasta_pdfs_var, file_listbox # Assegura que estamos usando as globais
+    from tkinter import filedialog
     folder = filedialog.askdirectory(title="Select the PDFs folder")
     if folder:
         pasta_pdfs_var.set(folder)
@@ -50,14 +109,18 @@ def selecionar_pasta_pdfs():
 
 def selecionar_arquivo_saida():
     global arquivo_saida_var # Assegura que estamos usando a global
+    from tkinter import filedialog
     file = filedialog.asksaveasfilename(defaultextension=".xlsx",
-                                       filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")],
+                                       filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv"),
+                                                  ("Parquet files", "*.parquet"), ("All files", "*.*")],
                                        title="Salvar resultados como")
     if file:
         arquivo_saida_var.set(file)
 
 def atualizar_listbox(folder_path):
     global file_listbox # Assegura que estamos usando a global
+    import tkinter as tk
+    from tkinter import messagebox
     if file_listbox:
         file_listbox.delete(0, tk.END)
         try:
@@ -69,10 +132,13 @@ def atualizar_listbox(folder_path):
 
 
 def iniciar_extracao_gui():
-    global pasta_pdfs_var, arquivo_saida_var, status_label # Assegura que estamos usando as globais
+    global pasta_pdfs_var, arquivo_saida_var, jobs_var, resume_var, status_label # Assegura que estamos usando as globais
+    from tkinter import messagebox
 
     folder = pasta_pdfs_var.get().strip()
     output_file_path = arquivo_saida_var.get().strip()
+    jobs = resolve_jobs(jobs_var.get().strip() if jobs_var else None)
+    resume = bool(resume_var.get()) if resume_var else False
 
     if not folder or not os.path.isdir(folder):
         messagebox.showerror("Input Error", "Please select a valid PDFs folder.")
@@ -87,76 +153,53 @@ def iniciar_extracao_gui():
         root.update_idletasks()
 
     # Executa a extração em uma thread separada para não bloquear a GUI
-    thread = threading.Thread(target=run_extraction_wrapper, args=(folder, output_file_path), daemon=True)
+    thread = threading.Thread(target=run_extraction_wrapper, args=(folder, output_file_path, jobs, resume), daemon=True)
     thread.start()
 
 
-def detect_pdf_type(pdf_path: Path) -> str:
+def detect_pdf_type(pdf_path: Path, ctx=None) -> str:
     """
     Detecta se um PDF é primariamente 'Digital' (baseado em texto) ou requer 'OCR' (imagem).
-    Critérios atuais:
-    - Digital: se a primeira página tiver mais de 100 "palavras" (blocos de texto).
-    - OCR: se a primeira página tiver mais de 2 imagens E menos de 50 "palavras".
-    - Fallback: 'Digital' (pode ser ajustado para 'OCR' se for um fallback mais seguro).
+    A decisão fica com classifier.classify: sinais baratos da primeira página (fontes, texto bruto do
+    content stream, cobertura de imagens, producer/creator) e, só se forem ambíguos, a análise completa
+    por blocos de texto (limiares 70/20).
+    ctx: PdfContext já aberto (opcional). A página 0 e seus blocos ficam cacheados para o extrator.
     """
+    pdf_path = Path(pdf_path)
     try:
-        doc = fitz.open(str(pdf_path)) # fitz.open aceita string ou Path
-        if not doc.page_count:
-            logging.warning(f"PDF sem páginas: {pdf_path.name}. Assumindo OCR.")
-            doc.close()
-            return 'OCR'
-
-        page = doc.load_page(0)  # Analisa apenas a primeira página para rapidez
-        
-        # Usar get_text("blocks") pode ser mais robusto que "words" para contar unidades de texto significativas
-        # blocks retorna tuplas (x0, y0, x1, y1, "text", block_no, block_type)
-        # block_type = 0 para texto, 1 para imagem
-        text_blocks = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
-        num_text_elements = len(text_blocks) # Conta blocos de texto não vazios
-
-        images = page.get_images(full=True)
-        num_images = len(images)
-        doc.close()
-
-        logging.debug(f"Análise de {pdf_path.name}: Text Elements={num_text_elements}, Images={num_images}")
-
-        # Critérios de decisão 
-        if num_text_elements > 70:  # Se tiver bastante texto, é provável que seja digital
-            logging.info(f"Arquivo '{pdf_path.name}' detectado como: Digital (textos: {num_text_elements})")
-            return 'Digital'
-        if num_images > 0 and num_text_elements < 20: # Se tiver imagens e muito pouco texto
-            logging.info(f"Arquivo '{pdf_path.name}' detectado como: OCR (textos: {num_text_elements}, imagens: {num_images})")
-            return 'OCR'
-        
-        
-        if num_text_elements >= 20 :
-             logging.info(f"Arquivo '{pdf_path.name}' detectado como: Digital (fallback - algum texto: {num_text_elements})")
-             return 'Digital'
-
-        logging.info(f"Arquivo '{pdf_path.name}' detectado como: OCR (fallback final - pouco texto: {num_text_elements})")
-        return 'OCR' # Fallback final para OCR se muito pouco texto
-
+        tipo, motivo, _ = classifier.classify(pdf_path, ctx)
+        logging.info(f"Arquivo '{pdf_path.name}' detectado como: {tipo} ({motivo})")
+        return tipo
     except Exception as e:
         logging.error(f"Erro ao detectar tipo do PDF '{pdf_path.name}': {e}. Assumindo OCR como fallback.")
-        if doc: # Garante que o documento seja fechado se a exceção ocorrer após a abertura
-            doc.close()
         return 'OCR' # Fallback em caso de erro na detecção
 
-def run_extraction_wrapper(folder, output_file):
+def run_extraction_wrapper(folder, output_file, jobs=None, resume=False):
     """ Wrapper para chamar run_extraction e atualizar a GUI no final """
     global status_label
+    from tkinter import messagebox
     try:
-        all_results = run_extraction(folder, output_file)
-
-        # Salvar Excel
-        if all_results: # Somente salva se houver resultados (mesmo que sejam erros)
-            df = pd.DataFrame(all_results)
-            df.to_excel(output_file, index=False, engine='openpyxl')
-            success_msg = f"Extraction completed! {len(all_results)} files processed. Saved to: {output_file}"
+        # Saída gravada linha a linha durante a extração (formato pela extensão: .xlsx, .csv ou .parquet)
+        sink = open_sink(output_file)
+        try:
+            resumo = run_extraction(folder, output_file, jobs=jobs, resume=resume, sink=sink)
+        except Exception:
+            sink.close()
+            raise
+
+        if resumo.get("files"): # Somente salva se houver resultados (mesmo que sejam erros)
+            sink.close()
+            # Saída gravada: o diário da execução não é mais necessário
+            try:
+                os.remove(default_journal_path(output_file))
+            except OSError:
+                pass
+            success_msg = f"Extraction completed! {resumo['files']} files processed. Saved to: {output_file}"
             logging.info(success_msg)
             status_label.config(text="Extraction completed!", fg="green")
             messagebox.showinfo("Completed", success_msg)
         else:
+            sink.discard()
             info_msg = "No PDF file found or processed in the folder."
             logging.info(info_msg)
             status_label.config(text=info_msg, fg="orange")
@@ -169,87 +212,715 @@ def run_extraction_wrapper(folder, output_file):
         messagebox.showerror("Critical Error", error_msg)
 
 
-def run_extraction(folder_path_str: str, output_file_path_str: str) -> list:
+def novo_registro(pdf_path: Path) -> InvoiceRecord:
+    return InvoiceRecord({"ARQUIVO": pdf_path.name, "SOURCE_DETECTION": "Indefinido", "SOURCE_EXTRACTION": "Nenhum"})
+
+
+def aplicar_resultado_digital(dados_fatura: InvoiceRecord, extracted_data_digital):
+    """ Combina o resultado de script_digital.extract_invoice_fields no registro do arquivo. """
+    if extracted_data_digital:
+        dados_fatura.merge(extracted_data_digital) # Combina os campos preenchidos
+        dados_fatura["SOURCE_EXTRACTION"] = "Digital"
+    else:
+        dados_fatura["ERRO"] = "Extrator digital não retornou dados."
+        dados_fatura["SOURCE_EXTRACTION"] = "Digital (Falhou)"
+
+
+def aplicar_resultado_ocr(dados_fatura: InvoiceRecord, extracted_data_ocr):
+    """ Combina o resultado de script_ocr.processar_pdf_ocr no registro do arquivo. """
+    if extracted_data_ocr:
+        dados_fatura.merge(extracted_data_ocr)
+        dados_fatura["SOURCE_EXTRACTION"] = "OCR"
+    else:
+        dados_fatura["ERRO"] = "Extrator OCR não retornou dados."
+        dados_fatura["SOURCE_EXTRACTION"] = "OCR (Falhou)"
+
+
+def finalizar_registro(dados_fatura: InvoiceRecord):
+    # Verifica se houve um erro durante a extração, mesmo que os dados tenham sido parcialmente preenchidos
+    if "ERRO" in dados_fatura and dados_fatura.get("ERRO"):
+         logging.warning(f"Processado com erro {dados_fatura['ARQUIVO']}: {dados_fatura['ERRO']}")
+    else:
+         logging.info(f"{dados_fatura['ARQUIVO']} processado com sucesso via {dados_fatura['SOURCE_EXTRACTION']}.")
+
+
+def process_single_pdf(pdf_path, tipo_fatura=None) -> InvoiceRecord:
     """
-    Processa os PDFs em uma pasta, detecta seu tipo e chama o script de extração apropriado.
+    Detecta o tipo e extrai os dados de um único PDF.
+    Função de nível de módulo para poder ser enviada aos processos do pool em run_extraction.
+    tipo_fatura: 'Digital'/'OCR' já conhecido (pula a detecção).
+    Nunca levanta exceção: erros são registrados no próprio dicionário de resultado.
+    Os tempos por estágio voltam no registro (colunas T_*_MS de metrics).
     """
-    global status_label, root # Para atualizar a GUI
+    inicio = time.perf_counter()
+    with metrics.collecting() as tempos:
+        dados_fatura = _process_single_pdf(Path(pdf_path), tipo_fatura)
+    return metrics.attach(dados_fatura, tempos, time.perf_counter() - inicio)
 
-    all_extracted_data = []
-    folder_path = Path(folder_path_str)
-    pdf_files = sorted(list(folder_path.glob("*.pdf")))
 
-    if not pdf_files:
-        logging.warning(f"Nenhum arquivo PDF encontrado em '{folder_path_str}'.")
-        return all_extracted_data
+def _process_single_pdf(pdf_path: Path, tipo_fatura=None) -> InvoiceRecord:
+    dados_fatura = novo_registro(pdf_path)
 
-    logging.info(f"Iniciando extração para {len(pdf_files)} arquivos em '{folder_path_str}'.")
+    # Abre o PDF uma única vez: detecção e extrator compartilham o documento e a página 0
+    ctx = None
+    try:
+        with metrics.stage("abrir"):
+            ctx = PdfContext(pdf_path)
+    except Exception as e:
+        logging.error(f"Não foi possível abrir '{pdf_path.name}': {e}")
 
+    try:
+        if tipo_fatura is None:
+            with metrics.stage("deteccao"):
+                tipo_fatura = detect_pdf_type(pdf_path, ctx=ctx)
+        dados_fatura["SOURCE_DETECTION"] = tipo_fatura
+
+        if tipo_fatura == 'Digital':
+            logging.info(f"Chamando script_digital para: {pdf_path.name}")
+            # Seu script_digital.py tem extract_invoice_fields(pdf_path)
+            with metrics.stage("extracao_digital"):
+                extracted_data_digital = script_digital.extract_invoice_fields(str(pdf_path), ctx=ctx)
+            aplicar_resultado_digital(dados_fatura, extracted_data_digital)
+
+        elif tipo_fatura == 'OCR':
+            logging.info(f"Chamando script_ocr para: {pdf_path.name}")
+            # Suposição: script_ocr.py tem processar_pdf_ocr(pdf_path)
+            # Ajuste o nome da função se for diferente no seu script_ocr.py
+            extracted_data_ocr = script_ocr.processar_pdf_ocr(str(pdf_path), ctx=ctx)
+            aplicar_resultado_ocr(dados_fatura, extracted_data_ocr)
+        else:
+            # Caso detect_pdf_type retorne algo inesperado (não deveria acontecer com a lógica atual)
+            logging.error(f"Tipo de fatura desconhecido '{tipo_fatura}' para {pdf_path.name}.")
+            dados_fatura["ERRO"] = f"Tipo de detecção desconhecido: {tipo_fatura}"
+
+        finalizar_registro(dados_fatura)
+
+    except Exception as e:
+        logging.error(f"Exceção ao processar o arquivo '{pdf_path.name}': {e}", exc_info=True)
+        dados_fatura["ERRO"] = f"Exceção: {str(e)}"
+        dados_fatura["SOURCE_EXTRACTION"] = "Falha Geral"
+    finally:
+        if ctx:
+            ctx.close()
+
+    return dados_fatura
+
+
+def _registro_falha_worker(pdf_path: Path, erro) -> InvoiceRecord:
+    """ Registro de saída para um arquivo cujo processo do pool falhou (ex.: crash do worker). """
+    return InvoiceRecord({
+        "ARQUIVO": pdf_path.name,
+        "SOURCE_DETECTION": "Indefinido",
+        "SOURCE_EXTRACTION": "Falha Geral",
+        "ERRO": f"Falha no worker: {erro}",
+    })
+
+
+def _atualizar_status(msg: str):
+    """ Atualiza o status da GUI, se ela existir. """
+    if status_label and root:
+        status_label.config(text=msg, fg="blue")
+        root.update_idletasks() # Força a atualização da GUI
+
+
+def resolve_jobs(jobs=None) -> int:
+    """ Normaliza o número de workers: None/0 usa DEFAULT_JOBS (núcleos da máquina). """
+    try:
+        jobs = int(jobs) if jobs else DEFAULT_JOBS
+    except (TypeError, ValueError):
+        logging.warning(f"Valor inválido para jobs: {jobs!r}. Usando {DEFAULT_JOBS}.")
+        jobs = DEFAULT_JOBS
+    return max(1, jobs)
+
+
+# Os executores abaixo entregam cada registro a on_result(pdf_path, dados_fatura) assim que ele fica
+# pronto e não guardam os registros: a memória não cresce com o número de arquivos.
+def _run_extraction_sequencial(pdf_files: list, tipos=None, on_result=None):
     for i, pdf_path in enumerate(pdf_files):
         current_file_msg = f"Processando {i+1}/{len(pdf_files)}: {pdf_path.name}"
         logging.info(current_file_msg)
-        if status_label and root:
-            status_label.config(text=current_file_msg, fg="blue")
-            root.update_idletasks() # Força a atualização da GUI
+        _atualizar_status(current_file_msg)
+        dados_fatura = process_single_pdf(pdf_path, tipos[i] if tipos else None)
+        if on_result:
+            on_result(pdf_path, dados_fatura)
 
-        dados_fatura = {"ARQUIVO": pdf_path.name, "SOURCE_DETECTION": "Indefinido", "SOURCE_EXTRACTION": "Nenhum"}
-        
-        try:
-            tipo_fatura = detect_pdf_type(pdf_path)
-            dados_fatura["SOURCE_DETECTION"] = tipo_fatura
 
-            if tipo_fatura == 'Digital':
-                logging.info(f"Chamando script_digital para: {pdf_path.name}")
-                # Seu script_digital.py tem extract_invoice_fields(pdf_path)
-                extracted_data_digital = script_digital.extract_invoice_fields(str(pdf_path))
-                if extracted_data_digital:
-                    dados_fatura.update(extracted_data_digital) # Combina os dicionários
-                    dados_fatura["SOURCE_EXTRACTION"] = "Digital"
-                else:
-                    dados_fatura["ERRO"] = "Extrator digital não retornou dados."
-                    dados_fatura["SOURCE_EXTRACTION"] = "Digital (Falhou)"
-            
-            elif tipo_fatura == 'OCR':
-                logging.info(f"Chamando script_ocr para: {pdf_path.name}")
-                # Suposição: script_ocr.py tem processar_pdf_ocr(pdf_path)
-                # Ajuste o nome da função se for diferente no seu script_ocr.py
-                extracted_data_ocr = script_ocr.processar_pdf_ocr(str(pdf_path))
-                if extracted_data_ocr:
-                    dados_fatura.update(extracted_data_ocr)
-                    dados_fatura["SOURCE_EXTRACTION"] = "OCR"
-                else:
-                    dados_fatura["ERRO"] = "Extrator OCR não retornou dados."
-                    dados_fatura["SOURCE_EXTRACTION"] = "OCR (Falhou)"
+def _run_extraction_paralelo(pdf_files: list, jobs: int, tipos=None, on_result=None):
+    """
+    Processa os PDFs em um pool de processos, entregando cada registro na ordem de conclusão.
+    Se um worker morrer (BrokenProcessPool), os arquivos pendentes são reenviados a um pool novo;
+    se uma rodada não avançar, o primeiro pendente é processado isolado para identificar o culpado.
+    """
+    concluidos = set() # Índices entregues; os registros não ficam guardados
+    pendentes = list(range(len(pdf_files)))
+    total = len(pdf_files)
+
+    def _entregar(idx, dados_fatura):
+        concluidos.add(idx)
+        if on_result:
+            on_result(pdf_files[idx], dados_fatura)
+        _atualizar_status(f"Processados {len(concluidos)}/{total} (workers: {jobs})")
+
+    def _coletar(futures):
+        for future in as_completed(futures):
+            idx = futures.pop(future) # Solta o futuro (e o registro que ele guarda) assim que é entregue
+            try:
+                dados_fatura = future.result()
+            except BrokenProcessPool:
+                continue # Continua pendente, será reenviado
+            except Exception as e:
+                logging.error(f"Falha no worker ao processar '{pdf_files[idx].name}': {e}", exc_info=True)
+                dados_fatura = _registro_falha_worker(pdf_files[idx], e)
+            _entregar(idx, dados_fatura)
+
+    while pendentes:
+        antes = len(concluidos)
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pendentes))) as executor:
+            futures = {executor.submit(process_single_pdf, str(pdf_files[i]), tipos[i] if tipos else None): i for i in pendentes}
+            _coletar(futures)
+        pendentes = [i for i in pendentes if i not in concluidos]
+
+        if pendentes and len(concluidos) == antes:
+            # Nenhum progresso: isola o primeiro pendente num pool próprio
+            idx = pendentes.pop(0)
+            logging.warning(f"Pool interrompido sem progresso. Processando '{pdf_files[idx].name}' isoladamente.")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                futures = {executor.submit(process_single_pdf, str(pdf_files[idx]), tipos[idx] if tipos else None): idx}
+                _coletar(futures)
+            if idx not in concluidos:
+                _entregar(idx, _registro_falha_worker(pdf_files[idx], "processo encerrado inesperadamente"))
+        elif pendentes:
+            logging.warning(f"Pool de processos interrompido. Reenviando {len(pendentes)} arquivo(s) pendente(s).")
+
+
+def _run_extraction_com_pool_ocr(pdf_files: list, jobs: int, ocr_workers: int, tipos=None, on_result=None):
+    """
+    Detecta o tipo de todos os PDFs e envia os de OCR ao OcrWorkerPool (modelos já carregados em cada worker),
+    enquanto os digitais são extraídos em paralelo (process_single_pdf num pool de jobs processos). Cada registro
+    vai a on_result quando fica pronto; só são iniciados arquivos até OUTPUT_REORDER_WINDOW posições à frente do
+    primeiro ainda não entregue, para que a saída em ordem não acumule registros adiantados.
+    Se um worker morrer (BrokenProcessPool), o pool é recriado e cada PDF das tarefas interrompidas é
+    reenviado sozinho, até OCR_TASK_RETRIES vezes; um pool sem nenhum lote concluído em OCR_TASK_TIMEOUT
+    segundos é encerrado e os lotes pendentes falham.
+    """
+    from ocr_pool import OcrWorkerPool, OCR_TASK_TIMEOUT, OCR_TASK_RETRIES, OCR_FILES_PER_BATCH
+
+    # Detecção no processo principal; o tempo é somado ao registro de cada arquivo quando ele termina
+    tempos_deteccao = {}
+    if not tipos:
+        tipos = []
+        for p in pdf_files:
+            inicio = time.perf_counter()
+            tipos.append(detect_pdf_type(p))
+            tempos_deteccao[Path(p)] = time.perf_counter() - inicio
+
+    idx_ocr = [i for i, t in enumerate(tipos) if t == 'OCR']
+    idx_outros = deque(i for i, t in enumerate(tipos) if t != 'OCR')
+    jobs_outros = min(jobs, len(idx_outros))
+
+    # Janela de reordenação: nenhum arquivo com índice além de base + OUTPUT_REORDER_WINDOW é iniciado, onde
+    # base é o primeiro índice ainda não entregue. Assim o OrderedWriter nunca guarda mais que a janela de
+    # registros adiantados (ex.: digitais prontos esperando o OCR do arquivo 0).
+    janela = max(1, OUTPUT_REORDER_WINDOW)
+    posicoes = {Path(p): i for i, p in enumerate(pdf_files)}
+    entregues = set()
+    base = 0
+    total_entregues = 0
+
+    def _concluido(pdf_path, dados_fatura):
+        nonlocal base, total_entregues
+        segundos = tempos_deteccao.get(Path(pdf_path))
+        if segundos is not None:
+            dados_fatura["T_DETECCAO_MS"] = round(segundos * 1000, 2)
+            dados_fatura["T_TOTAL_MS"] = round(dados_fatura.get("T_TOTAL_MS", 0) + segundos * 1000, 2)
+        if on_result:
+            on_result(pdf_path, dados_fatura)
+        entregues.add(posicoes[Path(pdf_path)])
+        total_entregues += 1
+        while base in entregues:
+            entregues.discard(base)
+            base += 1
+
+    concluidos_ocr = 0
+
+    def _entregar_lote(lote, extraidos_lote, erro_lote=None):
+        nonlocal concluidos_ocr
+        for i, extracted_data_ocr in zip(lote, extraidos_lote or [None] * len(lote)):
+            dados_fatura = novo_registro(pdf_files[i])
+            if erro_lote is not None:
+                dados_fatura.update(_registro_falha_worker(pdf_files[i], erro_lote))
             else:
-                # Caso detect_pdf_type retorne algo inesperado (não deveria acontecer com a lógica atual)
-                logging.error(f"Tipo de fatura desconhecido '{tipo_fatura}' para {pdf_path.name}.")
-                dados_fatura["ERRO"] = f"Tipo de detecção desconhecido: {tipo_fatura}"
-            
-            # Verifica se houve um erro durante a extração, mesmo que os dados tenham sido parcialmente preenchidos
-            if "ERRO" in dados_fatura and dados_fatura.get("ERRO"):
-                 logging.warning(f"Processado com erro {pdf_path.name}: {dados_fatura['ERRO']}")
+                aplicar_resultado_ocr(dados_fatura, extracted_data_ocr)
+            dados_fatura["SOURCE_DETECTION"] = 'OCR'
+            finalizar_registro(dados_fatura)
+            _concluido(pdf_files[i], dados_fatura)
+        concluidos_ocr += len(lote)
+        _atualizar_status(f"OCR {concluidos_ocr}/{len(idx_ocr)} concluído(s)")
+
+    def _entregar_outro(i, dados_fatura):
+        _concluido(pdf_files[i], dados_fatura)
+        _atualizar_status(f"Processados {total_entregues}/{len(pdf_files)}")
+
+    # Lotes de OCR_FILES_PER_BATCH PDFs por tarefa: o reconhecimento roda em lote sobre todos os recortes
+    lotes = deque(idx_ocr[n:n + OCR_FILES_PER_BATCH] for n in range(0, len(idx_ocr), max(1, OCR_FILES_PER_BATCH)))
+    em_andamento = {} # Future -> ("ocr", lote) ou ("outro", índice)
+    reenvios = {} # Índice do PDF -> vezes que o worker dele morreu
+    executor_outros = ProcessPoolExecutor(max_workers=jobs_outros) if jobs_outros > 1 else None
+
+    def _enviar():
+        """ Envia os lotes OCR e os digitais que cabem na janela (digitais: até 2 por worker em andamento). """
+        while lotes and lotes[0][0] <= base + janela:
+            lote = lotes.popleft()
+            em_andamento[pool.submit_pdf_batch([pdf_files[i] for i in lote])] = ("ocr", lote)
+        if executor_outros is None:
+            return
+        em_voo = sum(1 for tipo, _ in em_andamento.values() if tipo == "outro")
+        while idx_outros and idx_outros[0] <= base + janela and em_voo < 2 * jobs_outros:
+            i = idx_outros.popleft()
+            em_andamento[executor_outros.submit(process_single_pdf, str(pdf_files[i]), tipos[i])] = ("outro", i)
+            em_voo += 1
+
+    def _reenviar(indices, motivo):
+        """ Reenvia PDFs de um pool recriado, cada um sozinho; falha os que já passaram de OCR_TASK_RETRIES. """
+        for tipo, i in indices:
+            reenvios[i] = reenvios.get(i, 0) + 1
+            if reenvios[i] > OCR_TASK_RETRIES:
+                logging.error(f"Worker morreu {reenvios[i]} vez(es) com '{pdf_files[i].name}'.")
+                if tipo == "ocr":
+                    _entregar_lote([i], None, motivo)
+                else:
+                    _entregar_outro(i, _registro_falha_worker(pdf_files[i], motivo))
+            elif tipo == "ocr":
+                em_andamento[pool.submit_pdf_batch([pdf_files[i]])] = ("ocr", [i])
             else:
-                 logging.info(f"{pdf_path.name} processado com sucesso via {dados_fatura['SOURCE_EXTRACTION']}.")
+                em_andamento[executor_outros.submit(process_single_pdf, str(pdf_files[i]), tipos[i])] = ("outro", i)
 
+    with OcrWorkerPool(processes=min(ocr_workers, len(idx_ocr)) or 1) as pool:
+        try:
+            while lotes or idx_outros or em_andamento:
+                _enviar()
+                # Com um só worker para os digitais, eles rodam aqui, entre as coletas dos lotes OCR
+                sequencial = executor_outros is None and idx_outros and idx_outros[0] <= base + janela
+                if sequencial:
+                    i = idx_outros.popleft()
+                    logging.info(f"Processando {pdf_files[i].name}")
+                    _entregar_outro(i, process_single_pdf(pdf_files[i], tipos[i]))
+                if not em_andamento:
+                    continue
+                prontos, _ = wait(em_andamento, timeout=0 if sequencial else OCR_TASK_TIMEOUT, return_when=FIRST_COMPLETED)
+                if not prontos:
+                    if sequencial:
+                        continue
+                    ocr_parados = [lote for tipo, lote in em_andamento.values() if tipo == "ocr"] + list(lotes)
+                    if not ocr_parados:
+                        continue
+                    logging.error(f"Pool OCR sem progresso em {OCR_TASK_TIMEOUT}s: {len(ocr_parados)} lote(s) falham.")
+                    pool.terminate()
+                    for pendente in [f for f, (tipo, _) in em_andamento.items() if tipo == "ocr"]:
+                        del em_andamento[pendente]
+                    lotes.clear()
+                    for lote in ocr_parados:
+                        _entregar_lote(lote, None, f"sem resposta em {OCR_TASK_TIMEOUT}s")
+                    continue
+                interrompidos_ocr, interrompidos_outros = [], []
+                for pendente in prontos:
+                    tipo, alvo = em_andamento.pop(pendente) # O resultado é solto depois de entregue
+                    try:
+                        resultado = pendente.result()
+                    except BrokenProcessPool:
+                        (interrompidos_ocr if tipo == "ocr" else interrompidos_outros).append((tipo, alvo))
+                        continue
+                    except Exception as e:
+                        nomes = [pdf_files[i].name for i in alvo] if tipo == "ocr" else pdf_files[alvo].name
+                        logging.error(f"Falha no worker ao processar {nomes}: {e}")
+                        if tipo == "ocr":
+                            _entregar_lote(alvo, None, e)
+                        else:
+                            _entregar_outro(alvo, _registro_falha_worker(pdf_files[alvo], e))
+                        continue
+                    if tipo == "ocr":
+                        _entregar_lote(alvo, resultado)
+                    else:
+                        _entregar_outro(alvo, resultado)
+                # Pool quebrado: as demais tarefas dele também falham; todos os PDFs delas vão, um a um, a um pool novo
+                if interrompidos_ocr:
+                    for pendente in [f for f, (tipo, _) in em_andamento.items() if tipo == "ocr"]:
+                        interrompidos_ocr.append(em_andamento.pop(pendente))
+                    pool.restart()
+                    indices = [("ocr", i) for _, lote in interrompidos_ocr for i in lote]
+                    logging.warning(f"Pool OCR interrompido. Reenviando {len(indices)} arquivo(s) pendente(s).")
+                    _reenviar(indices, "processo encerrado inesperadamente")
+                if interrompidos_outros:
+                    for pendente in [f for f, (tipo, _) in em_andamento.items() if tipo == "outro"]:
+                        interrompidos_outros.append(em_andamento.pop(pendente))
+                    executor_outros.shutdown(wait=False, cancel_futures=True)
+                    executor_outros = ProcessPoolExecutor(max_workers=jobs_outros)
+                    logging.warning(f"Pool de processos interrompido. Reenviando {len(interrompidos_outros)} arquivo(s) pendente(s).")
+                    _reenviar(interrompidos_outros, "processo encerrado inesperadamente")
+        finally:
+            if executor_outros is not None:
+                executor_outros.shutdown(wait=True, cancel_futures=True)
+
+def _run_extraction_pipeline(pdf_files: list, queue_depths=None, tipo_fatura=None, on_result=None, tipos=None):
+    """
+    Pipeline em streaming: descoberta -> detecção/renderização -> OCR -> parse/saída, cada estágio em
+    sua thread, ligados por filas limitadas (queue_depths). Todo o acesso ao PyMuPDF (detecção, extração
+    digital e renderização) fica no mesmo estágio; o OCR roda sobreposto à renderização do próximo arquivo.
+    A exceção são as páginas seguintes de faturas OCR incompletas (script_ocr.ocr_remaining_pages), lidas
+    no estágio de parse sob o mesmo lock do estágio de detecção/renderização.
+    Cada registro vai a on_result no estágio de parse; os itens não ficam guardados no fim do pipeline.
+    A ocupação por estágio fica em PIPELINE_STATS.
+    tipo_fatura: 'Digital'/'OCR' forçado para todos os arquivos (pula a detecção).
+    tipos: tipo já conhecido de cada arquivo (ex.: classifier.classify_many); None detecta no estágio.
+    """
+    global PIPELINE_STATS
+    from pipeline import StreamingPipeline
+    total = len(pdf_files)
+    if script_ocr.OCR_ROI_MODE:
+        logging.warning("EXTRATOR_OCR_ROI=1 não vale no modo pipeline: o OCR é feito na página inteira.")
+
+    tipo_forcado = tipo_fatura
+    fitz_lock = threading.Lock() # PyMuPDF não é thread-safe: detecção/renderização e páginas extras do OCR
+
+    def etapa_detectar_renderizar(item):
+        pdf_path = item["path"]
+        dados_fatura = item["dados"] = novo_registro(pdf_path)
+        item["tempos"] = {}
+        with metrics.collecting(item["tempos"]), fitz_lock:
+            _detectar_renderizar(item, pdf_path, dados_fatura)
+        return item
+
+    def _detectar_renderizar(item, pdf_path, dados_fatura):
+        ctx = None
+        try:
+            with metrics.stage("abrir"):
+                ctx = PdfContext(pdf_path)
+        except Exception as e:
+            logging.error(f"Não foi possível abrir '{pdf_path.name}': {e}")
+        try:
+            with metrics.stage("deteccao"):
+                tipo_fatura = tipo_forcado or item.get("tipo") or detect_pdf_type(pdf_path, ctx=ctx)
+            dados_fatura["SOURCE_DETECTION"] = tipo_fatura
+            if tipo_fatura == 'Digital':
+                with metrics.stage("extracao_digital"):
+                    extraido = script_digital.extract_invoice_fields(str(pdf_path), ctx=ctx)
+                aplicar_resultado_digital(dados_fatura, extraido)
+            elif tipo_fatura == 'OCR':
+                item["ocr"] = True
+                # Página no cache de OCR bruto: as linhas seguem direto para o parse, sem imagem
+                item["ocr_key"], linhas, item["img"] = script_ocr.prepare_page_ocr(str(pdf_path), ctx=ctx)
+                if linhas is not None:
+                    item["lines"] = linhas
         except Exception as e:
             logging.error(f"Exceção ao processar o arquivo '{pdf_path.name}': {e}", exc_info=True)
             dados_fatura["ERRO"] = f"Exceção: {str(e)}"
             dados_fatura["SOURCE_EXTRACTION"] = "Falha Geral"
-        
-        all_extracted_data.append(dados_fatura)
+            item["ocr"] = False
+        finally:
+            if ctx:
+                ctx.close()
+
+    def etapa_ocr(item):
+        if item.get("ocr") and item.get("img") is not None:
+            with metrics.collecting(item.setdefault("tempos", {})), metrics.stage("ocr"):
+                item["lines"] = script_ocr.run_ocr_task(item["img"], cache_key=item.get("ocr_key"), arquivo=item["path"].name)
+        item["img"] = None # Libera a imagem assim que o OCR termina
+        return item
+
+    def etapa_parse(item):
+        dados_fatura = item["dados"]
+        if item.get("ocr"):
+            nome = item["path"].name
+            if script_ocr.get_ocr_engine() is None:
+                extraido = InvoiceRecord({"ARQUIVO": nome, "ERRO": "OCR não disponível/funcional"})
+            elif "lines" not in item:
+                extraido = InvoiceRecord({"ARQUIVO": nome, "ERRO": "Falha ao gerar imagem OCR"})
+            elif not item["lines"]:
+                extraido = InvoiceRecord({"ARQUIVO": nome, "ERRO": "OCR não retornou texto"})
+            else:
+                with metrics.collecting(item.setdefault("tempos", {})):
+                    with metrics.stage("parse"):
+                        extraido = script_ocr.extract_fields_from_text(item["lines"], nome)
+                    # Páginas seguintes (se faltar campo) renderizadas aqui, sob o mesmo lock do PyMuPDF
+                    extraido = script_ocr.ocr_remaining_pages(item["path"], item["lines"], extraido, render_lock=fitz_lock)
+            aplicar_resultado_ocr(dados_fatura, extraido)
+        if item.get("ERRO_PIPELINE"):
+            dados_fatura["ERRO"] = f"Exceção: {item['ERRO_PIPELINE']}"
+            dados_fatura["SOURCE_EXTRACTION"] = "Falha Geral"
+        finalizar_registro(dados_fatura)
+        tempos = item.get("tempos", {})
+        metrics.attach(dados_fatura, tempos, sum(tempos.values()))
+        entregues.add(item["idx"])
+        if on_result:
+            on_result(item["path"], dados_fatura)
+        item["lines"] = None
+        item["dados"] = None
+        with contador_lock:
+            contador[0] += 1
+            _atualizar_status(f"Processados {contador[0]}/{total} (pipeline)")
+        return item
+
+    contador, contador_lock = [0], threading.Lock()
+    entregues = set()
+    pipeline = StreamingPipeline(
+        [("detecção/renderização", etapa_detectar_renderizar, 1), ("ocr", etapa_ocr, 1), ("parse/saída", etapa_parse, 1)],
+        queue_depths=queue_depths or PIPELINE_QUEUE_DEPTHS, keep_output=False,
+    )
+    pipeline.run({"idx": i, "path": p, "tipo": tipos[i] if tipos else None} for i, p in enumerate(pdf_files))
+    PIPELINE_STATS = pipeline.log_stats()
+
+    for i, pdf_path in enumerate(pdf_files):
+        if i not in entregues and on_result:
+            on_result(pdf_path, _registro_falha_worker(pdf_path, "item perdido no pipeline"))
 
-    return all_extracted_data
+
+def run_extraction(folder_path_str: str, output_file_path_str: str, jobs=None, ocr_workers=None, pipeline=None, cache=None,
+                   journal=None, resume=False, sink=None, pdf_files=None, tipo_fatura=None,
+                   metrics_json=None, metrics_prom=None) -> dict:
+    """
+    Processa os PDFs em uma pasta, detecta seu tipo e chama o script de extração apropriado.
+    jobs: número de processos em paralelo (padrão: número de núcleos). Com jobs=1 roda na thread atual.
+    ocr_workers: tamanho do pool de OCR com modelos pré-carregados (ocr_pool). 0 desativa
+    (padrão: EXTRATOR_OCR_WORKERS); nesse caso cada processo carrega o PaddleOCR no primeiro PDF OCR.
+    pipeline: usa o pipeline em streaming com filas limitadas (padrão: EXTRATOR_PIPELINE); ignora jobs/ocr_workers.
+    cache: reaproveita resultados do cache SQLite por conteúdo do PDF (result_cache; padrão: EXTRATOR_CACHE, ativo).
+    journal: caminho do diário de resultados (padrão: <saída>.journal.jsonl; False desativa). Cada arquivo
+    concluído é gravado nele imediatamente. resume=True pula os arquivos já concluídos no diário.
+    sink: destino de output_sinks (XLSX/CSV/Parquet) alimentado na ordem dos arquivos, à medida que cada
+    arquivo termina; fechado ao final.
+    pdf_files: lista de PDFs já descoberta (ex.: cli.py com várias pastas/globs); substitui a busca na pasta.
+    tipo_fatura: 'Digital'/'OCR' forçado para todos os arquivos (pula a detecção).
+    metrics_json / metrics_prom: arquivos de métricas da execução (resumo JSON e textfile do Prometheus;
+    padrão: EXTRATOR_METRICS_JSON / EXTRATOR_METRICS_PROM). O resumo também fica em RUN_METRICS.
+    Os registros não são acumulados: cada um vai ao destino, ao diário, ao cache e às métricas quando
+    fica pronto (só os que chegam adiantados esperam no OrderedWriter pela vez na saída).
+    Retorna o resumo da execução (metrics.RunMetrics.summary) com a lista error_files
+    ([{"arquivo", "erro"}]); {} se não houver PDFs.
+    """
+    if pdf_files is None:
+        pdf_files = sorted(list(Path(folder_path_str).glob("*.pdf")))
+    else:
+        pdf_files = [Path(p) for p in pdf_files]
+
+    if not pdf_files:
+        logging.warning(f"Nenhum arquivo PDF encontrado em '{folder_path_str}'.")
+        return {}
+
+    jobs = min(resolve_jobs(jobs), len(pdf_files))
+    if ocr_workers is None:
+        from ocr_pool import DEFAULT_OCR_WORKERS
+        ocr_workers = DEFAULT_OCR_WORKERS
+    logging.info(f"Iniciando extração para {len(pdf_files)} arquivos em '{folder_path_str}' (workers: {jobs}, OCR workers: {ocr_workers}).")
+
+    if pipeline is None:
+        pipeline = USE_PIPELINE
+    if cache is None:
+        cache = USE_CACHE
+    if journal is None and output_file_path_str:
+        journal = default_journal_path(output_file_path_str)
+    modo = "pipeline" if pipeline else "pool_ocr" if ocr_workers > 0 else "paralelo" if jobs > 1 else "sequencial"
+    metricas = metrics.RunMetrics(workers=3 if pipeline else jobs + (ocr_workers if ocr_workers > 0 else 0), modo=modo)
+    escritor = OrderedWriter(sink) if sink is not None else None
+    indices = {p: i for i, p in enumerate(pdf_files)}
+    erros = []
+
+    def entregar(pdf_path, dados_fatura, processado):
+        """ Destino (na ordem dos arquivos), métricas e lista de erros; o registro não fica guardado aqui. """
+        if escritor:
+            escritor.put(indices[Path(pdf_path)], dados_fatura)
+        metricas.observe(dados_fatura, processado=processado)
+        if dados_fatura.get("ERRO"):
+            erros.append({"arquivo": dados_fatura.get("ARQUIVO"), "erro": dados_fatura.get("ERRO")})
+
+    # Retomada: registros já concluídos na execução anterior vão direto para a saída
+    concluidos = set()
+    retomados = load_journal(journal, pdf_files) if journal and resume else {}
+    for pdf_path in list(retomados):
+        entregar(pdf_path, retomados.pop(pdf_path), processado=False)
+        concluidos.add(pdf_path)
+    n_retomados = len(concluidos)
+    diario = ResultJournal(journal, resume=resume) if journal else None
+
+    # Cache de resultados: arquivos com o mesmo conteúdo (e mesma versão dos extratores) não são reprocessados
+    result_cache = None
+    hashes = {}
+    if cache:
+        try:
+            from result_cache import ResultCache
+            result_cache = ResultCache(extra_functions=(detect_pdf_type, process_single_pdf, aplicar_resultado_digital,
+                                                        aplicar_resultado_ocr, finalizar_registro))
+            for pdf_path in pdf_files:
+                if pdf_path in concluidos:
+                    continue
+                hashes[pdf_path] = result_cache.file_hash(pdf_path)
+                if tipo_fatura: # Resultado com tipo forçado fica numa entrada própria
+                    hashes[pdf_path] = f"{hashes[pdf_path]}:{tipo_fatura}"
+                dados = result_cache.get(hashes[pdf_path])
+                if dados is not None:
+                    dados["ARQUIVO"] = pdf_path.name
+                    if diario: # No diário também, para uma retomada ter a saída completa
+                        diario.append(pdf_path, dados)
+                    entregar(pdf_path, dados, processado=False)
+                    concluidos.add(pdf_path)
+                    del hashes[pdf_path]
+        except Exception as e:
+            logging.error(f"Cache de resultados indisponível: {e}", exc_info=True)
+            result_cache = None
+    n_cache = len(concluidos) - n_retomados
+    pendentes = [p for p in pdf_files if p not in concluidos]
+    concluidos = None
+
+    # Classificação Digital/OCR de todos os pendentes numa passada, antes de distribuir o trabalho. Só o modo
+    # pool OCR precisa de todos os tipos antes (para separar os arquivos); nos demais entram só as decisões
+    # memoizadas e a detecção dos outros fica no worker, no mesmo PdfContext da extração (uma abertura por PDF)
+    tipos = [tipo_fatura] * len(pendentes) if tipo_fatura else None
+    segundos_classificacao = 0.0
+    if pendentes and not tipo_fatura:
+        inicio = time.perf_counter()
+        try:
+            classificados = classifier.classify_many(pendentes, jobs=jobs, cache=result_cache,
+                                                     memo_only=pipeline or ocr_workers <= 0)
+            tipos = [classificados[p] for p in pendentes]
+        except Exception as e:
+            logging.error(f"Falha na classificação em lote ({e}); a detecção fica por arquivo.", exc_info=True)
+        segundos_classificacao = time.perf_counter() - inicio
+
+    def on_result(pdf_path, dados_fatura):
+        if diario:
+            diario.append(pdf_path, dados_fatura)
+        if result_cache is not None:
+            try:
+                result_cache.put(hashes.pop(Path(pdf_path)), dados_fatura)
+            except Exception as e:
+                logging.error(f"Falha ao guardar '{Path(pdf_path).name}' no cache de resultados: {e}")
+        entregar(pdf_path, dados_fatura, processado=True)
+
+    try:
+        if not pendentes:
+            pass
+        elif pipeline:
+            _run_extraction_pipeline(pendentes, tipo_fatura=tipo_fatura, on_result=on_result, tipos=tipos)
+        elif ocr_workers > 0:
+            _run_extraction_com_pool_ocr(pendentes, jobs, ocr_workers, tipos, on_result=on_result)
+        elif jobs > 1:
+            _run_extraction_paralelo(pendentes, min(jobs, len(pendentes)), tipos, on_result=on_result)
+        else:
+            _run_extraction_sequencial(pendentes, tipos, on_result=on_result)
+    finally:
+        if diario:
+            diario.close()
+
+    if escritor:
+        escritor.finish()
+    if n_retomados:
+        logging.info(f"Retomada: {n_retomados} arquivo(s) do diário, {len(pendentes)} processado(s) agora.")
+
+    if result_cache is not None:
+        try:
+            result_cache.evict()
+            CACHE_STATS.update(result_cache.stats())
+            logging.info(f"Cache de resultados: {CACHE_STATS['hits']} hit(s), {CACHE_STATS['misses']} miss(es), "
+                         f"{CACHE_STATS['stored']} guardado(s), {CACHE_STATS['evicted']} removido(s).")
+        except Exception as e:
+            logging.error(f"Falha ao atualizar o cache de resultados: {e}", exc_info=True)
+        finally:
+            result_cache.close()
+
+    metricas.finish(PIPELINE_STATS if pipeline and pendentes else None,
+                    cache_hits=n_cache, resumed=n_retomados,
+                    classification_seconds=round(segundos_classificacao, 4))
+    _exportar_metricas(metricas, metrics_json or METRICS_JSON_PATH, metrics_prom or METRICS_PROM_PATH)
+    return dict(RUN_METRICS, error_files=erros)
+
+
+def run_reparse(pdf_files, sink=None, metrics_json=None, metrics_prom=None) -> dict:
+    """
+    Modo re-parse (cli.py --reparse), para iterar nas regras de campos: os PDFs OCR têm os campos extraídos
+    de novo das linhas do cache de OCR bruto (script_ocr.reparse_pdf_ocr), sem renderizar nem rodar o OCR;
+    os que não estiverem no cache saem com erro. Os digitais passam pelo extrator digital, com o OCR híbrido
+    desligado (nenhum OCR roda neste modo). Do cache de resultados usa apenas as classificações Digital/OCR
+    memoizadas (os resultados não são lidos nem gravados); não usa o diário. A saída segue a ordem de pdf_files.
+    Retorna o resumo da execução, como run_extraction.
+    """
+    pdf_files = [Path(p) for p in pdf_files]
+    metricas = metrics.RunMetrics(workers=1, modo="reparse")
+    result_cache = None
+    if USE_CACHE:
+        try:
+            from result_cache import ResultCache
+            result_cache = ResultCache()
+        except Exception as e:
+            logging.error(f"Cache de resultados indisponível: {e}", exc_info=True)
+    try:
+        tipos = classifier.classify_many(pdf_files, cache=result_cache)
+    finally:
+        if result_cache is not None:
+            result_cache.close()
+    escritor = OrderedWriter(sink) if sink is not None else None
+    erros = []
+    hibrido = script_digital.HYBRID_OCR_ENABLED
+    script_digital.HYBRID_OCR_ENABLED = False
+    try:
+        _reparse_arquivos(pdf_files, tipos, escritor, metricas, erros)
+    finally:
+        script_digital.HYBRID_OCR_ENABLED = hibrido
+    if escritor:
+        escritor.finish()
+    metricas.finish(None)
+    _exportar_metricas(metricas, metrics_json or METRICS_JSON_PATH, metrics_prom or METRICS_PROM_PATH)
+    return dict(RUN_METRICS, error_files=erros)
+
+
+def _reparse_arquivos(pdf_files, tipos, escritor, metricas, erros):
+    """ Laço do run_reparse: cada arquivo vai ao escritor (na ordem), às métricas e à lista de erros. """
+    for i, pdf_path in enumerate(pdf_files):
+        if tipos[pdf_path] == 'OCR':
+            inicio = time.perf_counter()
+            with metrics.collecting() as tempos:
+                dados_fatura = novo_registro(pdf_path)
+                dados_fatura["SOURCE_DETECTION"] = 'OCR'
+                aplicar_resultado_ocr(dados_fatura, script_ocr.reparse_pdf_ocr(pdf_path))
+                finalizar_registro(dados_fatura)
+            metrics.attach(dados_fatura, tempos, time.perf_counter() - inicio)
+        else:
+            dados_fatura = process_single_pdf(pdf_path, tipos[pdf_path])
+        if escritor:
+            escritor.put(i, dados_fatura)
+        metricas.observe(dados_fatura, processado=True)
+        if dados_fatura.get("ERRO"):
+            erros.append({"arquivo": dados_fatura.get("ARQUIVO"), "erro": dados_fatura.get("ERRO")})
+
+
+def _exportar_metricas(metricas, json_path=None, prom_path=None):
+    """ Loga o resumo da execução e grava os arquivos de métricas pedidos. """
+    RUN_METRICS.clear()
+    RUN_METRICS.update(metricas.summary())
+    estagios = ", ".join(f"{k} p50 {v['p50_ms']} ms" for k, v in RUN_METRICS["stages"].items())
+    logging.info(f"[Métricas] {RUN_METRICS['files']} arquivo(s) em {RUN_METRICS['wall_seconds']}s "
+                 f"({RUN_METRICS['files_per_sec']} arquivos/s, ocupação {RUN_METRICS['worker_utilisation']}). {estagios}")
+    try:
+        if json_path:
+            metricas.write_json(json_path)
+        if prom_path:
+            metricas.write_prometheus(prom_path)
+    except OSError as e:
+        logging.error(f"Falha ao gravar as métricas: {e}")
 
 
 def create_gui():
-    global pasta_pdfs_var, arquivo_saida_var, file_listbox, status_label, root
+    global pasta_pdfs_var, arquivo_saida_var, jobs_var, resume_var, file_listbox, status_label, root
+    import tkinter as tk
+    from tkinter import Listbox, Scrollbar
 
+    inicio_gui = time.perf_counter()
     root = tk.Tk()
     root.title("Invoice Data Extraction")
     root.geometry("600x450") # Tamanho inicial um pouco maior
 
     pasta_pdfs_var = tk.StringVar()
     arquivo_saida_var = tk.StringVar()
+    jobs_var = tk.StringVar(value=str(DEFAULT_JOBS))
+    resume_var = tk.BooleanVar(value=False)
 
     main_frame = tk.Frame(root, padx=10, pady=10)
     main_frame.pack(fill=tk.BOTH, expand=True)
@@ -271,19 +942,27 @@ def create_gui():
     btn_selecionar_saida = tk.Button(main_frame, text="Selecionar Arquivo", command=selecionar_arquivo_saida)
     btn_selecionar_saida.grid(row=1, column=2, sticky="e", pady=5, padx=5)
 
+    # Número de processos em paralelo
+    tk.Label(main_frame, text="Workers:").grid(row=2, column=0, sticky="w", pady=5, padx=5)
+    spin_jobs = tk.Spinbox(main_frame, from_=1, to=max(64, DEFAULT_JOBS), textvariable=jobs_var, width=5)
+    spin_jobs.grid(row=2, column=1, sticky="w", pady=5, padx=5)
+    # Retoma a execução anterior a partir do diário (<saída>.journal.jsonl)
+    chk_resume = tk.Checkbutton(main_frame, text="Resume previous run", variable=resume_var)
+    chk_resume.grid(row=2, column=2, sticky="e", pady=5, padx=5)
+
     # Botão Iniciar
     btn_iniciar = tk.Button(main_frame, text="Start Extraction", command=iniciar_extracao_gui, bg="lightblue", font=("Arial", 10, "bold"))
-    btn_iniciar.grid(row=2, column=0, columnspan=3, pady=15, ipady=5) # ipady para altura interna
+    btn_iniciar.grid(row=3, column=0, columnspan=3, pady=15, ipady=5) # ipady para altura interna
 
     # Status Label
     status_label = tk.Label(main_frame, text="Aguardando...", fg="blue", wraplength=550, justify=tk.LEFT) # wraplength para quebrar linha
-    status_label.grid(row=3, column=0, columnspan=3, sticky="ew", pady=5)
+    status_label.grid(row=4, column=0, columnspan=3, sticky="ew", pady=5)
 
     # Listbox para mostrar arquivos
-    tk.Label(main_frame, text="Files in the selected folder:").grid(row=4, column=0, columnspan=3, sticky="w", pady=(10,0))
+    tk.Label(main_frame, text="Files in the selected folder:").grid(row=5, column=0, columnspan=3, sticky="w", pady=(10,0))
     listbox_frame = tk.Frame(main_frame)
-    listbox_frame.grid(row=5, column=0, columnspan=3, sticky="nsew", pady=5)
-    main_frame.rowconfigure(5, weight=1) # Linha da Listbox expande
+    listbox_frame.grid(row=6, column=0, columnspan=3, sticky="nsew", pady=5)
+    main_frame.rowconfigure(6, weight=1) # Linha da Listbox expande
     listbox_frame.columnconfigure(0, weight=1) # Coluna da Listbox expande
 
     file_listbox = Listbox(listbox_frame, width=70, height=10) # Aumentei a largura
@@ -293,7 +972,18 @@ def create_gui():
     scrollbar.grid(row=0, column=1, sticky="ns")
     file_listbox.config(yscrollcommand=scrollbar.set)
 
+    def _janela_pronta():
+        registrar_fase_startup("gui", inicio_gui)
+        registrar_fase_startup("total", _T_INICIO)
+        if OCR_WARMUP:
+            script_ocr.warmup_ocr_engine()
+
+    root.after_idle(_janela_pronta)
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Necessário para o pool de processos no executável PyInstaller
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve": # Serviço HTTP local (ver service.py), sem GUI
+        import service
+        sys.exit(service.main(sys.argv[2:]))
     create_gui()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+Instrumentação por arquivo e por estágio, com custo baixo o bastante para ficar sempre ligada
+(duas leituras de perf_counter por estágio).
+- stage(nome): mede um estágio e acumula no coletor da thread atual (sem coletor ativo, só mede e descarta)
+- collecting(tempos): ativa um coletor (dict) na thread atual; funciona também dentro dos workers,
+  pois os tempos voltam no próprio registro (colunas T_<ESTÁGIO>_MS, ver attach)
+- RunMetrics: agrega os registros de uma execução (tempos, contagens por detecção/extração, erros,
+  ocupação de workers e filas) e exporta resumo JSON e arquivo texto do Prometheus.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Estágios medidos, na ordem em que aparecem nas colunas
+STAGES = ["abrir", "deteccao", "extracao_digital", "renderizacao", "ocr", "parse"]
+METRIC_COLUMNS = [f"T_{s.upper()}_MS" for s in STAGES] + ["T_TOTAL_MS", "WORKER_PID"]
+# Colunas de métricas também na saída (XLSX/CSV/Parquet): EXTRATOR_METRICS_COLUMNS=1
+METRICS_COLUMNS_ENABLED = os.environ.get("EXTRATOR_METRICS_COLUMNS", "0") == "1"
+
+_local = threading.local()
+
+
+@contextmanager
+def collecting(tempos=None):
+    """ Ativa o coletor de tempos da thread atual; devolve o dict {estágio: segundos}. """
+    tempos = {} if tempos is None else tempos
+    anterior = getattr(_local, "tempos", None)
+    _local.tempos = tempos
+    try:
+        yield tempos
+    finally:
+        _local.tempos = anterior
+
+
+@contextmanager
+def stage(nome):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos = getattr(_local, "tempos", None)
+        if tempos is not None:
+            tempos[nome] = tempos.get(nome, 0.0) + time.perf_counter() - inicio
+
+
+def attach(dados, tempos, total=None):
+    """ Grava os tempos no registro como colunas T_<ESTÁGIO>_MS (mais T_TOTAL_MS e WORKER_PID). """
+    for nome, segundos in tempos.items():
+        dados[f"T_{nome.upper()}_MS"] = round(segundos * 1000, 2)
+    if total is not None:
+        dados["T_TOTAL_MS"] = round(total * 1000, 2)
+    dados["WORKER_PID"] = os.getpid()
+    return dados
+
+
+def strip(dados):
+    """ Cópia do registro sem as colunas de métricas (ex.: para guardar no cache). """
+    return {k: v for k, v in dados.items() if k not in METRIC_COLUMNS}
+
+
+def percentile(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(ordenados) - 1)
+    return ordenados[lo] + (ordenados[hi] - ordenados[lo]) * (k - lo)
+
+
+def _contar(contagem, chave):
+    contagem[chave] = contagem.get(chave, 0) + 1
+
+
+class RunMetrics:
+    """
+    Métricas de uma execução de run_extraction.
+        metricas = RunMetrics(workers=4, modo="paralelo")
+        metricas.observe(dados, processado=True)   # para cada registro
+        metricas.finish(PIPELINE_STATS)
+        metricas.write_json("m.json"); metricas.write_prometheus("extrator.prom")
+    """
+
+    def __init__(self, workers=1, modo="sequencial"):
+        self.workers = max(1, workers)
+        self.modo = modo
+        self.inicio = time.perf_counter()
+        self.wall = None
+        self.files = 0
+        self.processed = 0
+        self.errors = 0
+        self.by_detection = {}
+        self.by_extraction = {}
+        self.stage_seconds = {s: [] for s in STAGES + ["total"]}
+        self.pipeline = None
+        self.extra = {}
+
+    def observe(self, dados, processado=True):
+        """ Conta o registro; os tempos só entram se ele foi processado nesta execução (não cache/diário). """
+        self.files += 1
+        _contar(self.by_detection, dados.get("SOURCE_DETECTION") or "Indefinido")
+        _contar(self.by_extraction, dados.get("SOURCE_EXTRACTION") or "Nenhum")
+        if dados.get("ERRO"):
+            self.errors += 1
+        if not processado:
+            return
+        self.processed += 1
+        for nome in STAGES:
+            valor = dados.get(f"T_{nome.upper()}_MS")
+            if valor is not None:
+                self.stage_seconds[nome].append(valor / 1000)
+        if dados.get("T_TOTAL_MS") is not None:
+            self.stage_seconds["total"].append(dados["T_TOTAL_MS"] / 1000)
+
+    def finish(self, pipeline_stats=None, **extra):
+        self.wall = time.perf_counter() - self.inicio
+        self.pipeline = pipeline_stats
+        self.extra.update(extra)
+
+    def summary(self) -> dict:
+        wall = self.wall if self.wall is not None else time.perf_counter() - self.inicio
+        ocupado = sum(self.stage_seconds["total"])
+        estagios = {}
+        for nome, valores in self.stage_seconds.items():
+            if valores:
+                estagios[nome] = {
+                    "count": len(valores),
+                    "sum_seconds": round(sum(valores), 4),
+                    "p50_ms": round(percentile(valores, 0.5) * 1000, 2),
+                    "p95_ms": round(percentile(valores, 0.95) * 1000, 2),
+                    "max_ms": round(max(valores) * 1000, 2),
+                }
+        resumo = {
+            "mode": self.modo,
+            "workers": self.workers,
+            "wall_seconds": round(wall, 3),
+            "files": self.files,
+            "processed": self.processed,
+            "files_per_sec": round(self.files / wall, 3) if wall > 0 else None,
+            "errors": self.errors,
+            "by_detection": dict(self.by_detection),
+            "by_extraction": dict(self.by_extraction),
+            "stages": estagios,
+            # Fração do tempo total dos workers gasta processando arquivos
+            "worker_utilisation": round(ocupado / (wall * self.workers), 3) if wall > 0 else None,
+        }
+        if self.pipeline:
+            resumo["pipeline"] = self.pipeline
+        resumo.update(self.extra)
+        return resumo
+
+    def write_json(self, path):
+        _gravar_atomico(path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    def prometheus_text(self, prefixo="extrator_faturas") -> str:
+        r = self.summary()
+        linhas = []
+
+        def metrica(nome, tipo, ajuda, amostras):
+            prometheus_metric(linhas, f"{prefixo}_{nome}", tipo, ajuda, amostras)
+
+        metrica("run_wall_seconds", "gauge", "Duração da última execução.", [({}, r["wall_seconds"])])
+        metrica("run_files_per_second", "gauge", "Vazão da última execução.", [({}, r["files_per_sec"] or 0)])
+        metrica("run_workers", "gauge", "Workers da última execução.", [({"mode": r["mode"]}, r["workers"])])
+        metrica("run_worker_utilisation", "gauge", "Ocupação média dos workers.", [({}, r["worker_utilisation"] or 0)])
+        metrica("files", "gauge", "Arquivos da última execução por tipo detectado.",
+                [({"detection": k}, v) for k, v in r["by_detection"].items()])
+        metrica("files_by_extraction", "gauge", "Arquivos da última execução por resultado da extração.",
+                [({"extraction": k}, v) for k, v in r["by_extraction"].items()])
+        metrica("errors", "gauge", "Arquivos com erro na última execução.", [({}, r["errors"])])
+        metrica("stage_seconds_sum", "gauge", "Tempo total por estágio.",
+                [({"stage": k}, v["sum_seconds"]) for k, v in r["stages"].items()])
+        metrica("stage_count", "gauge", "Arquivos medidos por estágio.",
+                [({"stage": k}, v["count"]) for k, v in r["stages"].items()])
+        metrica("stage_seconds", "gauge", "Latência por estágio (quantis).",
+                [({"stage": k, "quantile": q}, round(v[f"p{int(float(q) * 100)}_ms"] / 1000, 6))
+                 for k, v in r["stages"].items() for q in ("0.5", "0.95")])
+        if self.pipeline:
+            metrica("pipeline_stage_occupancy", "gauge", "Ocupação por estágio do pipeline.",
+                    [({"stage": s["stage"]}, s["occupancy"]) for s in self.pipeline["stages"]])
+            metrica("pipeline_queue_depth_avg", "gauge", "Profundidade média da fila de entrada por estágio.",
+                    [({"stage": s["stage"]}, s["avg_queue_depth"]) for s in self.pipeline["stages"]])
+        return "\n".join(linhas) + "\n"
+
+    def write_prometheus(self, path):
+        """ Arquivo para o textfile collector do node_exporter (gravação atômica). """
+        _gravar_atomico(path, self.prometheus_text())
+
+
+def prometheus_metric(linhas, nome, tipo, ajuda, amostras):
+    """ Acrescenta a linhas uma métrica no formato texto do Prometheus; amostras: [(rótulos, valor)]. """
+    linhas.append(f"# HELP {nome} {ajuda}")
+    linhas.append(f"# TYPE {nome} {tipo}")
+    for rotulos, valor in amostras:
+        texto = ",".join(f'{k}="{_escapar(v)}"' for k, v in rotulos.items())
+        linhas.append(f"{nome}{{{texto}}} {valor}" if texto else f"{nome} {valor}")
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _gravar_atomico(path, texto):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(tmp, path)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+ocr_cache.py
+Cache persistente (SQLite) da saída bruta do OCR por página: linhas de texto, caixas (pixels da imagem
+renderizada) e confianças. Chave: SHA-256 do PDF + número da página + DPI da renderização + assinatura
+dos modelos (idioma, arquivos de det/rec/cls, versão do paddleocr, espaço de cor).
+Ao contrário do result_cache, a chave não depende do código de extração dos campos: corrigir uma regra
+de extract_fields_from_text não invalida nada, e o modo re-parse (main_processor.run_reparse) refaz só o
+parse sobre as linhas guardadas, sem renderizar nem rodar o PaddleOCR.
+Configuração: EXTRATOR_OCR_CACHE (0 desativa), EXTRATOR_OCR_CACHE_DB (caminho).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+OCR_CACHE_ENABLED = os.environ.get("EXTRATOR_OCR_CACHE", "1") == "1"
+OCR_CACHE_PATH = os.environ.get("EXTRATOR_OCR_CACHE_DB") or str(Path.home() / ".extratorfaturas" / "ocr_cache.sqlite")
+
+
+def model_signature(model_dir, lang, colorspace=""):
+    """ Assinatura do conjunto de modelos: muda se os arquivos dos modelos, o idioma ou a versão do paddleocr mudarem. """
+    h = hashlib.sha256(f"{lang}|{colorspace}".encode())
+    try:
+        from importlib.metadata import version
+        h.update(version("paddleocr").encode())
+    except Exception:
+        pass
+    for sub in ("det", "rec", "cls"):
+        pasta = Path(model_dir) / sub
+        if pasta.is_dir():
+            for arquivo in sorted(pasta.rglob("*")):
+                if arquivo.is_file():
+                    st = arquivo.stat()
+                    h.update(f"{arquivo.relative_to(model_dir).as_posix()}|{st.st_size}".encode())
+    return h.hexdigest()[:16]
+
+
+class OcrCache:
+    """
+    Cache de OCR bruto por página.
+        cache = OcrCache()
+        raw = cache.get(h, 0, 216, modelo)         # [(texto, caixa, confiança)] ou None
+        cache.put(h, 0, 216, modelo, raw, "fatura.pdf")
+        cache.close()
+    Pode ser usado por várias threads (lock) e por vários processos (WAL + timeout).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or OCR_CACHE_PATH
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ocr_paginas (
+                hash TEXT NOT NULL, pagina INTEGER NOT NULL, dpi INTEGER NOT NULL, modelo TEXT NOT NULL,
+                arquivo TEXT, linhas TEXT NOT NULL, criado REAL NOT NULL,
+                PRIMARY KEY (hash, pagina, dpi, modelo));
+        """)
+        self._conn.commit()
+
+    def get(self, file_hash, pagina, dpi, modelo, any_dpi=False):
+        """ Saída bruta da página ou None. any_dpi: aceita qualquer DPI (o maior), ex.: no re-parse. """
+        with self._lock:
+            if any_dpi:
+                row = self._conn.execute(
+                    "SELECT linhas FROM ocr_paginas WHERE hash = ? AND pagina = ? AND modelo = ? ORDER BY dpi DESC LIMIT 1",
+                    (file_hash, pagina, modelo)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT linhas FROM ocr_paginas WHERE hash = ? AND pagina = ? AND dpi = ? AND modelo = ?",
+                    (file_hash, pagina, dpi, modelo)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [tuple(r) for r in json.loads(row[0])]
+
+    def put(self, file_hash, pagina, dpi, modelo, raw, arquivo=None):
+        linhas = json.dumps([[texto, caixa, confianca] for texto, caixa, confianca in raw], ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ocr_paginas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (file_hash, pagina, dpi, modelo, arquivo, linhas, time.time()))
+            self._conn.commit() # Outros workers (processos) enxergam a página imediatamente
+            self.stored += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stored": self.stored}
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
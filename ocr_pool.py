@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+ocr_pool.py
+Pool de processos de OCR com instâncias PaddleOCR "quentes": cada worker carrega os modelos
+de script_ocr.model_dir uma única vez (no initializer) e atende vários PDFs/páginas.
+Configuração (também via variáveis de ambiente):
+- processes:            EXTRATOR_OCR_WORKERS            (0 = pool desativado no main_processor)
+- threads_per_worker:   EXTRATOR_OCR_THREADS            (threads da biblioteca de inferência por worker)
+- max_tasks_per_worker: EXTRATOR_OCR_MAX_TASKS          (reinicia o worker após N tarefas, contendo o crescimento de memória)
+- files_per_batch:      EXTRATOR_OCR_BATCH_FILES        (PDFs por tarefa em lote; recortes de todos vão juntos ao reconhecimento)
+- task_retries:         EXTRATOR_OCR_RETRIES            (reenvios de um PDF cujo worker morreu antes de ele falhar)
+Sobre concurrent.futures: um worker que morre quebra o pool (BrokenProcessPool) e as tarefas pendentes
+falham na hora, em vez de esperar o timeout; restart() cria um pool novo para os reenvios.
+max_tasks_per_child só existe a partir do Python 3.11; no 3.10 (build do Windows) o pool inteiro é
+trocado por um novo a cada processes x max_tasks_per_worker tarefas (as em andamento terminam no antigo).
+"""
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import script_ocr
+
+DEFAULT_OCR_WORKERS = int(os.environ.get("EXTRATOR_OCR_WORKERS", "0"))
+OCR_THREADS_PER_WORKER = int(os.environ.get("EXTRATOR_OCR_THREADS", "2"))
+OCR_MAX_TASKS_PER_WORKER = int(os.environ.get("EXTRATOR_OCR_MAX_TASKS", "200"))
+OCR_FILES_PER_BATCH = int(os.environ.get("EXTRATOR_OCR_BATCH_FILES", "4"))
+OCR_TASK_RETRIES = int(os.environ.get("EXTRATOR_OCR_RETRIES", "2"))
+OCR_TASK_TIMEOUT = 600 # segundos sem nenhuma tarefa concluída: o pool é considerado travado
+_MAX_TASKS_PER_CHILD = sys.version_info >= (3, 11) # Reinício dos workers pelo próprio ProcessPoolExecutor
+
+
+# --- Funções executadas dentro dos workers ---
+def _init_worker(threads_per_worker):
+    # Limita as threads das bibliotecas numéricas antes de carregar o Paddle
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads_per_worker)
+    script_ocr.OCR_ENGINE_OVERRIDES["cpu_threads"] = threads_per_worker
+    if script_ocr.get_ocr_engine() is None:
+        logging.error(f"[OCR Pool] Worker {os.getpid()} sem engine OCR.")
+    else:
+        logging.info(f"[OCR Pool] Worker {os.getpid()} pronto ({threads_per_worker} threads).")
+
+def _ocr_image(img_array):
+    return script_ocr.run_ocr_task(img_array)
+
+def _ocr_pdf(pdf_path):
+    return script_ocr.processar_pdf_ocr(pdf_path)
+
+def _ocr_images_batch(img_arrays):
+    return script_ocr.run_ocr_batch(img_arrays)
+
+def _ocr_pdf_batch(pdf_paths):
+    return script_ocr.processar_pdfs_ocr_lote(pdf_paths)
+
+
+class OcrWorkerPool:
+    """
+    Pool de workers OCR de longa duração.
+        with OcrWorkerPool(processes=4) as pool:
+            pendente = pool.submit_pdf("fatura.pdf")   # Future com o dict de processar_pdf_ocr
+            linhas = pool.ocr(img_array)               # linhas de run_ocr_task
+            pool.restart()                             # depois de BrokenProcessPool: pool novo
+    """
+
+    def __init__(self, processes=None, threads_per_worker=None, max_tasks_per_worker=None):
+        self.processes = max(1, processes or DEFAULT_OCR_WORKERS or 1)
+        self.threads_per_worker = threads_per_worker or OCR_THREADS_PER_WORKER
+        self.max_tasks_per_worker = max_tasks_per_worker or OCR_MAX_TASKS_PER_WORKER
+        self.restarts = 0
+        self._tarefas = 0 # Tarefas enviadas ao pool atual (reciclagem manual, Python < 3.11)
+        self._antigos = [] # Pools reciclados cujas tarefas em andamento ainda terminam
+        self._pool = self._novo_pool()
+        logging.info(f"[OCR Pool] {self.processes} worker(s), {self.threads_per_worker} thread(s) cada, "
+                     f"reinício a cada {self.max_tasks_per_worker} tarefas.")
+
+    def _novo_pool(self):
+        # spawn: o estado do Paddle nunca é herdado via fork (mesmo comportamento no Windows e no Linux)
+        opcoes = {"max_tasks_per_child": self.max_tasks_per_worker} if _MAX_TASKS_PER_CHILD else {}
+        self._tarefas = 0
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,),
+            **opcoes,
+        )
+
+    def _executor(self):
+        """ Pool para a próxima tarefa; sem max_tasks_per_child, troca o pool quando ele atinge o limite de tarefas. """
+        if not _MAX_TASKS_PER_CHILD:
+            if self._tarefas >= self.processes * self.max_tasks_per_worker:
+                self._pool.shutdown(wait=False) # Os workers saem ao terminar o que já receberam
+                self._antigos = [p for p in self._antigos
+                                 if any(w.is_alive() for w in (getattr(p, "_processes", None) or {}).values())]
+                self._antigos.append(self._pool)
+                self._pool = self._novo_pool()
+                logging.info(f"[OCR Pool] Workers reciclados após {self.processes * self.max_tasks_per_worker} tarefas.")
+            self._tarefas += 1
+        return self._pool
+
+    def restart(self):
+        """ Descarta o pool atual (quebrado ou travado) e cria outro; as tarefas dele não são reenviadas aqui. """
+        self.terminate()
+        self._pool = self._novo_pool()
+        self.restarts += 1
+        logging.warning(f"[OCR Pool] Pool recriado ({self.restarts}º reinício).")
+
+    def submit(self, img_array):
+        """ Enfileira uma imagem; Future com as linhas de run_ocr_task. """
+        return self._executor().submit(_ocr_image, img_array)
+
+    def submit_pdf(self, pdf_path):
+        """ Enfileira um PDF (renderização + OCR + campos no worker); Future com o dict de processar_pdf_ocr. """
+        return self._executor().submit(_ocr_pdf, str(pdf_path))
+
+    def submit_batch(self, img_arrays):
+        """ Enfileira um lote de imagens (OCR em lote no worker); Future com uma lista de linhas por imagem. """
+        return self._executor().submit(_ocr_images_batch, list(img_arrays))
+
+    def submit_pdf_batch(self, pdf_paths):
+        """ Enfileira um lote de PDFs; Future com a lista de dicts de processar_pdfs_ocr_lote. """
+        return self._executor().submit(_ocr_pdf_batch, [str(p) for p in pdf_paths])
+
+    def ocr(self, img_array):
+        return self.submit(img_array).result(OCR_TASK_TIMEOUT)
+
+    def map(self, images):
+        return [r.result(OCR_TASK_TIMEOUT) for r in [self.submit(img) for img in images]]
+
+    def close(self):
+        for antigo in self._antigos:
+            antigo.shutdown(wait=True)
+        self._antigos = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def terminate(self):
+        """ Encerra os workers sem esperar as tarefas em andamento (pool travado ou saída com exceção). """
+        pools = self._antigos + ([self._pool] if self._pool is not None else [])
+        self._antigos = []
+        for pool in pools:
+            processos = list((getattr(pool, "_processes", None) or {}).values())
+            pool.shutdown(wait=False, cancel_futures=True)
+            for p in processos:
+                if p.is_alive():
+                    p.terminate()
+            for p in processos:
+                p.join(5)
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
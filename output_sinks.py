@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+output_sinks.py
+Gravação incremental dos registros (uma linha por fatura) em XLSX (openpyxl write-only), CSV ou Parquet
+(grupos de linhas), sempre com o mesmo esquema de colunas (OUTPUT_COLUMNS). Nenhum destino mantém a
+planilha inteira em memória: as linhas são escritas em blocos de POSTPROCESS_CHUNK registros (ou do que
+chegou em POSTPROCESS_MAX_WAIT segundos), cada bloco pós-processado de uma vez (postprocess: importes
+numéricos, IMPUESTOS, TOTAL_OK/MOEDA_OK).
+    with open_sink("saida.xlsx") as sink:
+        sink.write(dados_fatura)
+"""
+import abc
+import csv
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import metrics
+import postprocess
+from invoice_record import FIELDS, NO_CACHE, InvoiceRecord
+
+# Esquema fixo da saída (ordem das colunas): campos do InvoiceRecord + verificações do pós-processamento
+OUTPUT_COLUMNS = list(FIELDS) + postprocess.CHECK_COLUMNS
+# Colunas gravadas como número / booleano nos formatos tipados (Parquet)
+NUMERIC_COLUMNS = set(postprocess.AMOUNT_COLUMNS) | set(metrics.METRIC_COLUMNS)
+BOOLEAN_COLUMNS = set(postprocess.CHECK_COLUMNS)
+
+
+def default_columns(with_metrics=None):
+    """ Esquema padrão; com with_metrics (padrão: EXTRATOR_METRICS_COLUMNS) inclui as colunas de tempo por estágio. """
+    if with_metrics is None:
+        with_metrics = metrics.METRICS_COLUMNS_ENABLED
+    return OUTPUT_COLUMNS + (metrics.METRIC_COLUMNS if with_metrics else [])
+
+PARQUET_ROW_GROUP = int(os.environ.get("EXTRATOR_PARQUET_ROW_GROUP", "1000"))
+
+
+class RecordSink(abc.ABC):
+    """
+    Destino base: junta os registros (dicts) em blocos de chunk_size (ou de max_wait segundos), pós-processa
+    cada bloco (postprocess.postprocess_records) e grava as linhas com as colunas do esquema.
+    """
+    extension = None
+
+    def __init__(self, path, columns=None, chunk_size=None, max_wait=None):
+        self.path = str(path)
+        self.columns = list(columns or default_columns())
+        self.count = 0
+        self.chunk_size = max(1, chunk_size or postprocess.POSTPROCESS_CHUNK)
+        self.max_wait = postprocess.POSTPROCESS_MAX_WAIT if max_wait is None else max_wait
+        self._bloco = []
+        self._inicio_bloco = None
+        # Colunas conhecidas: do esquema ou opcionais (fora do esquema sem aviso)
+        self._conhecidas = set(self.columns) | set(metrics.METRIC_COLUMNS) | set(postprocess.CHECK_COLUMNS) | {NO_CACHE}
+        self._campos_fora = set(FIELDS) - self._conhecidas # Campos do InvoiceRecord que o esquema não tem
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, registro):
+        if type(registro) is InvoiceRecord:
+            chaves = self._campos_fora.union(registro.extra_keys())
+        else:
+            chaves = registro.keys()
+        extras = chaves - self._conhecidas
+        if extras:
+            self._conhecidas |= extras
+            logging.warning(f"[Saída] Campo(s) fora do esquema ignorado(s): {sorted(extras)}")
+        if not self._bloco:
+            self._inicio_bloco = time.monotonic()
+        self._bloco.append(registro)
+        self.count += 1
+        if len(self._bloco) >= self.chunk_size or time.monotonic() - self._inicio_bloco >= self.max_wait:
+            self.flush()
+
+    def flush(self):
+        """ Pós-processa e grava o bloco pendente. """
+        if not self._bloco:
+            return
+        frame = postprocess.postprocess_records(self._bloco, self.columns)
+        self._bloco = []
+        self._write_frame(frame)
+
+    def _write_frame(self, frame):
+        linhas = frame.astype(object)
+        linhas = linhas.where(linhas.notna(), None)
+        self._write_rows(linhas.itertuples(index=False, name=None))
+
+    def _write_rows(self, rows):
+        for row in rows:
+            self._write_row(list(row))
+
+    @abc.abstractmethod
+    def _write_row(self, row):
+        """ Grava uma linha (valores na ordem das colunas). """
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def _close(self):
+        pass
+
+    def discard(self):
+        """ Fecha e apaga a saída (ex.: nenhuma fatura processada). """
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class XlsxSink(RecordSink):
+    """ openpyxl em modo write-only: as linhas vão para um arquivo temporário, não para a memória. """
+    extension = ".xlsx"
+
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns, max_wait=float("inf")) # O arquivo só fica legível no close
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+        self._illegal = ILLEGAL_CHARACTERS_RE
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet("Sheet1")
+        self._ws.append(self.columns)
+
+    def _cell(self, valor):
+        if valor is None or isinstance(valor, (int, float, bool)):
+            return valor
+        return self._illegal.sub("", str(valor))
+
+    def _write_row(self, row):
+        self._ws.append([self._cell(v) for v in row])
+
+    def _close(self):
+        if self._wb is not None:
+            self._wb.save(self.path)
+            self._wb = None
+
+
+class CsvSink(RecordSink):
+    """ CSV UTF-8 com BOM (abre com acentos corretos no Excel). """
+    extension = ".csv"
+
+    def __init__(self, path, columns=None, delimiter=","):
+        super().__init__(path, columns)
+        self._file = open(self.path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file, delimiter=delimiter)
+        self._writer.writerow(self.columns)
+
+    def _write_row(self, row):
+        self._writer.writerow(row) # None sai como campo vazio
+
+    def _write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink(RecordSink):
+    """
+    Parquet (pyarrow) com um grupo de linhas por bloco de row_group_size registros; importes e tempos como
+    float64, verificações (TOTAL_OK/MOEDA_OK) como booleano, demais como texto.
+    """
+    extension = ".parquet"
+
+    def __init__(self, path, columns=None, row_group_size=None):
+        # Sem gravação por tempo: o arquivo só fica legível no close e grupos pequenos pioram a leitura
+        super().__init__(path, columns, chunk_size=row_group_size or PARQUET_ROW_GROUP, max_wait=float("inf"))
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self.row_group_size = self.chunk_size
+        tipos = {c: pa.float64() for c in NUMERIC_COLUMNS} | {c: pa.bool_() for c in BOOLEAN_COLUMNS}
+        self._schema = pa.schema([(c, tipos.get(c, pa.string())) for c in self.columns])
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+
+    def _write_frame(self, frame):
+        import pandas as pd
+        arrays = []
+        for c in self.columns:
+            coluna = frame[c]
+            if c in NUMERIC_COLUMNS:
+                coluna = pd.to_numeric(coluna, errors="coerce")
+            elif c not in BOOLEAN_COLUMNS:
+                coluna = [None if pd.isna(v) else str(v) for v in coluna]
+            arrays.append(self._pa.array(coluna, type=self._schema.field(c).type, from_pandas=True))
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def _write_row(self, row):
+        import pandas as pd
+        self._write_frame(pd.DataFrame([row], columns=self.columns))
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+SINK_FORMATS = {"xlsx": XlsxSink, "csv": CsvSink, "parquet": ParquetSink}
+
+
+def open_sink(path, fmt=None, columns=None):
+    """ Abre o destino pelo formato (xlsx/csv/parquet) ou, sem formato, pela extensão do arquivo (padrão xlsx). """
+    fmt = (fmt or Path(path).suffix.lstrip(".") or "xlsx").lower()
+    if fmt not in SINK_FORMATS:
+        logging.warning(f"[Saída] Formato '{fmt}' desconhecido. Usando xlsx.")
+        fmt = "xlsx"
+    return SINK_FORMATS[fmt](path, columns)
+
+
+class OrderedWriter:
+    """
+    Recebe registros fora de ordem (put(índice, registro)) e os grava no destino na ordem dos índices,
+    assim que a sequência fica contígua. Só os registros adiantados ficam em memória.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._proximo = 0
+        self._pendentes = {}
+        self._lock = threading.Lock()
+
+    def put(self, indice, registro):
+        with self._lock:
+            if self._proximo is None or indice < self._proximo or indice in self._pendentes:
+                return
+            self._pendentes[indice] = registro
+            while self._proximo in self._pendentes:
+                self.sink.write(self._pendentes.pop(self._proximo))
+                self._proximo += 1
+
+    def finish(self):
+        """
+        Grava os registros adiantados que ainda esperam (índices que nunca chegaram ficam de fora, com
+        aviso) e fecha o destino.
+        """
+        with self._lock:
+            if self._pendentes:
+                logging.warning(f"[Saída] {len(self._pendentes)} registro(s) gravado(s) fora da sequência: "
+                                f"índice {self._proximo} não chegou.")
+            for indice in sorted(self._pendentes):
+                self.sink.write(self._pendentes.pop(indice))
+            self._proximo = None
+        self.sink.close()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+page_index.py
+Índice de palavras/linhas de uma página, construído uma única vez a partir de get_text("words").
+Substitui as chamadas repetidas de page.search_for(label) e page.get_text("text", clip=...)
+feitas pelos extratores de script_digital.
+DocumentIndex junta os índices das páginas de um documento, construídos sob demanda.
+"""
+from bisect import bisect_left
+
+import fitz  # PyMuPDF
+
+
+class _Line:
+    """ Linha de texto (mesmo block_no/line_no do PyMuPDF) com suas palavras na ordem de extração. """
+    __slots__ = ("order", "words", "starts", "text", "lower", "x0", "y0", "x1", "y1")
+
+    def __init__(self, order, words):
+        self.order = order
+        self.words = words
+        self.starts = []
+        pos = 0
+        for w in words:
+            self.starts.append(pos)
+            pos += len(w[4]) + 1
+        self.text = " ".join(w[4] for w in words)
+        self.lower = self.text.lower()
+        self.x0 = min(w[0] for w in words)
+        self.y0 = min(w[1] for w in words)
+        self.x1 = max(w[2] for w in words)
+        self.y1 = max(w[3] for w in words)
+
+    def span_rect(self, start, end):
+        """
+        Retângulo dos caracteres [start, end) do texto da linha. Palavras cobertas só em parte (ex.: o rótulo
+        "nº cliente" em "Cliente:") são cortadas na proporção dos caracteres, como o search_for faz por glifo.
+        """
+        rect = None
+        for w, s in zip(self.words, self.starts):
+            n = len(w[4])
+            if s < end and s + n > start:
+                r = fitz.Rect(w[:4])
+                if start > s or end < s + n:
+                    largura = (r.x1 - r.x0) / n
+                    r.x0, r.x1 = r.x0 + largura * max(0, start - s), r.x0 + largura * min(n, end - s)
+                rect = r if rect is None else rect | r
+        return rect
+
+
+def _intersects(w, rect):
+    return w[0] < rect.x1 and w[2] > rect.x0 and w[1] < rect.y1 and w[3] > rect.y0
+
+
+class PageIndex:
+    """
+    Índice de uma página:
+    - words: palavras de get_text("words") (x0, y0, x1, y1, texto, block_no, line_no, word_no)
+    - lines: palavras agrupadas por linha, ordenadas por y0 para consultas por faixa (bisect)
+    - find(label): tabela de rótulos (busca case-insensitive, memoizada por rótulo; prime() preenche
+      a tabela de uma vez para todos os rótulos de um conjunto de regras)
+    - text: texto completo da página (get_text("text")), extraído uma única vez
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.rect = page.rect
+        self.words = page.get_text("words")
+        self._text = None
+        self._labels = {}
+        self._primed = set()
+
+        grouped = {}
+        for w in self.words:
+            if w[4].strip():
+                grouped.setdefault((w[5], w[6]), []).append(w)
+        # Ordem de extração preservada em "order"; lista ordenada por y0 para as faixas
+        lines = [_Line(order, words) for order, words in enumerate(grouped.values())]
+        self.lines = lines
+        self._by_y = sorted(lines, key=lambda l: l.y0)
+        self._y0s = [l.y0 for l in self._by_y]
+        self._max_height = max((l.y1 - l.y0 for l in lines), default=0)
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.page.get_text("text")
+        return self._text
+
+    def find(self, label):
+        """ Equivalente a page.search_for(label): retângulos das ocorrências, na ordem de extração. """
+        key = label.lower()
+        if key not in self._labels:
+            hits = []
+            for line in self.lines:
+                start = line.lower.find(key)
+                while start != -1:
+                    rect = line.span_rect(start, start + len(key))
+                    if rect is not None:
+                        hits.append(rect)
+                    start = line.lower.find(key, start + 1)
+            self._labels[key] = hits
+        return self._labels[key]
+
+    def prime(self, matcher):
+        """
+        Localiza numa única passada pelas linhas todos os rótulos de um field_rules.LabelMatcher
+        e preenche a tabela de rótulos; as chamadas seguintes de find() não varrem mais a página.
+        """
+        if id(matcher) in self._primed:
+            return
+        self._primed.add(id(matcher))
+        table = {l: [] for l in matcher.labels if l not in self._labels}
+        if not table:
+            return
+        for line in self.lines:
+            for pos, label in matcher.scan(line.lower):
+                if label in table:
+                    rect = line.span_rect(pos, pos + len(label))
+                    if rect is not None:
+                        table[label].append(rect)
+        self._labels.update(table)
+
+    def first(self, label):
+        hits = self.find(label)
+        return hits[0] if hits else None
+
+    def lines_in(self, rect):
+        """ Linhas que cruzam a faixa vertical de rect, na ordem de extração. """
+        lo = bisect_left(self._y0s, rect.y0 - self._max_height)
+        hi = bisect_left(self._y0s, rect.y1)
+        found = [l for l in self._by_y[lo:hi] if l.y1 > rect.y0]
+        found.sort(key=lambda l: l.order)
+        return found
+
+    def words_in(self, rect, sort=False):
+        """ Equivalente a page.get_text("words", clip=rect[, sort=True]). """
+        lines = self.lines_in(rect)
+        if sort:
+            lines.sort(key=lambda l: (l.y1, l.x0))
+        return [w for l in lines for w in l.words if _intersects(w, rect)]
+
+    def text_in(self, rect):
+        """ Equivalente a page.get_text("text", clip=rect): uma linha de texto por linha do índice. """
+        out = []
+        for line in self.lines_in(rect):
+            words = [w[4] for w in line.words if _intersects(w, rect)]
+            if words:
+                out.append(" ".join(words))
+        return "\n".join(out) + ("\n" if out else "")
+
+
+class DocumentIndex:
+    """
+    Índice do documento inteiro, construído sob demanda: cada página só é indexada (PageIndex) quando
+    uma consulta chega nela, e uma única vez. As consultas percorrem as páginas em ordem e param na
+    primeira página que responde, de modo que documentos de uma página (ou campos achados na página 0)
+    não indexam as demais.
+    - doc: PdfContext (reaproveita os PageIndex cacheados nele) ou documento fitz
+    - matcher: field_rules.LabelMatcher aplicado (prime) a cada página indexada
+    - max_pages: limite de páginas consultadas (None: todas)
+    """
+
+    def __init__(self, doc, matcher=None, max_pages=None):
+        self.doc = doc
+        self.matcher = matcher
+        self.page_count = min(doc.page_count, max_pages) if max_pages else doc.page_count
+        self._indexes = {}
+
+    def page(self, number, prime=True):
+        """
+        PageIndex da página (None se não existir).
+        prime=False: a página não passa pelo matcher (quem chama faz o prime se precisar de muitos rótulos).
+        """
+        if number >= self.page_count:
+            return None
+        if number not in self._indexes:
+            if hasattr(self.doc, "page_index"):
+                index = self.doc.page_index(number)
+            else:
+                index = PageIndex(self.doc.load_page(number))
+            if index is not None and self.matcher is not None and prime:
+                index.prime(self.matcher)
+            self._indexes[number] = index
+        return self._indexes[number]
+
+    def pages(self, start=0):
+        """ (número, PageIndex) de cada página a partir de start, indexadas à medida que são pedidas. """
+        for number in range(start, self.page_count):
+            index = self.page(number)
+            if index is not None:
+                yield number, index
+
+    @property
+    def indexed_pages(self):
+        return len(self._indexes)
+
+    def first(self, label, start=0):
+        """ (página, retângulo) da primeira ocorrência do rótulo no documento, ou (None, None). """
+        for number, index in self.pages(start):
+            rect = index.first(label)
+            if rect is not None:
+                return number, rect
+        return None, None
+
+    def first_value(self, extractor, start=0, missing=(None,)):
+        """ (página, valor) do primeiro extractor(PageIndex) cujo valor não esteja em missing, ou (None, None). """
+        for number, index in self.pages(start):
+            value = extractor(index)
+            if value not in missing:
+                return number, value
+        return None, None
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+pdf_context.py
+Contexto por arquivo: abre o PDF uma única vez e guarda a página carregada, os blocos de texto,
+a lista de imagens e os índices de palavras (page_index.PageIndex por página e o DocumentIndex que
+os reúne), para serem reaproveitados pela detecção (main_processor.detect_pdf_type) e pelos extratores (script_digital / script_ocr).
+"""
+import logging
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from page_index import PageIndex, DocumentIndex
+
+
+class PdfContext:
+    """
+    Documento PDF aberto uma vez e compartilhado entre detecção e extração.
+    Uso:
+        with PdfContext(pdf_path) as ctx:
+            tipo = detect_pdf_type(pdf_path, ctx=ctx)
+            dados = script_digital.extract_invoice_fields(pdf_path, ctx=ctx)
+    """
+
+    def __init__(self, pdf_path):
+        self.path = Path(pdf_path)
+        self.doc = fitz.open(str(self.path))
+        self._pages = {}
+        self._text_blocks = {}
+        self._images = {}
+        self._indexes = {}
+        self._document_indexes = {}
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def page(self, number=0):
+        """ Página carregada (cacheada) ou None se não existir. """
+        if number >= self.doc.page_count:
+            return None
+        if number not in self._pages:
+            self._pages[number] = self.doc.load_page(number)
+        return self._pages[number]
+
+    def text_blocks(self, number=0):
+        """ Blocos de texto não vazios da página (get_text("blocks"), block_type == 0). """
+        if number not in self._text_blocks:
+            page = self.page(number)
+            self._text_blocks[number] = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()] if page else []
+        return self._text_blocks[number]
+
+    def images(self, number=0):
+        """ Imagens da página (get_images(full=True)). """
+        if number not in self._images:
+            page = self.page(number)
+            self._images[number] = page.get_images(full=True) if page else []
+        return self._images[number]
+
+    def page_index(self, number=0):
+        """ PageIndex da página (palavras/linhas extraídas uma única vez). """
+        if number not in self._indexes:
+            page = self.page(number)
+            self._indexes[number] = PageIndex(page) if page else None
+        return self._indexes[number]
+
+    def document_index(self, matcher=None, max_pages=None):
+        """ DocumentIndex do documento (páginas indexadas sob demanda, com os PageIndex deste contexto). """
+        key = (id(matcher), max_pages)
+        if key not in self._document_indexes:
+            self._document_indexes[key] = DocumentIndex(self, matcher, max_pages)
+        return self._document_indexes[key]
+
+    def close(self):
+        if self.doc is not None:
+            try:
+                self.doc.close()
+            except Exception as e:
+                logging.error(f"Erro ao fechar PDF '{self.name}': {e}")
+            self.doc = None
+            self._pages.clear()
+            self._indexes.clear()
+            self._document_indexes.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def open_context(pdf_path, ctx=None):
+    """
+    Retorna (ctx, owned): reaproveita o contexto recebido ou abre um novo.
+    owned=True indica que quem chamou deve fechar o contexto.
+    """
+    if ctx is not None:
+        return ctx, False
+    return PdfContext(pdf_path), True
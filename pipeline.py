@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+Pipeline de estágios sobrepostos ligados por filas limitadas (queue.Queue com maxsize).
+Cada estágio roda em sua(s) própria(s) thread(s); a fila cheia bloqueia o estágio anterior
+(backpressure), de modo que a memória fica limitada pela soma das profundidades das filas.
+Ao final, stats() informa a ocupação de cada estágio para identificar o gargalo.
+"""
+import logging
+import queue
+import threading
+import time
+
+_FIM = object() # Sentinela de fim de fluxo
+
+
+class _StageStats:
+    __slots__ = ("name", "workers", "items", "errors", "busy", "wait_in", "wait_out", "depth_sum", "depth_samples")
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0      # tempo processando itens
+        self.wait_in = 0.0   # tempo esperando entrada (estágio anterior lento)
+        self.wait_out = 0.0  # tempo bloqueado na fila de saída (estágio seguinte lento)
+        self.depth_sum = 0
+        self.depth_samples = 0
+
+
+class StreamingPipeline:
+    """
+    stages: lista de (nome, função, workers). Cada função recebe um item e devolve o item para o
+    próximo estágio. Exceções são logadas, o item recebe "ERRO_PIPELINE" e segue adiante (nada se perde).
+    queue_depths: profundidade da fila de entrada de cada estágio (int único ou lista).
+    keep_output: guarda os itens que saem do último estágio (devolvidos por run); com False o último
+    estágio é quem entrega os resultados e nada se acumula.
+    """
+
+    def __init__(self, stages, queue_depths=4, keep_output=True):
+        self.stages = [(name, fn, max(1, workers)) for name, fn, workers in stages]
+        if isinstance(queue_depths, int):
+            queue_depths = [queue_depths] * len(self.stages)
+        self.queues = [queue.Queue(maxsize=max(1, d)) for d in queue_depths]
+        self._stats = [_StageStats(name, workers) for name, _, workers in self.stages]
+        self._lock = threading.Lock()
+        self._vivos = [workers for _, _, workers in self.stages]
+        self._saida = []
+        self._keep_output = keep_output
+        self._wall = 0.0
+        self._source_wait = 0.0
+
+    def _put(self, q, item, stats):
+        inicio = time.perf_counter()
+        q.put(item)
+        if stats is not None:
+            espera = time.perf_counter() - inicio
+            with self._lock:
+                stats.wait_out += espera
+
+    def _worker(self, n):
+        name, fn, _ = self.stages[n]
+        stats = self._stats[n]
+        q_in = self.queues[n]
+        q_out = self.queues[n + 1] if n + 1 < len(self.queues) else None
+        while True:
+            inicio = time.perf_counter()
+            item = q_in.get()
+            espera = time.perf_counter() - inicio
+            if item is _FIM:
+                with self._lock:
+                    stats.wait_in += espera
+                    self._vivos[n] -= 1
+                    ultimo = self._vivos[n] == 0
+                if ultimo and q_out is not None:
+                    for _ in range(self.stages[n + 1][2]):
+                        q_out.put(_FIM)
+                return
+            inicio = time.perf_counter()
+            erro = False
+            try:
+                item = fn(item)
+            except Exception as e:
+                logging.error(f"[Pipeline] Erro no estágio '{name}': {e}", exc_info=True)
+                if isinstance(item, dict):
+                    item["ERRO_PIPELINE"] = f"{name}: {e}"
+                erro = True
+            duracao = time.perf_counter() - inicio
+            with self._lock:
+                stats.wait_in += espera
+                stats.busy += duracao
+                stats.items += 1
+                stats.errors += erro
+                stats.depth_sum += q_in.qsize()
+                stats.depth_samples += 1
+            if q_out is not None:
+                self._put(q_out, item, stats)
+            elif self._keep_output:
+                with self._lock:
+                    self._saida.append(item)
+
+    def run(self, items):
+        """ Alimenta o pipeline com items (estágio de descoberta) e devolve as saídas na ordem de conclusão ([] sem keep_output). """
+        inicio = time.perf_counter()
+        threads = []
+        for n, (name, _, workers) in enumerate(self.stages):
+            for w in range(workers):
+                t = threading.Thread(target=self._worker, args=(n,), name=f"pipeline-{name}-{w}", daemon=True)
+                t.start()
+                threads.append(t)
+        for item in items:
+            t0 = time.perf_counter()
+            self.queues[0].put(item)
+            self._source_wait += time.perf_counter() - t0
+        for _ in range(self.stages[0][2]):
+            self.queues[0].put(_FIM)
+        for t in threads:
+            t.join()
+        self._wall = time.perf_counter() - inicio
+        return self._saida
+
+    def stats(self):
+        """ Ocupação por estágio: busy / (tempo total x workers). O estágio com maior ocupação é o gargalo. """
+        wall = self._wall or 1e-9
+        out = {"wall_seconds": round(self._wall, 3), "discovery_blocked_seconds": round(self._source_wait, 3), "stages": []}
+        with self._lock:
+            estagios = [(s.name, s.workers, s.items, s.errors, s.busy, s.wait_in, s.wait_out, s.depth_sum, s.depth_samples)
+                        for s in self._stats]
+        for name, workers, items, errors, busy, wait_in, wait_out, depth_sum, depth_samples in estagios:
+            out["stages"].append({
+                "stage": name,
+                "workers": workers,
+                "items": items,
+                "errors": errors,
+                "busy_seconds": round(busy, 3),
+                "waiting_input_seconds": round(wait_in, 3),
+                "blocked_output_seconds": round(wait_out, 3),
+                "occupancy": round(busy / (wall * workers), 3),
+                "avg_queue_depth": round(depth_sum / depth_samples, 2) if depth_samples else 0.0,
+            })
+        return out
+
+    def log_stats(self):
+        st = self.stats()
+        logging.info(f"[Pipeline] Tempo total: {st['wall_seconds']}s (descoberta bloqueada {st['discovery_blocked_seconds']}s)")
+        for s in st["stages"]:
+            logging.info(f"[Pipeline] {s['stage']}: {s['items']} itens, ocupação {s['occupancy']:.0%}, "
+                         f"fila média {s['avg_queue_depth']}, esperando entrada {s['waiting_input_seconds']}s, "
+                         f"bloqueado na saída {s['blocked_output_seconds']}s")
+        if st["stages"]:
+            gargalo = max(st["stages"], key=lambda s: s["occupancy"])
+            logging.info(f"[Pipeline] Gargalo provável: {gargalo['stage']}")
+        return st
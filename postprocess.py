@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+postprocess.py
+Pós-processamento vetorizado (pandas) de um lote de registros, aplicado pelos destinos de output_sinks a
+cada bloco de linhas, antes da gravação. Os extratores devolvem um invoice_record.InvoiceRecord por
+arquivo; aqui as colunas do lote inteiro são tratadas de uma vez:
+- importes (BASE IMPONIBLE, IMPUESTOS, IMPORTE TOTAL) em float64 (já float nos InvoiceRecord; textos
+  '1234,56' / '1.234,56' / '12,50-' de registros em dict são convertidos)
+- IMPUESTOS = IMPORTE TOTAL - BASE IMPONIBLE onde o imposto não veio do extrator
+- TOTAL_OK: BASE + IMPUESTOS confere com o TOTAL (tolerância EXTRATOR_TOTAL_TOLERANCE) e o total não é
+  menor que a base em módulo; vazio se faltar algum valor
+- MOEDA_OK: moeda reconhecida (e igual a EXTRATOR_MOEDA, se definida); vazio se a fatura não tiver moeda
+"""
+import os
+
+AMOUNT_COLUMNS = ["BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL"]
+CHECK_COLUMNS = ["TOTAL_OK", "MOEDA_OK"]
+
+TOTAL_TOLERANCE = float(os.environ.get("EXTRATOR_TOTAL_TOLERANCE", "0.02"))
+EXPECTED_CURRENCY = os.environ.get("EXTRATOR_MOEDA", "").strip().upper() or None
+CURRENCY_CODES = {"€": "EUR", "EUR": "EUR", "USD": "USD", "US$": "USD"}
+# Registros por bloco pós-processado pelos destinos (output_sinks); blocos menores que ~10 mil linhas pagam
+# mais o custo fixo do DataFrame por bloco
+POSTPROCESS_CHUNK = int(os.environ.get("EXTRATOR_POSTPROCESS_CHUNK", "10000"))
+# Segundos máximos que um registro espera no bloco antes de ser gravado (execuções lentas, ex.: OCR)
+POSTPROCESS_MAX_WAIT = float(os.environ.get("EXTRATOR_POSTPROCESS_MAX_WAIT", "5"))
+
+_JUNK_RE = r"[^\d,.\-]" # Moeda, espaços e letras em volta do número
+
+
+def _is_text(valor):
+    return isinstance(valor, str)
+
+
+def parse_amounts(valores):
+    """
+    Importes de uma coluna em float64 (NaN onde não houver número). Números passam direto; textos seguem
+    as regras de clean_value do OCR: com vírgula depois do último ponto a vírgula é o decimal
+    ('1.234,56'), senão as vírgulas são milhares ('1,234.56'); hífen no início ou no fim é sinal.
+    """
+    import pandas as pd
+    if isinstance(valores, pd.Series) and pd.api.types.is_numeric_dtype(valores) and not pd.api.types.is_bool_dtype(valores):
+        return valores.astype("float64") # Coluna montada de InvoiceRecords: já numérica
+    valores = pd.Series(valores, dtype=object)
+    e_texto = valores.map(_is_text).astype(bool)
+    numeros = pd.to_numeric(valores.where(~e_texto), errors="coerce").astype("float64")
+    if e_texto.any():
+        texto = valores[e_texto].astype(str).str.replace(_JUNK_RE, "", regex=True)
+        negativo = texto.str.startswith("-") | texto.str.endswith("-")
+        texto = texto.str.strip("-")
+        decimal_virgula = texto.str.rfind(",") > texto.str.rfind(".")
+        texto = texto.where(~decimal_virgula, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+        texto = texto.where(decimal_virgula, texto.str.replace(",", "", regex=False))
+        convertidos = pd.to_numeric(texto, errors="coerce").astype("float64")
+        numeros[e_texto] = convertidos.where(~negativo, -convertidos)
+    return numeros
+
+
+def postprocess_frame(df):
+    """ Aplica o pós-processamento ao DataFrame (colunas alteradas/criadas nele) e o devolve. """
+    import pandas as pd
+    for coluna in AMOUNT_COLUMNS:
+        df[coluna] = parse_amounts(df[coluna]) if coluna in df else float("nan")
+    base, total = df["BASE IMPONIBLE"], df["IMPORTE TOTAL"]
+    df["IMPUESTOS"] = df["IMPUESTOS"].fillna((total - base).round(2))
+
+    diferenca = (base + df["IMPUESTOS"] - total).abs()
+    total_ok = (diferenca <= TOTAL_TOLERANCE) & (total.abs() >= base.abs() - TOTAL_TOLERANCE)
+    df["TOTAL_OK"] = total_ok.astype("boolean").mask(diferenca.isna())
+
+    moeda = df["MOEDA"] if "MOEDA" in df else pd.Series(None, index=df.index, dtype=object)
+    codigo = moeda.astype("string").str.strip().str.upper().map(CURRENCY_CODES)
+    moeda_ok = codigo.notna() if EXPECTED_CURRENCY is None else codigo.eq(EXPECTED_CURRENCY)
+    df["MOEDA_OK"] = moeda_ok.astype("boolean").mask(moeda.isna())
+    return df
+
+
+def postprocess_records(registros, columns=None):
+    """
+    DataFrame pós-processado de uma lista de registros (InvoiceRecord ou dicts), com as colunas na ordem de
+    columns (padrão: invoice_record.FIELDS). O DataFrame é montado por coluna: de um lote só de
+    InvoiceRecord, direto dos atributos (column_values); senão, a partir das linhas (to_row / get).
+    """
+    import pandas as pd
+    from invoice_record import FIELDS, InvoiceRecord, column_values
+    colunas = list(columns or FIELDS)
+    todas = colunas + [c for c in AMOUNT_COLUMNS + ["MOEDA"] if c not in colunas]
+    if all(type(r) is InvoiceRecord for r in registros):
+        dados = {c: column_values(registros, c) for c in todas}
+    else:
+        linhas = [r.to_row(todas) if hasattr(r, "to_row") else [r.get(c) for c in todas] for r in registros]
+        dados = dict(zip(todas, zip(*linhas))) if linhas else {c: [] for c in todas}
+    df = pd.DataFrame(dados, columns=todas)
+    return postprocess_frame(df)[colunas]
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+result_cache.py
+Cache persistente (SQLite) dos registros finais (dados_fatura) por conteúdo do PDF.
+Chave: SHA-256 do arquivo + impressão digital dos extratores (código de script_digital, script_ocr e
+módulos auxiliares, mais os parâmetros de OCR e do extrator digital que alteram o resultado). Qualquer mudança na lógica
+de extração gera outra impressão digital e invalida as entradas antigas.
+Só registros sem ERRO e sem NO_CACHE são guardados (falhas podem ser transitórias, ex.: OCR indisponível;
+registros com NO_CACHE dependem do estado da execução, ex.: DPI reduzido pelo orçamento de memória).
+A tabela classificacoes guarda as decisões Digital/OCR do classifier pela mesma chave.
+Cada gravação é confirmada na hora (commit): uma execução interrompida não perde o que já guardou e não
+segura o lock de escrita do SQLite, de modo que outra execução (GUI, CLI ou serviço) pode usar o mesmo cache.
+Configuração: EXTRATOR_CACHE_DB (caminho), EXTRATOR_CACHE_MAX_ENTRIES, EXTRATOR_CACHE_MAX_AGE_DAYS.
+"""
+import hashlib
+import json
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from invoice_record import InvoiceRecord, NO_CACHE
+
+CACHE_PATH = os.environ.get("EXTRATOR_CACHE_DB") or str(Path.home() / ".extratorfaturas" / "cache.sqlite")
+CACHE_MAX_ENTRIES = int(os.environ.get("EXTRATOR_CACHE_MAX_ENTRIES", "200000"))
+CACHE_MAX_AGE_DAYS = float(os.environ.get("EXTRATOR_CACHE_MAX_AGE_DAYS", "365"))
+
+# Módulos cujo código define o resultado da extração
+FINGERPRINT_MODULES = ["script_digital", "script_ocr", "field_rules", "page_index", "pdf_context", "classifier",
+                       "invoice_record", "layout_templates", "postprocess"]
+
+_fingerprints = {}
+
+
+def _module_bytes(name):
+    """ Bytes que identificam o código de um módulo: fonte (.py) ou, no executável congelado, o bytecode. """
+    module = sys.modules.get(name) or __import__(name)
+    try:
+        with open(module.__file__, "rb") as f:
+            return f.read()
+    except Exception:
+        try:
+            return marshal.dumps(module.__spec__.loader.get_code(name))
+        except Exception:
+            return name.encode()
+
+
+def extractor_fingerprint(extra_functions=()):
+    """
+    Impressão digital da lógica de extração (calculada uma vez por processo).
+    extra_functions: funções de fora dos módulos de extração que também definem o registro
+    (ex.: detect_pdf_type e a montagem do registro no main_processor); entra o bytecode delas.
+    """
+    key = tuple(extra_functions)
+    if key not in _fingerprints:
+        h = hashlib.sha256()
+        for name in FINGERPRINT_MODULES:
+            h.update(name.encode())
+            h.update(_module_bytes(name))
+        for func in key:
+            h.update(func.__qualname__.encode())
+            h.update(marshal.dumps(func.__code__))
+        import postprocess, script_digital, script_ocr
+        h.update(repr((tuple(script_ocr.PDF_RESOLUTION_MATRIX), script_ocr.OCR_LANG, script_ocr.OCR_ROI_MODE,
+                       script_ocr.OCR_MAX_PAGES, script_ocr.LOW_MEMORY_MODE, script_ocr.OCR_COLORSPACE.name,
+                       script_ocr.OCR_MAX_PIXELS, script_ocr.OCR_MEMORY_BUDGET_MB,
+                       script_digital.HYBRID_OCR_ENABLED, script_digital.DIGITAL_MAX_PAGES,
+                       postprocess.TOTAL_TOLERANCE)).encode())
+        _fingerprints[key] = h.hexdigest()[:16]
+    return _fingerprints[key]
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache de resultados por (hash do PDF, impressão digital do extrator).
+        cache = ResultCache()
+        h = cache.file_hash(pdf_path)
+        dados = cache.get(h) or extrair(pdf_path)
+        cache.put(h, dados)
+        cache.evict(); cache.close()
+    """
+
+    def __init__(self, path=None, max_entries=None, max_age_days=None, extra_functions=()):
+        self.path = path or CACHE_PATH
+        self.max_entries = max_entries or CACHE_MAX_ENTRIES
+        self.max_age_days = max_age_days or CACHE_MAX_AGE_DAYS
+        self.fingerprint = extractor_fingerprint(extra_functions)
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS resultados (
+                hash TEXT NOT NULL, fingerprint TEXT NOT NULL, registro TEXT NOT NULL,
+                criado REAL NOT NULL, acessado REAL NOT NULL,
+                PRIMARY KEY (hash, fingerprint));
+            CREATE INDEX IF NOT EXISTS idx_resultados_acessado ON resultados (acessado);
+            CREATE TABLE IF NOT EXISTS classificacoes (
+                hash TEXT NOT NULL, fingerprint TEXT NOT NULL, tipo TEXT NOT NULL, criado REAL NOT NULL,
+                PRIMARY KEY (hash, fingerprint));
+            CREATE TABLE IF NOT EXISTS arquivos (
+                caminho TEXT PRIMARY KEY, tamanho INTEGER NOT NULL, mtime REAL NOT NULL, hash TEXT NOT NULL);
+        """)
+        self._conn.commit()
+
+    def file_hash(self, pdf_path):
+        """ SHA-256 do PDF; memoizado por (caminho, tamanho, mtime) para não reler arquivos inalterados. """
+        pdf_path = Path(pdf_path)
+        st = pdf_path.stat()
+        caminho = str(pdf_path.resolve())
+        with self._lock:
+            row = self._conn.execute("SELECT tamanho, mtime, hash FROM arquivos WHERE caminho = ?", (caminho,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return row[2]
+        h = file_sha256(pdf_path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?)", (caminho, st.st_size, st.st_mtime, h))
+            self._conn.commit()
+        return h
+
+    def get(self, file_hash):
+        with self._lock:
+            row = self._conn.execute("SELECT registro FROM resultados WHERE hash = ? AND fingerprint = ?",
+                                     (file_hash, self.fingerprint)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE resultados SET acessado = ? WHERE hash = ? AND fingerprint = ?",
+                               (time.time(), file_hash, self.fingerprint))
+            self._conn.commit()
+        return InvoiceRecord(json.loads(row[0]))
+
+    def put(self, file_hash, registro):
+        """ Guarda o registro final (sem as colunas de tempo); registros com ERRO ou NO_CACHE não são guardados. Retorna True se guardou. """
+        if registro.get("ERRO") or registro.get(NO_CACHE):
+            return False
+        registro = metrics.strip(registro)
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?)",
+                               (file_hash, self.fingerprint, json.dumps(registro, ensure_ascii=False, default=str), agora, agora))
+            self._conn.commit()
+            self.stored += 1
+        return True
+
+    def get_classification(self, file_hash):
+        """ Tipo (Digital/OCR) já decidido pelo classificador para este conteúdo, ou None. """
+        with self._lock:
+            row = self._conn.execute("SELECT tipo FROM classificacoes WHERE hash = ? AND fingerprint = ?",
+                                     (file_hash, self.fingerprint)).fetchone()
+        return row[0] if row else None
+
+    def put_classification(self, file_hash, tipo):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO classificacoes VALUES (?, ?, ?, ?)",
+                               (file_hash, self.fingerprint, tipo, time.time()))
+            self._conn.commit()
+
+    def evict(self):
+        """ Remove entradas de outras versões do extrator, entradas antigas e o excesso além de max_entries. """
+        limite = time.time() - self.max_age_days * 86400
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM resultados WHERE fingerprint != ? OR acessado < ?", (self.fingerprint, limite))
+            removidos = cur.rowcount
+            cur = self._conn.execute("""
+                DELETE FROM resultados WHERE rowid IN (
+                    SELECT rowid FROM resultados ORDER BY acessado DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+            removidos += cur.rowcount
+            self._conn.execute("DELETE FROM classificacoes WHERE fingerprint != ? OR criado < ?", (self.fingerprint, limite))
+            self._conn.execute("""
+                DELETE FROM arquivos WHERE hash NOT IN (SELECT hash FROM resultados)
+                    AND hash NOT IN (SELECT hash FROM classificacoes)""")
+            self._conn.commit()
+            self.evicted += removidos
+        return removidos
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stored": self.stored, "evicted": self.evicted,
+                "fingerprint": self.fingerprint}
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
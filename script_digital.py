@@ -1,74 +1,158 @@
 import fitz  # PyMuPDF
+import logging
+import os
 import re
-import pandas as pd
 from pathlib import Path
+import threading
 import traceback
 
+import layout_templates
+import postprocess
+from pdf_context import open_context
+from page_index import PageIndex, DocumentIndex
+from field_rules import FieldRule, literal_matcher
+from invoice_record import InvoiceRecord, NO_CACHE, to_amount
+
 # --- Função principal ---
-def extract_invoice_fields(pdf_path):
+def extract_invoice_fields(pdf_path, ctx=None):
+    """
+    Extrai os campos de uma fatura digital.
+    ctx: PdfContext já aberto (opcional), para reaproveitar o documento e a página 0 da detecção.
+    Todos os campos da página 0 são respondidos pelo mesmo PageIndex (palavras extraídas uma vez);
+    os que faltarem nela são procurados nas páginas seguintes pelo DocumentIndex (páginas indexadas sob
+    demanda, parando na primeira que responde).
+    Layouts já vistos (mesmo emissor e mesmas posições das âncoras do cabeçalho) são lidos direto nas
+    regiões do modelo aprendido (layout_templates); se a leitura não validar, vale a busca completa.
+    """
+    owned = False
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0) if doc.page_count > 0 else None
-        if not page:
+        ctx, owned = open_context(pdf_path, ctx)
+        doc_index = ctx.document_index(DIGITAL_LABEL_MATCHER, DIGITAL_MAX_PAGES)
+        index = doc_index.page(0, prime=False)
+        if not index:
             raise ValueError("PDF sem páginas")
 
-        data = {
-            "ARQUIVO": Path(pdf_path).name,
-            "EMISOR": extract_emisor(page),
-            "Nº CLIENTE": extract_num_cliente(page),
-            "CLIENTE": extract_cliente(page),
-            "REFERENCIA FACTURA": extract_referencia_factura(page),
-            "DESCRIPCIÓN": extract_descripcion(page),
-            "BASE IMPONIBLE": extract_base_imponible(page),
-            "IMPUESTOS": extract_impuestos(page),
-            "IMPORTE TOTAL": extract_importe_total(page),
-            "MOEDA": extract_moeda(page),   
-            "OBSERVACIONES": extract_observaciones(doc),
-        }
+        emisor = extract_emisor(index)
+        especial = is_special_layout(index)
+        layout, lidos = (None, None) if especial else template_lookup(index, emisor)
+        if not lidos: # Busca completa: todos os rótulos localizados numa passada
+            index.prime(DIGITAL_LABEL_MATCHER)
+
+        data = InvoiceRecord({"ARQUIVO": Path(pdf_path).name, "EMISOR": emisor})
+        if lidos:
+            data.update(lidos)
+        for key, extractor in PAGE_FIELD_EXTRACTORS.items():
+            if key != "EMISOR" and not (lidos and key in lidos):
+                data[key] = extractor(index)
+        if not (lidos and "OBSERVACIONES" in lidos):
+            data["OBSERVACIONES"] = extract_observaciones(doc_index)
 
         print(f"\n📝 {data['ARQUIVO']}")
         print(f"🔢 DEBUG Valores -> BASE: {data['BASE IMPONIBLE']} | IMPUESTOS: {data['IMPUESTOS']} | TOTAL: {data['IMPORTE TOTAL']}")
 
         # Detecção e extração por layout alternativo
-        if is_special_layout(page):
+        if especial:
             print("🔁 Detecção de layout alternativo – aplicando extração especial...")
-            special_vals = extract_values_for_special_layout(page)
+            special_vals = extract_values_for_special_layout(index)
             for key, val in special_vals.items():
                 data[key] = val  # <-- sobrescreve SEM verificar se está preenchido
 
         # Fallback (apenas se ainda houver campo ausente)
-        if any(data.get(k) is None for k in ["BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL"]):
-            fallback_vals = extract_from_text_fallback(page)
+        if any(data.get(k) is None for k in AMOUNT_KEYS):
+            fallback_vals = extract_from_text_fallback(index)
             for key, val in fallback_vals.items():
                 if data.get(key) is None:
                     data[key] = val
 
-        return validate_totals(data)
+        # Campos ausentes na página 0: páginas seguintes (anexos, totais na última página)
+        for key, val in extract_from_next_pages(doc_index, data).items():
+            data[key] = val
+
+        # Híbrido: importes que continuam ausentes podem estar numa imagem colada perto dos rótulos
+        if HYBRID_OCR_ENABLED and any(data.get(k) is None for k in AMOUNT_KEYS):
+            for key, val in extract_missing_from_images(index, data).items():
+                if data.get(key) is None:
+                    data[key] = val
+
+        validate_totals(data)
+        if layout and not lidos:
+            template_learn(index, layout, data)
+        return data
 
     except Exception as e:
         print(f"❌ Erro ao processar {pdf_path}: {e}")
         print(traceback.format_exc())
-        return {"ARQUIVO": Path(pdf_path).name, "ERRO": str(e)}
+        return InvoiceRecord({"ARQUIVO": Path(pdf_path).name, "ERRO": str(e)})
+    finally:
+        if owned and ctx:
+            ctx.close()
 
 
 # --- Funções auxiliares ---
+# Todas aceitam um PageIndex (ou uma página fitz, indexada na hora).
+def _as_index(page):
+    """
+    PageIndex da página. Uma página fitz é indexada com todos os rótulos das regras localizados numa única
+    passada; um PageIndex é usado como veio (o do DocumentIndex já passou pelo prime; o da página 0 numa
+    leitura por modelo de layout não precisa, os poucos rótulos são procurados um a um).
+    """
+    if isinstance(page, PageIndex):
+        return page
+    index = PageIndex(page)
+    index.prime(DIGITAL_LABEL_MATCHER)
+    return index
+
+def apply_rule(page, rule):
+    """
+    Aplica uma FieldRule literal ao índice da página. Para cada rótulo (em ordem de prioridade),
+    pega a primeira ocorrência, lê o texto da região e aplica o padrão do valor.
+    Regiões: "line" (linha inteira ± margin), "totals" (idem, só abaixo da âncora TOTALS)
+    e "right" (janela de 100pt à direita do rótulo).
+    """
+    return locate_rule(page, rule)[0]
+
+def locate_rule(page, rule, debug=True):
+    """ Como apply_rule, mas retorna (valor, região lida, y0 da âncora TOTALS ou None); sem valor: (None, None, None). """
+    index = _as_index(page)
+    ref_start = None
+    if rule.region == "totals":
+        totals_found = index.first(TOTALS_ANCHOR)
+        if totals_found:
+            ref_start = totals_found.y0
+    for l in rule.labels:
+        found = index.find(l)
+        if ref_start:
+            found = [r for r in found if r.y0 > ref_start]
+        if not found:
+            continue
+        rect = found[0]
+        if rule.region == "right":
+            search_rect = fitz.Rect(rect.x1 + 2, rect.y0 - rule.margin, min(rect.x1 + 100, index.rect.width - 5), rect.y1 + rule.margin)
+        else:
+            search_rect = fitz.Rect(0, rect.y0 - rule.margin, index.rect.width, rect.y1 + rule.margin)
+        text = index.text_in(search_rect)
+        if debug and rule.region != "line":
+            print(f"🔍 [DEBUG] {rule.name} ({rule.region}) - texto capturado: '{text.strip()}'")
+        match = rule.regex.search(text)
+        if match:
+            value = match.group(1)
+            return (rule.normalizer(value) if rule.normalizer else value), search_rect, ref_start
+        if rule.region == "right":
+            break # Fallback lateral olha apenas a primeira ocorrência
+    return None, None, None
+
 def extract_emisor(page):
     try:
-        full_text = page.get_text("text")
-        emisor_labels = [
-            r"Endesa Energía, S[.]A[.]U[.]", r"ENDESA MOBILITY S[.]L[.]",
-            r"Endesa Medios y Sistemas S[.]L[.]", r"ENDESA, Sociedad Anónima",
-            r"EDISTRIBUCI[^\n]*"
-        ]
-        for pattern in emisor_labels:
-            match = re.search(r"^\s*(" + pattern + ")", full_text, re.IGNORECASE | re.MULTILINE)
+        full_text = _as_index(page).text
+        for regex in EMISOR_START_RES:
+            match = regex.search(full_text)
             if match:
                 return match.group(1).strip()
-        for pattern in emisor_labels:
-            match = re.search("(" + pattern + ")", full_text, re.IGNORECASE)
+        for regex in EMISOR_ANY_RES:
+            match = regex.search(full_text)
             if match:
                 return match.group(1).strip()
-        match = re.search(r"(ENDESA[^\n]*)", full_text, re.IGNORECASE)
+        match = EMISOR_FALLBACK_RE.search(full_text)
         if match:
             return match.group(1).strip()
     except:
@@ -76,89 +160,70 @@ def extract_emisor(page):
     return "N/A"
 
 def extract_num_cliente(page):
-    return _extract_by_label(page, ["Nº Cliente:", "N° Cliente:", "No Cliente:", "Customer Nº:", "Customer N°:", "Customer No:","Nº Cliente"], r"(\d{6,})")
+    return apply_rule(page, DIGITAL_RULES["Nº CLIENTE"])
 
 def extract_cliente(page):
     try:
-        labels = ["Nombre:", "Name:", "Razón Social:"]
-        for label in labels:
-            rects = page.search_for(label)
-            if rects:
-                rect = rects[0]
-                line_rect = fitz.Rect(0, rect.y0 - 1, page.rect.width, rect.y1 + 1)
-                text = page.get_text("text", clip=line_rect)
-                match = re.search(r"(?:Nombre|Name|Razón Social)[:\s]+(.*?)(?:\s*NIF/CIF:|\s*NIF IVA:|\s*Dirección Fiscal:|$)", text, re.IGNORECASE)
-                if match:
-                    return match.group(1).strip().removeprefix("F:").strip()
+        return apply_rule(page, DIGITAL_RULES["CLIENTE"])
     except:
         pass
     return None
 
 def extract_referencia_factura(page):
-    # Modificação: Coloquei um parêntese externo para capturar *qualquer* um dos padrões
-    # e usei grupos não-capturantes (?:...) para as alternativas internas.
-    pattern = r"((?:FT\s?\d{2,4}/\d{5,})|(?:\d{2}\s*/\s*\d{8,}\s*/\s*\d{2}))"
-    # Os rótulos parecem OK
-    labels = ["Nº Factura:", "N° Factura:", "Invoice Nº:", "Invoice No:", "Amendment Invoice Nº:"]
-    # A chamada para _extract_by_label continua a mesma, mas agora match.group(1) funcionará
-    return _extract_by_label(page, labels, pattern)
+    return apply_rule(page, DIGITAL_RULES["REFERENCIA FACTURA"])
+
+def _descripcion_area(index, labels=None, end_labels=None):
+    """
+    (área da descrição, rótulo inicial, rótulo final ou None) ou None se nenhum rótulo inicial estiver na página.
+    labels / end_labels: padrão DESC_LABELS / DESC_END_LABELS.
+    """
+    for label in DESC_LABELS if labels is None else labels:
+        desc_rect = index.first(label)
+        if desc_rect:
+            break
+    else:
+        return None
+    bottom_y, end = index.rect.height, None
+    for el in DESC_END_LABELS if end_labels is None else end_labels:
+        found = index.first(el)
+        if found and found.y0 < bottom_y:
+            bottom_y, end = found.y0, el
+    return fitz.Rect(0, desc_rect.y1, index.rect.width * 0.35, bottom_y), label, end
+
+def _descripcion_text(index, area):
+    words = index.words_in(area, sort=True)
+    texts = [w[4] for w in words if not DESC_SKIP_RE.fullmatch(w[4])]
+    return WS_RE.sub(' ', " ".join(texts)).strip()
 
 def extract_descripcion(page):
     try:
-        labels = ["Descripción", "Description", "Detalle de la Factura", "Invoice detail", "Concepto"]
-        end_labels = ["Impuestos repercutidos", "Output taxes", "Totales", "TOTALS", "Subtotal", "BASE IMPONIBLE", "Observaciones", "Observations", "Pag.", "Rogamos envíen"]
-        desc_rect = None
-        for l in labels:
-            found = page.search_for(l)
-            if found:
-                desc_rect = found[0]
-                break
-        if not desc_rect:
+        index = _as_index(page)
+        found = _descripcion_area(index)
+        if not found:
             return "N/A"
-        top_y = desc_rect.y1
-        bottom_y = page.rect.height
-        for el in end_labels:
-            found = page.search_for(el)
-            if found:
-                bottom_y = min(bottom_y, found[0].y0)
-        area = fitz.Rect(0, top_y, page.rect.width * 0.35, bottom_y)
-        words = page.get_text("words", clip=area, sort=True)
-        texts = [w[4] for w in words if not re.fullmatch(r"[\d.,\s-]+|EUR|USD|%|UN|MMBTU|IVA|VAT", w[4], re.IGNORECASE)]
-        return re.sub(r'\s+', ' ', " ".join(texts)).strip()
+        return _descripcion_text(index, found[0])
     except:
         return "N/A"
 
 def extract_base_imponible(page):
-    return extract_valor_area(page, ["BASE IMPONIBLE", "Tax base"], label="BASE IMPONIBLE")
+    try:
+        return apply_rule(page, DIGITAL_RULES["BASE IMPONIBLE"])
+    except Exception as e:
+        print(f"⚠️ Erro ao extrair BASE IMPONIBLE: {e}")
+    return None
 
 def extract_impuestos(page):
-    return extract_valor_area(page, ["IVA repercutido", "VAT Output tax", "Cuota"], label="IMPUESTOS")
+    try:
+        return apply_rule(page, DIGITAL_RULES["IMPUESTOS"])
+    except Exception as e:
+        print(f"⚠️ Erro ao extrair IMPUESTOS: {e}")
+    return None
 
 def extract_importe_total(page):
-    return extract_valor_area(page, ["TOTAL importe Factura", "Invoice total value"], label="IMPORTE TOTAL")
-
-def extract_valor_area(page, labels, label="VALOR", width_ratio=0.6, height_limit=10):
     try:
-        ref_start = None
-        totals_found = page.search_for("TOTALS")
-        if totals_found:
-            ref_start = totals_found[0].y0
-        for l in labels:
-            found = page.search_for(l)
-            if not found:
-                continue
-            candidates = [r for r in found if not ref_start or r.y0 > ref_start]
-            if not candidates:
-                continue
-            label_rect = candidates[0]
-            search_rect = fitz.Rect(0, label_rect.y0 - 1, page.rect.width, label_rect.y1 + 1)
-            text = page.get_text("text", clip=search_rect)
-            print(f"🔍 [DEBUG] {label} - linha capturada: '{text.strip()}'")
-            match = re.search(r"(-?[\d\s.,]{5,})", text)
-            if match:
-                return normalize_number(match.group(1))
+        return apply_rule(page, DIGITAL_RULES["IMPORTE TOTAL"])
     except Exception as e:
-        print(f"⚠️ Erro ao extrair {label}: {e}")
+        print(f"⚠️ Erro ao extrair IMPORTE TOTAL: {e}")
     return None
 
 def normalize_number(text):
@@ -167,7 +232,7 @@ def normalize_number(text):
             return None
 
         text = str(text).strip()
-        text = re.sub(r"[€$EURUSD]", "", text).strip()
+        text = CURRENCY_CHARS_RE.sub("", text).strip()
 
         # Detecta valor negativo com hífen no final (ex: "1,59-")
         is_negative = False
@@ -176,10 +241,10 @@ def normalize_number(text):
             text = text[:-1].strip()
 
         # Remove espaços entre dígitos
-        text = re.sub(r"(?<=\d)\s+(?=\d)", "", text)
+        text = DIGIT_SPACES_RE.sub("", text)
 
         # Trata número sem separador com 2 casas como centavos
-        if re.fullmatch(r"\d{5,}", text):
+        if CENTS_ONLY_RE.fullmatch(text):
             text = text[:-2] + "." + text[-2:]
         elif ',' in text and '.' in text:
             if text.rfind(',') > text.rfind('.'):
@@ -203,20 +268,94 @@ def normalize_number(text):
 
 
 def _extract_by_label(page, labels, pattern):
+    """ Regra ad hoc (linha inteira ± 2pt) para rótulos/padrão fora da tabela DIGITAL_RULES. """
     try:
-        for label in labels:
-            found = page.search_for(label)
-            if found:
-                rect = found[0]
-                line_rect = fitz.Rect(0, rect.y0 - 2, page.rect.width, rect.y1 + 2)
-                text = page.get_text("text", clip=line_rect)
-                match = re.search(pattern, text)
-                if match:
-                    return match.group(1)
+        return apply_rule(page, FieldRule("_ad_hoc", labels, pattern, region="line", margin=2))
     except:
         pass
     return None
 
+
+# --- Regras de campo (compiladas uma vez na importação) ---
+LINE_VALUE_PATTERN = r"(-?[\d\s.,]{5,})"
+SIDE_VALUE_PATTERN = r"(-?[\d.,]+)"
+TOTALS_ANCHOR = "TOTALS"
+
+def _clean_cliente(value):
+    return value.strip().removeprefix("F:").strip()
+
+DIGITAL_RULES = {r.name: r for r in [
+    FieldRule("Nº CLIENTE", ["Nº Cliente:", "N° Cliente:", "No Cliente:", "Customer Nº:", "Customer N°:", "Customer No:", "Nº Cliente"],
+              r"(\d{6,})", region="line", margin=2),
+    FieldRule("CLIENTE", ["Nombre:", "Name:", "Razón Social:"],
+              r"(?:Nombre|Name|Razón Social)[:\s]+(.*?)(?:\s*NIF/CIF:|\s*NIF IVA:|\s*Dirección Fiscal:|$)",
+              region="line", margin=1, normalizer=_clean_cliente, flags=re.IGNORECASE),
+    # Grupo externo captura *qualquer* um dos formatos; alternativas internas não-capturantes
+    FieldRule("REFERENCIA FACTURA", ["Nº Factura:", "N° Factura:", "Invoice Nº:", "Invoice No:", "Amendment Invoice Nº:"],
+              r"((?:FT\s?\d{2,4}/\d{5,})|(?:\d{2}\s*/\s*\d{8,}\s*/\s*\d{2}))", region="line", margin=2),
+    FieldRule("BASE IMPONIBLE", ["BASE IMPONIBLE", "Tax base"], LINE_VALUE_PATTERN, region="totals", margin=1, normalizer=normalize_number),
+    FieldRule("IMPUESTOS", ["IVA repercutido", "VAT Output tax", "Cuota"], LINE_VALUE_PATTERN, region="totals", margin=1, normalizer=normalize_number),
+    FieldRule("IMPORTE TOTAL", ["TOTAL importe Factura", "Invoice total value"], LINE_VALUE_PATTERN, region="totals", margin=1, normalizer=normalize_number),
+]}
+
+# Fallback: valor na janela à direita do rótulo
+FALLBACK_RULES = [
+    FieldRule("BASE IMPONIBLE", ["BASE IMPONIBLE"], SIDE_VALUE_PATTERN, region="right", margin=1, normalizer=normalize_number),
+    FieldRule("IMPUESTOS", ["repercutido"], SIDE_VALUE_PATTERN, region="right", margin=1, normalizer=normalize_number),
+    FieldRule("IMPORTE TOTAL", ["TOTAL Importe Factura"], SIDE_VALUE_PATTERN, region="right", margin=1, normalizer=normalize_number),
+]
+
+AMOUNT_KEYS = ["BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL"]
+# Páginas consultadas pelo índice do documento (0: todas)
+DIGITAL_MAX_PAGES = int(os.environ.get("EXTRATOR_DIGITAL_MAX_PAGES", "0")) or None
+
+# Extração híbrida (OCR de recortes de imagem perto dos rótulos dos importes ausentes). Desativada por
+# padrão: o primeiro recorte carrega o PaddleOCR no processo do extrator digital (cada worker do pool)
+HYBRID_OCR_ENABLED = os.environ.get("EXTRATOR_HYBRID_OCR", "0") == "1"
+HYBRID_NEAR_PT = 120              # distância máxima entre rótulo (ou âncora) e imagem
+HYBRID_MIN_IMAGE_AREA = 400       # pt²: ícones e logotipos pequenos ficam de fora
+HYBRID_MAX_PAGE_FRACTION = 0.35   # imagem maior que isso não é um recorte (seria OCR de página)
+HYBRID_MAX_CLIPS = 3
+HYBRID_ROW_TOLERANCE = 4          # pt: folga vertical para "mesma linha do rótulo"
+HYBRID_NUMBER_RE = re.compile(r"[€$]?\s*-?[\d\s.,]*\d[.,]\d{1,2}\s*-?\s*(?:€|EUR)?")
+
+DESC_LABELS = ["Descripción", "Description", "Detalle de la Factura", "Invoice detail", "Concepto"]
+DESC_END_LABELS = ["Impuestos repercutidos", "Output taxes", "Totales", "TOTALS", "Subtotal", "BASE IMPONIBLE", "Observaciones", "Observations", "Pag.", "Rogamos envíen"]
+OBS_LABELS = ["Observaciones", "Observations"]
+OBS_END_LABELS = ["Pag.", "ENDESA", "Please send proof", "Rogamos envíen"]
+
+# Todos os rótulos literais localizados numa única passada por página (PageIndex.prime)
+DIGITAL_LABEL_MATCHER = literal_matcher(list(DIGITAL_RULES.values()) + FALLBACK_RULES,
+                                        DESC_LABELS, DESC_END_LABELS, OBS_LABELS, OBS_END_LABELS, [TOTALS_ANCHOR])
+
+# Modelos de layout: âncoras da impressão digital são os primeiros TEMPLATE_ANCHOR_COUNT rótulos do
+# cabeçalho (regras de linha e descrição) presentes na página, que não se movem com o número de itens;
+# a assinatura das regras e dos rótulos de descrição/observações invalida modelos antigos
+TEMPLATE_ANCHOR_LABELS = [l for r in DIGITAL_RULES.values() if r.region == "line" for l in r.labels] + DESC_LABELS
+TEMPLATE_ANCHOR_COUNT = 2
+TEMPLATE_RULES_SIGNATURE = "|".join([f"{r.name}:{r.labels}:{r.pattern}:{r.region}:{r.margin}" for r in DIGITAL_RULES.values()]
+                                    + [f"{DESC_LABELS}:{DESC_END_LABELS}:{OBS_LABELS}:{OBS_END_LABELS}"])
+
+_EMISOR_PATTERNS = [
+    r"Endesa Energía, S[.]A[.]U[.]", r"ENDESA MOBILITY S[.]L[.]",
+    r"Endesa Medios y Sistemas S[.]L[.]", r"ENDESA, Sociedad Anónima",
+    r"EDISTRIBUCI[^\n]*"
+]
+EMISOR_START_RES = [re.compile(r"^\s*(" + p + ")", re.IGNORECASE | re.MULTILINE) for p in _EMISOR_PATTERNS]
+EMISOR_ANY_RES = [re.compile("(" + p + ")", re.IGNORECASE) for p in _EMISOR_PATTERNS]
+EMISOR_FALLBACK_RE = re.compile(r"(ENDESA[^\n]*)", re.IGNORECASE)
+
+SPECIAL_BASE_RE = re.compile(r"BASE IMPONIBLE[\s:\n]*(-?[\d.,]+-?)", re.IGNORECASE)
+SPECIAL_TAX_RE = re.compile(r"repercutido[^\n\r]*(?:[\s/]+)?(-?[\d.,]+-?)", re.IGNORECASE)
+SPECIAL_TOTAL_RE = re.compile(r"TOTAL Importe Factura[\s:\n]*(-?[\d.,]+-?)", re.IGNORECASE)
+
+MOEDA_RE = re.compile(r"\b(€|EUR|USD|US\$)\b")
+DESC_SKIP_RE = re.compile(r"[\d.,\s-]+|EUR|USD|%|UN|MMBTU|IVA|VAT", re.IGNORECASE)
+WS_RE = re.compile(r"\s+")
+CURRENCY_CHARS_RE = re.compile(r"[€$EURUSD]")
+DIGIT_SPACES_RE = re.compile(r"(?<=\d)\s+(?=\d)")
+CENTS_ONLY_RE = re.compile(r"\d{5,}")
+
 def validate_totals(data):
     try:
         base = data.get("BASE IMPONIBLE")
@@ -230,50 +369,67 @@ def validate_totals(data):
         pass
     return data
 
+def _as_document_index(doc):
+    """ DocumentIndex de um PdfContext (cacheado nele), de um documento fitz ou o próprio DocumentIndex. """
+    if isinstance(doc, DocumentIndex):
+        return doc
+    if hasattr(doc, "document_index"):
+        return doc.document_index(DIGITAL_LABEL_MATCHER, DIGITAL_MAX_PAGES)
+    return DocumentIndex(doc, DIGITAL_LABEL_MATCHER, DIGITAL_MAX_PAGES)
+
 def extract_observaciones(doc):
+    """
+    doc: DocumentIndex, PdfContext ou documento fitz. As páginas são indexadas sob demanda, até a
+    primeira que tiver o rótulo.
+    """
     try:
-        obs_labels = ["Observaciones", "Observations"]
-        end_labels = ["Pag.", "ENDESA", "Please send proof", "Rogamos envíen"]
-        for i in range(doc.page_count):
-            page = doc.load_page(i)
-            for label in obs_labels:
-                found = page.search_for(label)
-                if not found:
-                    continue
-                label_rect = found[0]
-                search_rect = fitz.Rect(0, label_rect.y1, page.rect.width, page.rect.height)
-                for end_label in end_labels:
-                    found_end = page.search_for(end_label, clip=search_rect)
-                    if found_end:
-                        end_y = min(r.y0 for r in found_end)
-                        search_rect.y1 = end_y
-                        break
-                blocks = page.get_text("blocks", clip=search_rect, sort=True)
-                obs_text = " ".join([b[4].strip() for b in blocks if b[4].strip()])
-                return re.sub(r'\s+', ' ', obs_text).strip()
+        for _, index in _as_document_index(doc).pages():
+            found = _observaciones_area(index)
+            if found:
+                return _observaciones_text(index, found[0])
         return "N/A"
     except Exception as e:
         print(f"Erro ao extrair OBSERVACIONES: {e}")
         return "N/A"
 
+def _observaciones_area(index, labels=None, end_labels=None):
+    """ (área das observações, rótulo, rótulo final ou None) na página, ou None sem rótulo (padrão: OBS_LABELS / OBS_END_LABELS). """
+    for label in OBS_LABELS if labels is None else labels:
+        label_rect = index.first(label)
+        if not label_rect:
+            continue
+        search_rect = fitz.Rect(0, label_rect.y1, index.rect.width, index.rect.height)
+        for end_label in OBS_END_LABELS if end_labels is None else end_labels:
+            found_end = [r for r in index.find(end_label) if r.intersects(search_rect)]
+            if found_end:
+                search_rect.y1 = min(r.y0 for r in found_end)
+                return search_rect, label, end_label
+        return search_rect, label, None
+    return None
+
+def _observaciones_text(index, area):
+    words = index.words_in(area, sort=True)
+    obs_text = " ".join([w[4].strip() for w in words if w[4].strip()])
+    return WS_RE.sub(' ', obs_text).strip()
+
 def is_special_layout(page):
-    full_text = page.get_text("text")
+    full_text = _as_index(page).text
     return ("Factura Rectificativa" in full_text) or ("TOTALS" not in full_text and "TOTALES" not in full_text)
 
 def extract_values_for_special_layout(page):
     special_data = {}
     try:
-        full_text = page.get_text("text")
+        full_text = _as_index(page).text
 
-        match_base = re.search(r"BASE IMPONIBLE[\s:\n]*(-?[\d.,]+-?)", full_text, re.IGNORECASE)
+        match_base = SPECIAL_BASE_RE.search(full_text)
         if match_base:
             special_data["BASE IMPONIBLE"] = normalize_number(match_base.group(1))
 
-        match_tax = re.search(r"repercutido[^\n\r]*(?:[\s/]+)?(-?[\d.,]+-?)", full_text, re.IGNORECASE)
+        match_tax = SPECIAL_TAX_RE.search(full_text)
         if match_tax:
             special_data["IMPUESTOS"] = normalize_number(match_tax.group(1))
 
-        match_total = re.search(r"TOTAL Importe Factura[\s:\n]*(-?[\d.,]+-?)", full_text, re.IGNORECASE)
+        match_total = SPECIAL_TOTAL_RE.search(full_text)
         if match_total:
             special_data["IMPORTE TOTAL"] = normalize_number(match_total.group(1))
 
@@ -286,55 +442,324 @@ def extract_values_for_special_layout(page):
 def extract_from_text_fallback(page):
     fallback_data = {}
     try:
-        keywords = {
-            "BASE IMPONIBLE": "BASE IMPONIBLE",
-            "IMPUESTOS": "repercutido",
-            "IMPORTE TOTAL": "TOTAL Importe Factura"
-        }
-        for campo, palavra in keywords.items():
-            found = page.search_for(palavra)
-            if found:
-                rect = found[0]
-                search_rect = fitz.Rect(
-                    rect.x1 + 2,
-                    rect.y0 - 1,
-                    min(rect.x1 + 100, page.rect.width - 5),
-                    rect.y1 + 1
-                )
-                texto_lateral = page.get_text("text", clip=search_rect)
-                print(f"🔍 [Fallback DEBUG] {campo} ao lado de '{palavra}': '{texto_lateral.strip()}'")
-                match = re.search(r"(-?[\d.,]+)", texto_lateral)
-                if match:
-                    fallback_data[campo] = normalize_number(match.group(1))
+        for rule in FALLBACK_RULES:
+            value = apply_rule(page, rule)
+            if value is not None:
+                fallback_data[rule.name] = value
         return fallback_data
     except Exception as e:
         print(f"❌ Erro no fallback: {e}")
         return {}
 
+def _ausente(value):
+    return value is None or value == "N/A"
+
+def extract_from_next_pages(doc, data):
+    """
+    Campos que ficaram ausentes na página 0 procurados nas páginas seguintes com os mesmos extratores
+    (e, para os importes, as regras de fallback), cada página indexada uma única vez e só se algum campo
+    ainda faltar. Cada campo fica com o valor da primeira página que o responde.
+    """
+    doc_index = _as_document_index(doc)
+    missing = [k for k in PAGE_FIELD_EXTRACTORS if _ausente(data.get(k))]
+    found = {}
+    if not missing or doc_index.page_count < 2:
+        return found
+    try:
+        for number, index in doc_index.pages(start=1):
+            fallback = None
+            for key in list(missing):
+                value = PAGE_FIELD_EXTRACTORS[key](index)
+                if _ausente(value) and key in AMOUNT_KEYS:
+                    if fallback is None:
+                        fallback = extract_from_text_fallback(index)
+                    value = fallback.get(key)
+                if not _ausente(value):
+                    found[key] = value
+                    missing.remove(key)
+            if not missing:
+                break
+        if found:
+            logging.debug(f"[Páginas seguintes] {found} ({doc_index.indexed_pages}/{doc_index.page_count} página(s) indexadas)")
+    except Exception as e:
+        logging.error(f"Erro ao procurar campos nas páginas seguintes: {e}")
+    return found
+
+def _distance(a, b):
+    """ Distância (pt) entre dois retângulos; 0 se se tocam. """
+    dx = max(0, a.x0 - b.x1, b.x0 - a.x1)
+    dy = max(0, a.y0 - b.y1, b.y0 - a.y1)
+    return max(dx, dy)
+
+def _hybrid_candidates(index, missing):
+    """
+    Imagens da página que podem conter os importes ausentes: recortes pequenos (nem ícones, nem a
+    página inteira) perto dos rótulos dos campos ausentes. Sem nenhum rótulo na camada de texto (tabela
+    inteira colada como imagem), vale a distância à âncora TOTALS ou, sem ela, as imagens mais baixas.
+    Retorna (imagens ordenadas por proximidade, {campo: retângulo do rótulo}).
+    """
+    page_area = abs(index.rect)
+    images = []
+    for info in index.page.get_image_info():
+        r = fitz.Rect(info["bbox"]) & index.rect
+        if not r.is_empty and HYBRID_MIN_IMAGE_AREA <= abs(r) <= page_area * HYBRID_MAX_PAGE_FRACTION:
+            images.append(r)
+    if not images:
+        return [], {}
+
+    labels = {}
+    for key in missing:
+        for rule in (DIGITAL_RULES[key], *[r for r in FALLBACK_RULES if r.name == key]):
+            found = next((index.first(l) for l in rule.labels if index.first(l)), None)
+            if found:
+                labels[key] = found
+                break
+    anchors = list(labels.values()) or [a for a in [index.first(TOTALS_ANCHOR)] if a]
+    if anchors:
+        near = [(min(_distance(img, a) for a in anchors), img) for img in images]
+        near = [(d, img) for d, img in near if d <= HYBRID_NEAR_PT]
+    else:
+        near = [(-img.y1, img) for img in images]
+    near.sort(key=lambda t: t[0])
+    return [img for _, img in near[:HYBRID_MAX_CLIPS]], labels
+
+def _value_for_label(boxes, label):
+    """ Primeiro número OCR na mesma linha, à direita do rótulo; senão logo abaixo dele. """
+    numbers = [(r, normalize_number(t)) for r, t in boxes if HYBRID_NUMBER_RE.fullmatch(t.strip())]
+    numbers = [(r, v) for r, v in numbers if v is not None]
+    same_row = [(r, v) for r, v in numbers
+                if r.x0 >= label.x0 and r.y0 - HYBRID_ROW_TOLERANCE <= (label.y0 + label.y1) / 2 <= r.y1 + HYBRID_ROW_TOLERANCE]
+    if same_row:
+        return min(same_row, key=lambda t: t[0].x0)[1]
+    below = [(r, v) for r, v in numbers
+             if 0 <= r.y0 - label.y1 <= HYBRID_NEAR_PT and r.x0 < label.x1 and r.x1 > label.x0]
+    if below:
+        return min(below, key=lambda t: t[0].y0)[1]
+    return None
+
+def extract_missing_from_images(page, data):
+    """
+    Extração híbrida: OCR só das imagens perto dos rótulos dos importes ainda ausentes (get_pixmap com
+    clip), sem OCR da página inteira. Rótulo e valor dentro da imagem são lidos pelas regras do OCR; rótulo
+    na camada de texto e valor na imagem são casados pela posição. Retorna {campo: valor} só com o que achou.
+    """
+    missing = [k for k in AMOUNT_KEYS if data.get(k) is None]
+    found = {}
+    try:
+        index = _as_index(page)
+        clips, labels = _hybrid_candidates(index, missing)
+        if not clips:
+            return found
+        import script_ocr # Import tardio: o engine só é carregado se houver recorte a ler
+        if script_ocr.get_ocr_engine() is None:
+            # Sem engine o importe fica ausente só nesta execução: o registro não vai ao cache de resultados
+            data[NO_CACHE] = "OCR híbrido sem engine"
+            return found
+        for clip in clips:
+            boxes = script_ocr.ocr_clip_boxes(index.page, clip)
+            if not boxes:
+                continue
+            # Já normalizados pelas regras do OCR ('1234.56'): só a conversão para float
+            for key, val in script_ocr.extract_amounts_from_text([t for _, t in boxes]).items():
+                if key in missing and key not in found:
+                    found[key] = to_amount(val)
+            for key, label in labels.items():
+                if key not in found:
+                    val = _value_for_label(boxes, label)
+                    if val is not None:
+                        found[key] = val
+            if all(k in found for k in missing):
+                break
+        found = {k: v for k, v in found.items() if v is not None}
+        logging.info(f"[Híbrido] OCR de {len(clips)} recorte(s) para {missing}: {found}")
+    except Exception as e:
+        logging.error(f"[Híbrido] Erro na extração híbrida: {e}")
+    return found
+
+# --- Modelos de layout (layout_templates) ---
+# Aberto no primeiro uso, um por processo; EXTRATOR_TEMPLATES=0 desativa.
+_template_store = None
+_template_store_lock = threading.Lock()
+_template_store_init_done = False
+
+def get_template_store():
+    """ Modelos de layout do processo, ou None se desativado/indisponível. """
+    global _template_store, _template_store_init_done
+    if _template_store_init_done:
+        return _template_store
+    with _template_store_lock:
+        if not _template_store_init_done:
+            try:
+                if layout_templates.TEMPLATES_ENABLED:
+                    _template_store = layout_templates.TemplateStore()
+            except Exception as e:
+                logging.warning(f"[Modelo] Modelos de layout indisponíveis: {e}")
+            _template_store_init_done = True
+    return _template_store
+
+def layout_key(page, emisor):
+    """ Impressão digital do layout da página (emissor + âncoras do cabeçalho), ou None sem emissor/âncoras. """
+    if _ausente(emisor):
+        return None
+    index = _as_index(page)
+    anchors = []
+    for label in TEMPLATE_ANCHOR_LABELS:
+        rect = index.first(label)
+        if rect:
+            anchors.append((label.lower(), rect.x0, rect.y0))
+            if len(anchors) == TEMPLATE_ANCHOR_COUNT:
+                break
+    if not anchors:
+        return None
+    return layout_templates.layout_fingerprint(emisor, (index.rect.width, index.rect.height), anchors,
+                                               TEMPLATE_RULES_SIGNATURE)
+
+def _amounts_ok(data):
+    """ BASE e TOTAL presentes e conferindo com o imposto (lido ou TOTAL - BASE), como o TOTAL_OK do pós-processamento. """
+    base, total = data.get("BASE IMPONIBLE"), data.get("IMPORTE TOTAL")
+    if base is None or total is None:
+        return False
+    tax = data.get("IMPUESTOS")
+    if tax is None:
+        tax = round(total - base, 2)
+    tol = postprocess.TOTAL_TOLERANCE
+    return abs(base + tax - total) <= tol and abs(total) >= abs(base) - tol
+
+def read_with_template(page, campos):
+    """
+    Leitura direta: cada campo do modelo lido só na sua região (text_in + padrão da regra), sem procurar
+    os rótulos; regiões dos importes deslocadas com a âncora TOTALS. A região tem de conter um rótulo da
+    regra e o valor tem de casar. DESCRIPCIÓN e OBSERVACIONES guardam os rótulos inicial e final que
+    delimitaram a área e só eles são procurados (tem de achar os mesmos dois). Retorna {campo: valor}, ou
+    None se algum campo falhar ou os importes não conferirem.
+    """
+    index = _as_index(page)
+    totals = None
+    found = {}
+    for key, modelo in campos.items():
+        if key in TEMPLATE_AREA_FIELDS:
+            area_fn, text_fn = TEMPLATE_AREA_FIELDS[key]
+            area = area_fn(index, [modelo["rotulo"]], [modelo["fim"]] if modelo["fim"] else [])
+            if not area or area[2] != modelo["fim"]:
+                return None
+            found[key] = text_fn(index, area[0])
+            continue
+        x0, y0, x1, y1 = modelo["rect"]
+        if modelo.get("ancora_y") is not None:
+            totals = totals or index.first(TOTALS_ANCHOR)
+            if not totals:
+                return None
+            dy = totals.y0 - modelo["ancora_y"]
+            y0, y1 = y0 + dy, y1 + dy
+        rule = DIGITAL_RULES[key]
+        text = index.text_in(fitz.Rect(x0, y0, x1, y1))
+        match = rule.regex.search(text) if rule.label_re.search(text.lower()) else None
+        if not match:
+            return None
+        value = rule.normalizer(match.group(1)) if rule.normalizer else match.group(1)
+        if _ausente(value) or value == "":
+            return None
+        found[key] = value
+    return found if _amounts_ok(found) else None
+
+def learn_template(page, data):
+    """
+    Modelo do layout a partir de uma extração completa que validou: cada regra de DIGITAL_RULES é
+    relocalizada na página e sua região só entra se deu o mesmo valor que ficou no registro (valores do
+    layout especial, do fallback, de outras páginas ou do híbrido ficam de fora). None se os importes não
+    conferirem ou se BASE / TOTAL não vierem das regras. DESCRIPCIÓN e OBSERVACIONES entram com os rótulos
+    que delimitaram a área na página, se o texto dela for o do registro.
+    """
+    if not _amounts_ok(data):
+        return None
+    index = _as_index(page)
+    campos = {}
+    for key, rule in DIGITAL_RULES.items():
+        value, rect, ancora_y = locate_rule(index, rule, debug=False)
+        if value is not None and value == data.get(key):
+            campos[key] = {"rect": [round(v, 2) for v in rect], "ancora_y": ancora_y}
+    if "BASE IMPONIBLE" not in campos or "IMPORTE TOTAL" not in campos:
+        return None
+    for key, (area_fn, text_fn) in TEMPLATE_AREA_FIELDS.items():
+        area = area_fn(index)
+        if area and text_fn(index, area[0]) == data.get(key):
+            campos[key] = {"rotulo": area[1], "fim": area[2]}
+    return campos
+
+def template_lookup(page, emisor):
+    """ (impressão digital, {campo: valor} lidos pelo modelo ou None); (None, None) sem modelos. """
+    store = get_template_store()
+    if store is None:
+        return None, None
+    try:
+        layout = layout_key(page, emisor)
+        campos = store.get(layout) if layout else None
+        if not campos:
+            return layout, None
+        found = read_with_template(page, campos)
+        if found is None:
+            logging.debug(f"[Modelo] Leitura direta do layout {layout} não validou – busca completa")
+            if store.record_failure(layout):
+                logging.info(f"[Modelo] Layout {layout} desativado após {store.max_failures} falhas seguidas")
+        else:
+            store.record_success(layout)
+            logging.debug(f"[Modelo] Layout {layout}: {len(found)} campo(s) lidos direto nas regiões do modelo")
+        return layout, found
+    except Exception as e:
+        logging.error(f"[Modelo] Erro no modelo de layout: {e}")
+        return None, None
+
+# Campos por área (rótulo inicial até rótulo final) lidos pelo modelo: (área, texto da área)
+TEMPLATE_AREA_FIELDS = {
+    "DESCRIPCIÓN": (_descripcion_area, _descripcion_text),
+    "OBSERVACIONES": (_observaciones_area, _observaciones_text),
+}
+
+def template_learn(page, layout, data):
+    """ Guarda o modelo do layout depois de uma busca completa que validou. """
+    try:
+        campos = learn_template(page, data)
+        if campos and get_template_store().put(layout, data.get("EMISOR"), campos, data.get("ARQUIVO")):
+            logging.debug(f"[Modelo] Layout {layout} aprendido: {', '.join(campos)}")
+    except Exception as e:
+        logging.error(f"[Modelo] Erro ao guardar o modelo de layout: {e}")
+
 def extract_moeda(page):
     """
     Procura pelo símbolo ou código de moeda mais comum na página.
     Retorna, por exemplo, '€', 'EUR', 'USD' ou None.
     """
-    text = page.get_text("text")
+    text = _as_index(page).text
     # Regex buscando símbolo ou sigla de moeda
-    m = re.search(r"\b(€|EUR|USD|US\$)\b", text)
+    m = MOEDA_RE.search(text)
     return m.group(1) if m else None
 
 
+# Extratores por página usados nas páginas seguintes (campos ausentes na página 0)
+PAGE_FIELD_EXTRACTORS = {
+    "EMISOR": extract_emisor,
+    "Nº CLIENTE": extract_num_cliente,
+    "CLIENTE": extract_cliente,
+    "REFERENCIA FACTURA": extract_referencia_factura,
+    "DESCRIPCIÓN": extract_descripcion,
+    "BASE IMPONIBLE": extract_base_imponible,
+    "IMPUESTOS": extract_impuestos,
+    "IMPORTE TOTAL": extract_importe_total,
+    "MOEDA": extract_moeda,
+}
+
+
 def process_folder(folder_path, output_file):
+    from output_sinks import open_sink # Cada resultado é gravado assim que extraído
     folder = Path(folder_path)
     pdf_files = sorted(folder.glob("*.pdf"))
-    all_data = []
 
     print(f"📂 Iniciando processamento de {len(pdf_files)} arquivos PDF...")
-    for pdf in pdf_files:
-        print(f"🔍 Processando: {pdf.name}")
-        result = extract_invoice_fields(pdf)
-        all_data.append(result)
+    with open_sink(output_file) as sink:
+        for pdf in pdf_files:
+            print(f"🔍 Processando: {pdf.name}")
+            sink.write(extract_invoice_fields(pdf))
 
-    df = pd.DataFrame(all_data)
-    df.to_excel(output_file, index=False, engine="openpyxl")
     print(f"✅ Extração finalizada. Resultados salvos em: {output_file}")
 
 # --- Execução ---
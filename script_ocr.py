@@ -1,7 +1,5 @@
-from paddleocr import PaddleOCR
+import contextlib
 import fitz
-import cv2
-import numpy as np
 import re
 from pathlib import Path
 import logging
@@ -9,10 +7,39 @@ import io
 import unicodedata
 import os
 import sys
+import threading
+import time
+# paddleocr, numpy e cv2 são importados sob demanda (ver get_ocr_engine / pdf_to_img_ocr):
+# a importação deste módulo não carrega o PaddleOCR nem os modelos.
+
+from pdf_context import open_context
+from invoice_record import FIELDS, InvoiceRecord, NO_CACHE
+from field_rules import FieldRule, TextScanner
+import metrics
 
 PDF_RESOLUTION_MATRIX = fitz.Matrix(3, 3)
 OCR_LANG = 'latin'
 USE_GPU = False
+# Modo de pouca memória (EXTRATOR_LOW_MEMORY=1): páginas renderizadas direto em cinza (1 byte/pixel) e
+# expandidas uma única vez para os 3 canais do engine, sem conversão intermediária nem cópia dos samples
+LOW_MEMORY_MODE = os.environ.get("EXTRATOR_LOW_MEMORY", "0") == "1"
+OCR_COLORSPACE = fitz.csGRAY if LOW_MEMORY_MODE else fitz.csRGB
+# Teto de pixels por página renderizada (0: sem teto; no modo de pouca memória, padrão 8 MP)
+OCR_MAX_PIXELS = int(os.environ.get("EXTRATOR_OCR_MAX_PIXELS", "8000000" if LOW_MEMORY_MODE else "0"))
+# Orçamento de memória por worker (MB, 0: sem limite): a resolução da página cai se a renderização o estouraria
+OCR_MEMORY_BUDGET_MB = float(os.environ.get("EXTRATOR_OCR_MEM_BUDGET_MB", "0"))
+OCR_MIN_ZOOM = 1.5 # ~108 dpi: piso da redução de resolução
+OCR_ENGINE_BYTES_PER_PIXEL = 6 # Estimativa das cópias internas do PaddleOCR por pixel da página
+# PDFs com alguma página reduzida pelo orçamento (depende da memória do momento): o registro leva NO_CACHE
+_reduzidos_por_memoria = set()
+_reduzidos_lock = threading.Lock()
+# OCR página a página: páginas seguintes só enquanto faltar algum campo essencial (ver ocr_remaining_pages)
+OCR_MAX_PAGES = int(os.environ.get("EXTRATOR_OCR_MAX_PAGES", "3"))
+# Modo ROI: passada barata em baixa resolução para achar os rótulos e OCR em alta resolução só das regiões
+OCR_ROI_MODE = os.environ.get("EXTRATOR_OCR_ROI", "0") == "1"
+ROI_PREVIEW_MATRIX = fitz.Matrix(1, 1)
+# Tamanho de lote dos estágios de classificação de ângulo e reconhecimento (recortes de linha por chamada)
+OCR_BATCH_SIZE = int(os.environ.get("EXTRATOR_OCR_BATCH", "16"))
 
 # Quando empacotado pelo PyInstaller, tudo é extraído em sys._MEIPASS
 bundle_dir = getattr(sys, "_MEIPASS", os.path.abspath(os.path.dirname(__file__)))
@@ -26,13 +53,23 @@ if os.path.isdir(os.path.join(raw_model_dir, "paddle_models")):
 else:
     model_dir = raw_model_dir
 
-# ─── Inicialização do PaddleOCR com model_dir ──────────────────────
+# ─── Inicialização preguiçosa do PaddleOCR com model_dir ───────────
+# O engine só é criado no primeiro uso (get_ocr_engine), protegido por lock.
+# PADDLE_OK / OCR_ENGINE_OK refletem o resultado dessa inicialização.
 PADDLE_OK = False
 OCR_ENGINE_OK = False
 ocr_engine = None
-try:
+ENGINE_LOAD_SECONDS = None
+OCR_ENGINE_OVERRIDES = {} # Parâmetros extras do PaddleOCR (ex.: cpu_threads definido pelo ocr_pool)
+_engine_lock = threading.Lock()
+_engine_init_done = False
+# Chamadas ao engine de threads diferentes (ex.: pipeline: estágio OCR + OCR híbrido no estágio de detecção)
+_engine_call_lock = threading.Lock()
+
+def create_ocr_engine(**overrides):
+    """ Cria uma nova instância do PaddleOCR com os modelos de model_dir (parâmetros sobrescrevíveis). """
     from paddleocr import PaddleOCR
-    ocr_engine = PaddleOCR(
+    params = dict(
         use_angle_cls=True,
         lang=OCR_LANG,
         show_log=True,
@@ -40,13 +77,124 @@ try:
         det_model_dir       = os.path.join(model_dir, "det"),
         rec_model_dir       = os.path.join(model_dir, "rec"),
         cls_model_dir       = os.path.join(model_dir, "cls"),
-        structure_model_dir = os.path.join(model_dir, "layout")
+        structure_model_dir = os.path.join(model_dir, "layout"),
+        rec_batch_num=OCR_BATCH_SIZE,
+        cls_batch_num=OCR_BATCH_SIZE,
     )
-    PADDLE_OK = True
-    OCR_ENGINE_OK = True
-    logging.info(f"[OCR Module] PaddleOCR engine inicializado com modelos em {model_dir}")
-except Exception:
-    logging.exception("[OCR Module] Falha CRÍTICA ao inicializar PaddleOCR Engine")
+    params.update(overrides)
+    return PaddleOCR(**params)
+
+def get_ocr_engine():
+    """
+    Retorna o engine PaddleOCR do processo, criando-o no primeiro uso (thread-safe).
+    Retorna None se a inicialização falhar (a falha não é retentada a cada arquivo).
+    """
+    global ocr_engine, PADDLE_OK, OCR_ENGINE_OK, ENGINE_LOAD_SECONDS, _engine_init_done
+    if _engine_init_done:
+        return ocr_engine
+    with _engine_lock:
+        if _engine_init_done:
+            return ocr_engine
+        inicio = time.perf_counter()
+        try:
+            ocr_engine = create_ocr_engine(**OCR_ENGINE_OVERRIDES)
+            PADDLE_OK = True
+            OCR_ENGINE_OK = True
+            ENGINE_LOAD_SECONDS = time.perf_counter() - inicio
+            logging.info(f"[OCR Module] PaddleOCR engine inicializado com modelos em {model_dir} ({ENGINE_LOAD_SECONDS:.2f}s)")
+        except Exception:
+            ocr_engine = None
+            logging.exception("[OCR Module] Falha CRÍTICA ao inicializar PaddleOCR Engine")
+        finally:
+            _engine_init_done = True
+    return ocr_engine
+
+def warmup_ocr_engine():
+    """ Inicializa o engine em uma thread de fundo (daemon). Retorna a thread. """
+    thread = threading.Thread(target=get_ocr_engine, name="ocr-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# ─── Cache de OCR bruto (ocr_cache) ───────────
+# Saída bruta de cada página (texto, caixa, confiança) guardada por hash do PDF, página, DPI e modelos.
+# Aberto no primeiro uso, um por processo; EXTRATOR_OCR_CACHE=0 desativa.
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+_ocr_cache_init_done = False
+_model_signature = None
+_file_hashes = {} # (caminho, tamanho, mtime) -> SHA-256
+
+def get_ocr_cache():
+    """ Cache de OCR bruto do processo, ou None se desativado/indisponível. """
+    global _ocr_cache, _ocr_cache_init_done
+    if _ocr_cache_init_done:
+        return _ocr_cache
+    with _ocr_cache_lock:
+        if not _ocr_cache_init_done:
+            try:
+                import ocr_cache
+                if ocr_cache.OCR_CACHE_ENABLED:
+                    _ocr_cache = ocr_cache.OcrCache()
+            except Exception as e:
+                logging.error(f"[OCR] Cache de OCR bruto indisponível: {e}")
+            _ocr_cache_init_done = True
+    return _ocr_cache
+
+def model_signature():
+    """ Assinatura dos modelos em uso (model_dir, OCR_LANG, espaço de cor da renderização). """
+    global _model_signature
+    if _model_signature is None:
+        import ocr_cache
+        _model_signature = ocr_cache.model_signature(model_dir, OCR_LANG, OCR_COLORSPACE.name)
+    return _model_signature
+
+def _file_hash(pdf_path):
+    st = os.stat(pdf_path)
+    chave = (os.path.abspath(pdf_path), st.st_size, st.st_mtime)
+    if chave not in _file_hashes:
+        from result_cache import file_sha256
+        _file_hashes[chave] = file_sha256(pdf_path)
+    return _file_hashes[chave]
+
+def ocr_cache_key(pdf_path, page_number, matrix):
+    """ Chave da página no cache de OCR bruto: (hash do PDF, página, dpi, modelos); None sem cache. """
+    if get_ocr_cache() is None:
+        return None
+    try:
+        return (_file_hash(pdf_path), page_number, round(72 * matrix.a), model_signature())
+    except Exception as e:
+        logging.warning(f"[OCR] Sem chave de cache para {Path(pdf_path).name}: {e}")
+        return None
+
+def roi_cache_key(pdf_path):
+    """
+    Chave da página 1 lida no modo ROI: mesmo esquema de ocr_cache_key, com a assinatura dos modelos marcada
+    com "|roi" (as linhas das regiões não valem como OCR da página inteira, nem o contrário).
+    """
+    key = ocr_cache_key(pdf_path, 0, PDF_RESOLUTION_MATRIX)
+    return None if key is None else key[:3] + (key[3] + "|roi",)
+
+def cached_ocr_lines(key, any_dpi=False):
+    """ Linhas da página (formato de run_ocr_task) lidas do cache de OCR bruto, ou None. """
+    cache = get_ocr_cache()
+    if cache is None or key is None:
+        return None
+    try:
+        raw = cache.get(*key, any_dpi=any_dpi)
+    except Exception as e:
+        logging.error(f"[OCR] Erro ao ler o cache de OCR bruto: {e}")
+        return None
+    return None if raw is None else raw_to_lines(raw)
+
+def store_ocr_raw(key, raw, arquivo=None):
+    """ Guarda a saída bruta de uma página (None = OCR falhou: não é guardado). """
+    cache = get_ocr_cache()
+    if cache is None or key is None or raw is None:
+        return
+    try:
+        cache.put(*key, raw, arquivo)
+    except Exception as e:
+        logging.error(f"[OCR] Erro ao gravar o cache de OCR bruto: {e}")
 
 # === Funções Auxiliares
 def remove_accents(input_str):
@@ -66,7 +214,7 @@ def clean_value(text):
          if text.rfind('.') < text.rfind(','): text = text.replace('.', '').replace(',', '.')
          else: text = text.replace(',', '')
     elif ',' in text: text = text.replace(',', '.')
-    cleaned_text = re.sub(r"[^\d.]", "", text)
+    cleaned_text = NON_NUMERIC_RE.sub("", text)
     if is_negative: cleaned_text = "-" + cleaned_text
     try:
         if cleaned_text in ['.', '-.','-','']: return None # Adicionado '-' e ''
@@ -77,128 +225,395 @@ def clean_value(text):
         return None
 
 # === Funções OCR Pipeline
-def pdf_to_img_ocr(pdf_path):
+def pixmap_to_array(pix):
+    """
+    Converte um Pixmap em array uint8 com 3 canais (None se o pixmap estiver vazio).
+    Cinza: o array de 3 canais é preenchido direto da memória do pixmap (samples_mv, sem cópia em bytes).
+    """
+    import numpy as np
+    if not pix.width or not pix.height: return None
+    if pix.n == 1:
+        gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 1)
+        img = np.empty((pix.height, pix.width, 3), dtype=np.uint8)
+        img[...] = gray # Única alocação de página inteira; o pixmap pode ser liberado em seguida
+        return img
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if img.shape[2] == 4:
+        import cv2
+        img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+    return img
+
+def _rss_bytes():
+    """ Memória residente do processo (psutil ou /proc), ou None se não der para medir. """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+def render_matrix(page, matrix=None):
+    """
+    Matriz de renderização de uma página para o OCR: PDF_RESOLUTION_MATRIX reduzida se a página passar
+    de OCR_MAX_PIXELS ou se a renderização (pixmap + array + cópias do engine) estourar o
+    OCR_MEMORY_BUDGET_MB do worker, considerando a memória que o processo já usa.
+    """
+    matrix = matrix or PDF_RESOLUTION_MATRIX
+    zoom = min(matrix.a, matrix.d)
+    area = abs(page.rect) # pt²
+    novo_zoom = zoom
+    if OCR_MAX_PIXELS and area * novo_zoom ** 2 > OCR_MAX_PIXELS:
+        novo_zoom = (OCR_MAX_PIXELS / area) ** 0.5
+    if OCR_MEMORY_BUDGET_MB:
+        bytes_por_pixel = OCR_COLORSPACE.n + 3 + OCR_ENGINE_BYTES_PER_PIXEL
+        disponivel = OCR_MEMORY_BUDGET_MB * 1024 * 1024 - (_rss_bytes() or 0)
+        if area * novo_zoom ** 2 * bytes_por_pixel > disponivel:
+            novo_zoom = max(OCR_MIN_ZOOM, (max(disponivel, 0) / (area * bytes_por_pixel)) ** 0.5)
+            logging.warning(f"[OCR] Orçamento de memória ({OCR_MEMORY_BUDGET_MB:.0f} MB): página renderizada a "
+                            f"{72 * novo_zoom:.0f} dpi em vez de {72 * zoom:.0f} dpi.")
+            if page.parent.name:
+                with _reduzidos_lock: _reduzidos_por_memoria.add(os.path.abspath(page.parent.name))
+    if novo_zoom >= zoom:
+        return matrix
+    escala = novo_zoom / zoom
+    return fitz.Matrix(matrix.a * escala, matrix.d * escala)
+
+def mark_memory_reduced(pdf_path, result):
+    """ Marca result com NO_CACHE se alguma página do PDF foi renderizada com DPI reduzido pelo orçamento de memória. """
+    with _reduzidos_lock:
+        try: _reduzidos_por_memoria.remove(os.path.abspath(str(pdf_path)))
+        except KeyError: return result
+    if result is not None and not result.get("ERRO"):
+        result[NO_CACHE] = "DPI reduzido pelo orçamento de memória"
+    return result
+
+def render_for_ocr(page, matrix=None, clip=None):
+    """ Renderiza a página (ou o recorte) no espaço de cor do OCR e devolve o array; o pixmap é liberado aqui. """
+    pix = page.get_pixmap(matrix=matrix or PDF_RESOLUTION_MATRIX, clip=clip, alpha=False, colorspace=OCR_COLORSPACE)
+    img = pixmap_to_array(pix)
+    pix = None
+    return img
+
+def pdf_to_img_ocr(pdf_path, ctx=None, page_number=0, matrix=None):
     # Função pdf_to_img_and_text adaptada para retornar só a imagem
-    img_page_1 = None; doc = None
+    # ctx: PdfContext já aberto (opcional); só é fechado aqui se tiver sido aberto aqui
+    # page_number: página a renderizar (padrão: a primeira)
+    # matrix: matriz já calculada por render_matrix (padrão: calculada aqui)
+    img_page_1 = None; owned = False
     try:
-        doc = fitz.open(pdf_path)
-        if doc.page_count > 0:
-            page = doc.load_page(0); pix = page.get_pixmap(matrix=PDF_RESOLUTION_MATRIX, alpha=False)
-            if pix.samples:
-                img_page_1 = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
-                if img_page_1.shape[2] == 1: img_page_1 = cv2.cvtColor(img_page_1, cv2.COLOR_GRAY2BGR)
-                elif img_page_1.shape[2] == 4: img_page_1 = cv2.cvtColor(img_page_1, cv2.COLOR_RGBA2BGR)
-            else: logging.warning(f"[OCR] Pixmap vazio para {Path(pdf_path).name}")
+        ctx, owned = open_context(pdf_path, ctx)
+        if ctx.page_count > page_number:
+            page = ctx.page(page_number)
+            img_page_1 = render_for_ocr(page, matrix or render_matrix(page))
+            if img_page_1 is None: logging.warning(f"[OCR] Pixmap vazio para {Path(pdf_path).name}")
         else: logging.warning(f"[OCR] PDF sem páginas: {Path(pdf_path).name}")
     except Exception as e: logging.error(f"[OCR] Erro pdf_to_img para {Path(pdf_path).name}: {e}"); img_page_1 = None
     finally:
-         if doc:
-             try: doc.close()
+         if owned and ctx:
+             try: ctx.close()
              except Exception as close_err: logging.error(f"[OCR] Erro ao fechar doc: {close_err}")
     return img_page_1
 
-def run_ocr_task(img_array):
-    # Função run_ocr do script funcional (renomeada task)
-    lines = []
-    if not OCR_ENGINE_OK: logging.error("[OCR] Engine não disponível para run_ocr_task."); return lines
-    if img_array is None: logging.warning("[OCR] Imagem None para run_ocr_task."); return lines
+def prepare_page_ocr(pdf_path, ctx=None, page_number=0):
+    """
+    Página pronta para o OCR: (chave, linhas, imagem). Se a página estiver no cache de OCR bruto vêm as
+    linhas, sem renderizar; senão, a imagem (None se a renderização falhar) e a chave para o run_ocr_task.
+    """
+    key = lines = img = None; owned = False
     try:
-        result = ocr_engine.ocr(img_array, cls=True)
+        ctx, owned = open_context(pdf_path, ctx)
+        matrix = None
+        if ctx.page_count > page_number:
+            matrix = render_matrix(ctx.page(page_number))
+            key = ocr_cache_key(pdf_path, page_number, matrix)
+            lines = cached_ocr_lines(key)
+        if lines is None:
+            with metrics.stage("renderizacao"):
+                img = pdf_to_img_ocr(pdf_path, ctx=ctx, page_number=page_number, matrix=matrix)
+    except Exception as e: logging.error(f"[OCR] Erro ao preparar a página {page_number + 1} de {Path(pdf_path).name}: {e}")
+    finally:
+        if owned and ctx:
+            try: ctx.close()
+            except Exception as close_err: logging.error(f"[OCR] Erro ao fechar doc: {close_err}")
+    return key, lines, img
+
+def _box_list(box):
+    # Vértices da caixa detectada em lista simples (JSON), em pixels da imagem
+    try: return [[round(float(x), 1), round(float(y), 1)] for x, y in box]
+    except Exception: return None
+
+def run_ocr_task_raw(img_array):
+    """
+    OCR de uma imagem com a saída bruta do engine: [(texto, caixa, confiança)].
+    None se o engine falhar ou não estiver disponível ([] = a imagem não tem texto).
+    """
+    engine = get_ocr_engine()
+    if engine is None: logging.error("[OCR] Engine não disponível para run_ocr_task."); return None
+    if img_array is None: logging.warning("[OCR] Imagem None para run_ocr_task."); return None
+    raw = []
+    try:
+        with _engine_call_lock:
+            result = engine.ocr(img_array, cls=True)
         if result and isinstance(result, list) and len(result) > 0 and result[0] is not None:
              for line_info in result[0]:
-                 if isinstance(line_info, list) and len(line_info) == 2: text_tuple = line_info[1]
-                 if isinstance(text_tuple, tuple) and len(text_tuple) > 0: text = text_tuple[0]
-                 if isinstance(text, str): lines.append(text.strip())
-        if lines: full_ocr_text = "\n".join(lines); full_ocr_text = re.sub(r'\n\s*\n', '\n', full_ocr_text.strip()); full_ocr_text = re.sub(r' +', ' ', full_ocr_text); return full_ocr_text.splitlines()
-        else: logging.warning("[OCR] run_ocr_task não extraiu linhas."); return []
-    except Exception as e: logging.error(f"[OCR] Erro run_ocr_task: {e}", exc_info=True); return []
+                 if not (isinstance(line_info, list) and len(line_info) == 2): continue
+                 text_tuple = line_info[1]
+                 if not (isinstance(text_tuple, tuple) and len(text_tuple) > 0): continue
+                 text = text_tuple[0]
+                 if isinstance(text, str):
+                     score = float(text_tuple[1]) if len(text_tuple) > 1 else None
+                     raw.append((text.strip(), _box_list(line_info[0]), score))
+        return raw
+    except Exception as e: logging.error(f"[OCR] Erro run_ocr_task: {e}", exc_info=True); return None
+
+def raw_to_lines(raw):
+    """ Linhas no formato de run_ocr_task a partir da saída bruta. """
+    lines = [texto for texto, _, _ in raw or []]
+    return _normalizar_linhas(lines) if lines else []
+
+def run_ocr_task(img_array, cache_key=None, arquivo=None):
+    # Função run_ocr do script funcional (renomeada task)
+    # cache_key: chave de prepare_page_ocr; a saída bruta é guardada no cache de OCR bruto
+    raw = run_ocr_task_raw(img_array)
+    store_ocr_raw(cache_key, raw, arquivo)
+    lines = raw_to_lines(raw)
+    if raw is not None and not lines: logging.warning("[OCR] run_ocr_task não extraiu linhas.")
+    return lines
+
+def _normalizar_linhas(lines):
+    # Remove linhas vazias e espaços repetidos (mesma saída de run_ocr_task)
+    full_ocr_text = "\n".join(lines); full_ocr_text = BLANK_LINES_RE.sub('\n', full_ocr_text.strip()); full_ocr_text = MULTI_SPACE_RE.sub(' ', full_ocr_text); return full_ocr_text.splitlines()
+
+def _funcoes_recorte():
+    """ Funções internas do PaddleOCR para recortar as linhas detectadas (None se indisponíveis). """
+    try:
+        import paddleocr # noqa: F401 - adiciona o diretório "tools" do pacote ao sys.path
+        from tools.infer.utility import get_rotate_crop_image
+        from tools.infer.predict_system import sorted_boxes
+        return get_rotate_crop_image, sorted_boxes
+    except Exception:
+        try:
+            from paddleocr.tools.infer.utility import get_rotate_crop_image
+            from paddleocr.tools.infer.predict_system import sorted_boxes
+            return get_rotate_crop_image, sorted_boxes
+        except Exception as e:
+            logging.warning(f"[OCR] Recorte em lote indisponível ({e}); usando OCR imagem a imagem.")
+            return None
+
+def run_ocr_batch(img_arrays, batch_size=None, raw=False):
+    """
+    OCR em lote: detecção por imagem e classificação/reconhecimento dos recortes de linha de TODAS as
+    imagens juntos, em lotes de batch_size (padrão OCR_BATCH_SIZE). Retorna uma lista de linhas por imagem,
+    na mesma ordem e no mesmo formato de run_ocr_task.
+    raw=True: saída bruta por imagem, como run_ocr_task_raw (None nas imagens em que o OCR falhou).
+    Imagens cuja detecção ou reconhecimento em lote falhou são refeitas sozinhas (run_ocr_task_raw), para
+    não voltarem com o texto parcial dos recortes que passaram.
+    """
+    engine = get_ocr_engine()
+    if engine is None:
+        logging.error("[OCR] Engine não disponível para run_ocr_batch.")
+        return [None if raw else [] for _ in img_arrays]
+    funcoes = _funcoes_recorte()
+    if funcoes is None or not all(hasattr(engine, a) for a in ("text_detector", "text_recognizer")):
+        return [run_ocr_task_raw(img) if raw else run_ocr_task(img) for img in img_arrays]
+    get_rotate_crop_image, sorted_boxes = funcoes
+    batch_size = batch_size or OCR_BATCH_SIZE
+
+    # 1. Detecção por imagem; recortes de todas as imagens numa lista única (com a imagem de origem)
+    crops, owners, boxes, falhas = [], [], [], set()
+    for n, img in enumerate(img_arrays):
+        if img is None: logging.warning("[OCR] Imagem None em run_ocr_batch."); falhas.add(n); continue
+        try:
+            dt_boxes, _ = engine.text_detector(img)
+            if dt_boxes is None: continue
+            for box in sorted_boxes(dt_boxes):
+                crops.append(get_rotate_crop_image(img, box.copy()))
+                owners.append(n)
+                boxes.append(_box_list(box))
+        except Exception as e:
+            logging.error(f"[OCR] Erro na detecção em lote (imagem {n}): {e}", exc_info=True)
+            falhas.add(n)
+
+    # 2. Classificação de ângulo e reconhecimento em lotes de recortes
+    drop_score = getattr(engine, "drop_score", 0.5)
+    brutos = [[] for _ in img_arrays]
+    for start in range(0, len(crops), batch_size):
+        chunk = crops[start:start + batch_size]
+        try:
+            if getattr(engine, "use_angle_cls", False) and getattr(engine, "text_classifier", None) is not None:
+                chunk, _, _ = engine.text_classifier(chunk)
+            rec_res, _ = engine.text_recognizer(chunk)
+        except Exception as e:
+            logging.error(f"[OCR] Erro no reconhecimento em lote: {e}", exc_info=True)
+            falhas.update(owners[start:start + batch_size])
+            continue
+        for owner, box, (text, score) in zip(owners[start:start + batch_size], boxes[start:start + batch_size], rec_res):
+            if score >= drop_score and isinstance(text, str):
+                brutos[owner].append((text.strip(), box, float(score)))
+
+    # 3. Imagens com falha refeitas uma a uma; linhas de volta para cada imagem
+    for n in sorted(falhas):
+        img = img_arrays[n]
+        brutos[n] = None if img is None else run_ocr_task_raw(img)
+        if img is not None: logging.warning(f"[OCR] Imagem {n} refeita fora do lote: {'falhou' if brutos[n] is None else 'ok'}.")
+    if raw:
+        return brutos
+    return [raw_to_lines(b) for b in brutos]
 
 def extract_moeda_ocr(text):
     """
     Busca no texto completo a ocorrência de símbolos ou códigos de moeda mais comuns.
     Retorna, por exemplo, '€', 'EUR', 'USD' ou None.
     """
-    m = re.search(r"\b(€|EUR|USD|US\$)\b", text)
+    m = MOEDA_RE.search(text)
     return m.group(1) if m else None
 
 
+# --- Regras de campo (compiladas uma vez na importação) ---
+# Padrões base
+NUM_PATTERN = r"([-+]?\s?\d{1,3}(?:[.,]?\d{3})*(?:[.,]\d{1,2}))\s*(-?)" # G1: Valor, G2: Sinal
+DATE_PATTERN = r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})"
+
+def combine_num_groups(match_obj):
+    if not match_obj: return None
+    val = match_obj.group(1).strip()
+    sign = match_obj.group(2).strip()
+    combined = (sign + val).replace("- ", "-")
+    return combined
+
+def _normalize_cliente(match):
+    client_name = match.group(1).strip().split('\n')[0]
+    if len(client_name.split()) > 6 and DIGIT_RE.search(client_name):
+         m_sl = SL_SUFFIX_RE.search(client_name)
+         if m_sl: client_name = m_sl.group(1).strip()
+    return client_name
+
+def _normalize_referencia(match):
+    # Limpa espaços e para antes de datas ou palavras-chave comuns que podem vir depois
+    ref_text = match.group(1).strip()
+    ref_text = REF_STOP_RE.split(ref_text, 1)[0].strip() # Para antes de datas
+    return ref_text.replace(" ", "") # Remove espaços internos restantes
+
+def _normalize_observaciones(match):
+    observations = match.group(1).strip()
+    observations = "\n".join(line for line in observations.split('\n') if line.strip() and not line.startswith("ESIP"))
+    return observations.replace('\n', ' ').strip()
+
+def _strip_group(match):
+    return match.group(1).strip()
+
+def _clean_amount(match):
+    return clean_value(combine_num_groups(match))
+
+STOP_OBS_PATTERNS = [
+    r"\n\n", r"Pag\.",
+    r"ENDESA\s+X\s+WAY", r"Enel\s+Green\s+Power", r"\bENDESA\b.*\bS\.A\.",
+    r"ESIP\d+", r"Registro\s+Mercantil", r"Inscrita\s+en\s+el\s+Registro"
+]
+
+# Regras rótulo + valor (literal=False): o normalizador recebe o match
+OCR_RULES = [
+    FieldRule("Nº CLIENTE", [r"n[ºo°]?\s*cliente", r"customer\s*no"], r"\.?\s*:?\s*(\S+)",
+              normalizer=_strip_group, flags=re.IGNORECASE, literal=False),
+    FieldRule("CLIENTE", [r"nombre", r"name"], r"\s*:?\s*(.+?)(?:\s*Direcci[oó]n Fiscal|\s*NIF/CIF|\s*N[ºo°]?\s*Factura|\n|$)",
+              normalizer=_normalize_cliente, flags=re.IGNORECASE | re.DOTALL, literal=False),
+    # Permite letras (FT), números, barras, e potencialmente espaços (removidos depois)
+    FieldRule("REFERENCIA FACTURA", [r"n[ºo°]?\s*factura", r"invoice\s*no"], r"\.?\s*:?\s*([A-Z0-9/ -]+)",
+              normalizer=_normalize_referencia, flags=re.IGNORECASE, literal=False),
+    FieldRule("FECHA FACTURA", [r"Fecha\s*emisi[oó]n", r"Issue\s*Date"], r"\s*:?\s*" + DATE_PATTERN,
+              normalizer=_strip_group, flags=re.IGNORECASE, literal=False),
+    FieldRule("FECHA VENCIMIENTO", [r"Fecha\s*vencimiento", r"Vencimiento", r"Due\s*Date", r"Hasta\s*el", r"Until"], r"\s*:?\s*" + DATE_PATTERN,
+              normalizer=_strip_group, flags=re.IGNORECASE, literal=False),
+    FieldRule("BASE IMPONIBLE", [r"BASE\s*IMPONIBLE", r"TAX\s*BASE"], r"\s*€?\s*\n?.*?" + NUM_PATTERN,
+              normalizer=_clean_amount, flags=re.IGNORECASE | re.DOTALL, literal=False),
+    FieldRule("IMPORTE TOTAL", [r"TOTAL\s*Importe\s*Factura", r"Invoice\s*TOTAL\s*Value", r"TOTAL\s*A\s*PAGAR"], r"\s*€?\s*\n?.*?" + NUM_PATTERN,
+              normalizer=_clean_amount, flags=re.IGNORECASE | re.DOTALL, literal=False),
+    FieldRule("OBSERVACIONES", [r"Observaciones", r"Observations"], r"\s*:?\s*(.*?)(?:" + "|".join(STOP_OBS_PATTERNS) + r"|\Z)",
+              normalizer=_normalize_observaciones, flags=re.IGNORECASE | re.DOTALL, literal=False),
+    # IVA 0% explícito (usado na validação do imposto)
+    FieldRule("_IVA_ZERO", [r"iva", r"output\s*tax"], r"[\s,]*0[,.]00\s*%", flags=re.IGNORECASE, literal=False),
+]
+OCR_SCANNER = TextScanner(OCR_RULES)
+
+# "TOTAL" genérico: última ocorrência, só se nenhum rótulo de total específico casar
+TOTAL_FALLBACK_RE = re.compile(r"\bTOTAL\b\s*€?\s*\n?.*?" + NUM_PATTERN, re.IGNORECASE | re.DOTALL)
+
+# EMISOR (texto normalizado, sem acentos e minúsculo), em ordem de prioridade
+EMISOR_GREEN_POWER_RE = re.compile(r"enel\s+green\s+power\s+espa[nñ]a")
+EMISOR_EDISTRIBUCION_RE = re.compile(r"edistribucion\s+redes\s+digitales")
+EMISOR_X_WAY_RE = re.compile(r"endesa\s+x\s+way")
+EMISOR_X_WAY_FULL_RE = re.compile(r"(ENDESA\s+X\s+WAY\s+SUC\.PORTUGAL)", re.IGNORECASE)
+EMISOR_ENDESA_SA_RE = re.compile(r"\bendesa\b.*\bs\.a\.")
+
+# DESCRIPCIÓN
+START_DESC_KEYWORDS = ("concepto", "concept")
+STOP_DESC_RE = re.compile("|".join("(?:" + p + ")" for p in [
+    r"detalle\s+de\s+la\s+factura", r"detalle\s+factura", r"invoice\s+detail",
+    r"base\s+imponible", r"tax\s+base", r"total\s+importe", r"invoice\s+total",
+    r"observaciones", r"observations", r"iban", r"swift",
+    r"^\s*(cantidad|quantity|precio|price|importe|amount|mon|curr)",
+    r"^\s*forma\s+de\s+pago", r"^\s*payment\s+method",
+]), re.IGNORECASE)
+DETAIL_RE = re.compile(r"(?:Detalle\s+de\s+la\s+Factura|Invoice\s+Detail)\s*\n", re.IGNORECASE)
+DESC_HEADER_RE = re.compile(r"^\s*(?:Descripci[oó]n|Description)\s*\n", re.IGNORECASE | re.MULTILINE)
+TABLE_HEADER_RE = re.compile(r"^\s*(cantidad|quantity|precio|price|importe|amount|mon|curr|value|impte)\b", re.IGNORECASE)
+
+MOEDA_RE = re.compile(r"\b(€|EUR|USD|US\$)\b")
+NON_NUMERIC_RE = re.compile(r"[^\d.]")
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+MULTI_SPACE_RE = re.compile(r' +')
+DIGIT_RE = re.compile(r'\d')
+SL_SUFFIX_RE = re.compile(r'(.+?\b(?:S\.L\.?U?|S\.A\.?)\b)', re.IGNORECASE)
+REF_STOP_RE = re.compile(r'\s+(?:Fecha|Issue|Date)')
+
+ESSENTIAL_KEYS = ["EMISOR", "Nº CLIENTE", "CLIENTE", "REFERENCIA FACTURA", "BASE IMPONIBLE", "IMPORTE TOTAL", "FECHA FACTURA"]
+# Campos que encerram o OCR página a página quando todos têm valor
+OCR_STOP_KEYS = ESSENTIAL_KEYS + ["IMPUESTOS"]
+
+
 # --- Função de Extração Principal
 def extract_fields_from_text(text_lines, arquivo_nome):
-    result = {
-        "ARQUIVO": arquivo_nome, "EMISOR": None, "Nº CLIENTE": None, "CLIENTE": None,
-        "REFERENCIA FACTURA": None, "DESCRIPCIÓN": None, "BASE IMPONIBLE": None,
-        "IMPUESTOS": None, "IMPORTE TOTAL": None, "FECHA FACTURA": None,
-        "FECHA VENCIMIENTO": None, "OBSERVACIONES": None
-    }
+    result = InvoiceRecord({"ARQUIVO": arquivo_nome}) # Importes guardados como float (InvoiceRecord)
     full_text = "\n".join(text_lines)
     search_text_norm = remove_accents(full_text.lower())
 
     # **Extrai moeda**  
     result["MOEDA"] = extract_moeda_ocr(full_text)
 
-    # --- Patterns ---
-    num_pattern = r"([-+]?\s?\d{1,3}(?:[.,]?\d{3})*(?:[.,]\d{1,2}))\s*(-?)" # G1: Valor, G2: Sinal
-    date_pattern = r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})"
-
-    def combine_num_groups(match_obj):
-        if not match_obj: return None
-        val = match_obj.group(1).strip()
-        sign = match_obj.group(2).strip()
-        combined = (sign + val).replace("- ", "-")
-        return combined
+    # Uma única passada de rótulos para todas as regras rótulo + valor
+    matches = OCR_SCANNER.scan(full_text)
 
     # EMISOR, Nº CLIENTE, CLIENTE (Manter)
-    if re.search(r"enel\s+green\s+power\s+espa[nñ]a", search_text_norm): result["EMISOR"] = "Enel Green Power España S.L."
-    elif re.search(r"edistribucion\s+redes\s+digitales", search_text_norm): result["EMISOR"] = "EDISTRIBUCIÓN Redes Digitales S.L.U."
-    elif re.search(r"endesa\s+x\s+way", search_text_norm):
-        match = re.search(r"(ENDESA\s+X\s+WAY\s+SUC\.PORTUGAL)", full_text, re.IGNORECASE)
+    if EMISOR_GREEN_POWER_RE.search(search_text_norm): result["EMISOR"] = "Enel Green Power España S.L."
+    elif EMISOR_EDISTRIBUCION_RE.search(search_text_norm): result["EMISOR"] = "EDISTRIBUCIÓN Redes Digitales S.L.U."
+    elif EMISOR_X_WAY_RE.search(search_text_norm):
+        match = EMISOR_X_WAY_FULL_RE.search(full_text)
         result["EMISOR"] = match.group(1).strip() if match else "ENDESA X WAY SUC.PORTUGAL"
-    elif re.search(r"\bendesa\b.*\bs\.a\.", search_text_norm): result["EMISOR"] = "ENDESA S.A."
+    elif EMISOR_ENDESA_SA_RE.search(search_text_norm): result["EMISOR"] = "ENDESA S.A."
     if not result["EMISOR"]:
          first_lines = [line for line in text_lines[:3] if line.strip()]
          if first_lines: result["EMISOR"] = first_lines[0].strip(); logging.warning(f"Emissor não identificado, usando fallback: {result['EMISOR']}")
 
-    match = re.search(r"(?:n[ºo°]?\s*cliente|customer\s*no)\.?\s*:?\s*(\S+)", full_text, re.IGNORECASE)
-    if match: result["Nº CLIENTE"] = match.group(1).strip()
-
-    match = re.search(r"(?:nombre|name)\s*:?\s*(.+?)(?:\s*Direcci[oó]n Fiscal|\s*NIF/CIF|\s*N[ºo°]?\s*Factura|\n|$)", full_text, re.IGNORECASE | re.DOTALL)
-    if match:
-        client_name = match.group(1).strip().split('\n')[0]
-        if len(client_name.split()) > 6 and re.search(r'\d', client_name):
-             m_sl = re.search(r'(.+?\b(?:S\.L\.?U?|S\.A\.?)\b)', client_name, re.IGNORECASE)
-             if m_sl: client_name = m_sl.group(1).strip()
-        result["CLIENTE"] = client_name
-
-    # REFERENCIA FACTURA (**REVERTENDO/AJUSTANDO Regex**)
-    # Permite letras (FT), números, barras, e potencialmente espaços (removidos depois)
-    match = re.search(r"(?:n[ºo°]?\s*factura|invoice\s*no)\.?\s*:?\s*([A-Z0-9/ -]+)", full_text, re.IGNORECASE)
-    if match:
-        # Limpa espaços e para antes de datas ou palavras-chave comuns que podem vir depois
-        ref_text = match.group(1).strip()
-        ref_text = re.split(r'\s+(?:Fecha|Issue|Date)', ref_text, 1)[0].strip() # Para antes de datas
-        result["REFERENCIA FACTURA"] = ref_text.replace(" ", "") # Remove espaços internos restantes
-
-    # FECHAS (Manter)
-    match = re.search(fr"(?:Fecha\s*emisi[oó]n|Issue\s*Date)\s*:?\s*{date_pattern}", full_text, re.IGNORECASE)
-    if match: result["FECHA FACTURA"] = match.group(1).strip()
-    match = re.search(fr"(?:Fecha\s*vencimiento|Vencimiento|Due\s*Date|Hasta\s*el|Until)\s*:?\s*{date_pattern}", full_text, re.IGNORECASE)
-    if match: result["FECHA VENCIMIENTO"] = match.group(1).strip()
+    # Campos rótulo + valor (Nº CLIENTE, CLIENTE, REFERENCIA FACTURA, FECHAS, OBSERVACIONES)
+    for rule in OCR_RULES:
+        if rule.normalizer and rule.name in FIELDS and matches[rule.name]:
+            result[rule.name] = rule.normalizer(matches[rule.name])
 
     # DESCRIPCIÓN (Lógica Principal + **Fallback Ajustado**)
     desc_lines_collected = []
     in_description = False
-    start_desc_keywords = ["concepto", "concept"]
-    stop_desc_patterns = [
-        r"detalle\s+de\s+la\s+factura", r"detalle\s+factura", r"invoice\s+detail",
-        r"base\s+imponible", r"tax\s+base", r"total\s+importe", r"invoice\s+total",
-        r"observaciones", r"observations", r"iban", r"swift",
-        r"^\s*(cantidad|quantity|precio|price|importe|amount|mon|curr)",
-        r"^\s*forma\s+de\s+pago", r"^\s*payment\s+method",
-    ]
-    for i, line in enumerate(text_lines): # Coleta via Concepto (igual antes)
-        line_lower_norm = remove_accents(line.lower().strip())
+    # Linhas já normalizadas (sem acentos, minúsculas) a partir do texto completo
+    norm_lines = search_text_norm.split("\n")
+    if len(norm_lines) != len(text_lines):
+        norm_lines = [remove_accents(line.lower()) for line in text_lines]
+    for line, line_norm in zip(text_lines, norm_lines): # Coleta via Concepto (igual antes)
+        line_lower_norm = line_norm.strip()
         line_content = line.strip()
-        if any(line_lower_norm.startswith(key) for key in start_desc_keywords):
+        if line_lower_norm.startswith(START_DESC_KEYWORDS):
             in_description = True
             potential_desc = line_content.split(":", 1)[1].strip() if ":" in line_content else ""
             if potential_desc: desc_lines_collected.append(potential_desc)
@@ -206,7 +621,7 @@ def extract_fields_from_text(text_lines, arquivo_nome):
         if in_description:
             should_stop = False
             if not line_content: pass
-            elif any(re.search(stop, line_lower_norm, re.IGNORECASE) for stop in stop_desc_patterns): should_stop = True
+            elif STOP_DESC_RE.search(line_lower_norm): should_stop = True
             if should_stop: in_description = False
             else: desc_lines_collected.append(line_content)
 
@@ -214,44 +629,35 @@ def extract_fields_from_text(text_lines, arquivo_nome):
         result["DESCRIPCIÓN"] = " ".join(desc_lines_collected).strip()
     else: # Fallback via Detalle/Descripción
         logging.info(f"Descrição via 'Concepto' falhou para {arquivo_nome}. Tentando fallback via 'Detalle/Descripción'.")
-        detail_match = re.search(r"(?:Detalle\s+de\s+la\s+Factura|Invoice\s+Detail)\s*\n", full_text, re.IGNORECASE)
+        detail_match = DETAIL_RE.search(full_text)
         if detail_match:
             start_index = detail_match.end()
             text_after_detail = full_text[start_index:]
-            desc_header_match = re.search(r"^\s*(?:Descripci[oó]n|Description)\s*\n", text_after_detail, re.IGNORECASE | re.MULTILINE)
+            desc_header_match = DESC_HEADER_RE.search(text_after_detail)
             if desc_header_match:
                 start_desc_index = desc_header_match.end()
                 text_after_desc_header = text_after_detail[start_desc_index:]
                 # **AJUSTE AQUI:** Loop nas próximas linhas ignorando cabeçalhos de tabela
-                header_patterns = r"^\s*(cantidad|quantity|precio|price|importe|amount|mon|curr|value|impte)\b"
                 found_desc_line = None
                 for line in text_after_desc_header.split('\n'):
                     line_strip = line.strip()
-                    if line_strip and not re.search(header_patterns, line_strip, re.IGNORECASE):
+                    if line_strip and not TABLE_HEADER_RE.search(line_strip):
                         found_desc_line = line_strip
                         break # Pega a primeira linha significativa
                 if found_desc_line:
                     result["DESCRIPCIÓN"] = found_desc_line
 
-    # --- BASE IMPONIBLE & IMPORTE TOTAL
-    base_value_clean = None
-    total_value_clean = None
-
-    match_base = re.search(fr"(?:BASE\s*IMPONIBLE|TAX\s*BASE)\s*€?\s*\n?.*?{num_pattern}", full_text, re.IGNORECASE | re.DOTALL)
-    if match_base:
-        base_value_clean = clean_value(combine_num_groups(match_base))
-        result["BASE IMPONIBLE"] = base_value_clean
-
-    match_total = re.search(fr"(?:TOTAL\s*Importe\s*Factura|Invoice\s*TOTAL\s*Value|TOTAL\s*A\s*PAGAR)\s*€?\s*\n?.*?{num_pattern}", full_text, re.IGNORECASE | re.DOTALL)
-    if not match_total:
-        matches = list(re.finditer(fr"\bTOTAL\b\s*€?\s*\n?.*?{num_pattern}", full_text, re.IGNORECASE | re.DOTALL))
-        if matches: match_total = matches[-1]
-    if match_total:
-        total_value_clean = clean_value(combine_num_groups(match_total))
-        result["IMPORTE TOTAL"] = total_value_clean
+    # --- BASE IMPONIBLE & IMPORTE TOTAL (já normalizados por clean_value nas regras)
+    base_value_clean = result["BASE IMPONIBLE"]
+    if not matches["IMPORTE TOTAL"]:
+        total_matches = list(TOTAL_FALLBACK_RE.finditer(full_text))
+        if total_matches:
+            result["IMPORTE TOTAL"] = _clean_amount(total_matches[-1])
+    total_value_clean = result["IMPORTE TOTAL"]
 
     # --- IMPUESTOS
     tax_value = None
+    zero_tax_match = matches["_IVA_ZERO"]
     # 1. Verifica se Base e Total foram encontrados e são numéricos
     try:
         base_float = float(base_value_clean) if base_value_clean is not None else None
@@ -269,7 +675,6 @@ def extract_fields_from_text(text_lines, arquivo_nome):
             #    - Se o imposto calculado for 0.00, verifica se o texto menciona 0%
             #    - Se o imposto calculado for muito diferente de (Base * taxa_padrão), pode ser erro.
             if abs(calculated_tax) < 0.005: # Praticamente zero
-                 zero_tax_match = re.search(r"(?:iva|output\s*tax)[\s,]*0[,.]00\s*%", full_text, re.IGNORECASE)
                  if zero_tax_match:
                       tax_value = "0.00" # Confirma 0.00
                  else:
@@ -280,7 +685,6 @@ def extract_fields_from_text(text_lines, arquivo_nome):
 
         # 4. Se o cálculo falhou ou foi invalidado, tenta encontrar 0% explicitamente
         if tax_value is None:
-            zero_tax_match = re.search(r"(?:iva|output\s*tax)[\s,]*0[,.]00\s*%", full_text, re.IGNORECASE)
             if zero_tax_match:
                  tax_value = "0.00"
 
@@ -288,57 +692,328 @@ def extract_fields_from_text(text_lines, arquivo_nome):
         # Se Base ou Total não forem números válidos, o cálculo falha.
         logging.warning(f"Não foi possível calcular imposto para {arquivo_nome} pois Base ou Total não são numéricos.")
         # Tenta fallback para encontrar 0%
-        zero_tax_match = re.search(r"(?:iva|output\s*tax)[\s,]*0[,.]00\s*%", full_text, re.IGNORECASE)
         if zero_tax_match:
              tax_value = "0.00"
 
     result["IMPUESTOS"] = tax_value
 
-    # OBSERVACIONES
-    stop_obs_patterns = [
-        r"\n\n", r"Pag\.",
-        r"ENDESA\s+X\s+WAY", r"Enel\s+Green\s+Power", r"\bENDESA\b.*\bS\.A\.",
-        r"ESIP\d+", r"Registro\s+Mercantil", r"Inscrita\s+en\s+el\s+Registro"
-    ]
-    match = re.search(r"(?:Observaciones|Observations)\s*:?\s*(.*?)(?:" + "|".join(stop_obs_patterns) + r"|\Z)", full_text, re.IGNORECASE | re.DOTALL | re.S)
-    if match:
-        observations = match.group(1).strip()
-        observations = "\n".join(line for line in observations.split('\n') if line.strip() and not line.startswith("ESIP"))
-        result["OBSERVACIONES"] = observations.replace('\n', ' ').strip()
-
     # Log final
     for key, value in result.items():
-        essential_keys = ["EMISOR", "Nº CLIENTE", "CLIENTE", "REFERENCIA FACTURA", "BASE IMPONIBLE", "IMPORTE TOTAL", "FECHA FACTURA"]
-        if key in essential_keys and value is None:
+        if key in ESSENTIAL_KEYS and value is None:
              logging.warning(f"Campo essencial '{key}' não encontrado no arquivo '{arquivo_nome}'.")
 
-     # ── Converte ponto para vírgula na saída numérica ────────────────
-    for key in ["BASE IMPONIBLE", "IMPUESTOS", "IMPORTE TOTAL"]:
-        val = result.get(key)
-        if isinstance(val, str) and "." in val:
-            result[key] = val.replace(".", ",")
-    # ──────────────────────────────────────────────────────────────────
-    
     return result
     
 
 # --- Função Wrapper (a ser chamada pelo main_processor.py) ---
-def processar_pdf_ocr(pdf_path):
-    """Extrai dados de um PDF via OCR usando a lógica validada."""
+def processar_pdf_ocr(pdf_path, ctx=None):
+    """Extrai dados de um PDF via OCR usando a lógica validada.
+    ctx: PdfContext já aberto (opcional), compartilhado com a detecção."""
     arquivo_nome = Path(pdf_path).name
-    # Usa OCR_ENGINE_OK para verificar se o engine está pronto
-    if not PADDLE_OK or not OCR_ENGINE_OK:
+    # Inicializa o engine no primeiro uso; None indica falha na inicialização
+    if get_ocr_engine() is None:
         logging.error(f"[OCR Wrapper] Tentativa de processar {arquivo_nome} falhou: OCR não está disponível/funcional.")
-        return {"ARQUIVO": arquivo_nome, "ERRO": "OCR não disponível/funcional"}
-
-    img = pdf_to_img_ocr(pdf_path)
-    if img is None: return {"ARQUIVO": arquivo_nome, "ERRO": "Falha ao gerar imagem OCR"}
-
-    logging.info(f"[OCR Wrapper] Executando OCR para {arquivo_nome}...")
-    ocr_lines = run_ocr_task(img)
-    if not ocr_lines: return {"ARQUIVO": arquivo_nome, "ERRO": "OCR não retornou texto"}
+        return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "OCR não disponível/funcional"})
+
+    if OCR_ROI_MODE:
+        logging.info(f"[OCR Wrapper] Executando OCR por regiões para {arquivo_nome}...")
+        with metrics.stage("ocr"):
+            ocr_lines = run_ocr_roi(pdf_path, ctx=ctx)
+    else:
+        key, ocr_lines, img = prepare_page_ocr(pdf_path, ctx=ctx)
+        if ocr_lines is not None:
+            logging.info(f"[OCR Wrapper] OCR de {arquivo_nome} lido do cache de OCR bruto.")
+        else:
+            if img is None: return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "Falha ao gerar imagem OCR"})
+            logging.info(f"[OCR Wrapper] Executando OCR para {arquivo_nome}...")
+            with metrics.stage("ocr"):
+                ocr_lines = run_ocr_task(img, cache_key=key, arquivo=arquivo_nome)
+            img = None # Libera a imagem antes do parse e das páginas seguintes
+    if not ocr_lines: return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "OCR não retornou texto"})
 
     logging.info(f"[OCR Wrapper] Extraindo campos do texto OCR para {arquivo_nome}...")
     # Chama a função principal de extração deste módulo
-    extracted_data = extract_fields_from_text(ocr_lines, arquivo_nome)
-    return extracted_data
+    with metrics.stage("parse"):
+        extracted_data = extract_fields_from_text(ocr_lines, arquivo_nome)
+    return ocr_remaining_pages(pdf_path, ocr_lines, extracted_data, ctx=ctx)
+
+def missing_fields(result):
+    """ Campos de OCR_STOP_KEYS ainda sem valor. """
+    return [k for k in OCR_STOP_KEYS if result.get(k) is None]
+
+def _completar_campos(result, lines, arquivo_nome):
+    # Extrai de novo do texto acumulado e preenche só os campos ainda vazios
+    with metrics.stage("parse"):
+        novo = extract_fields_from_text(lines, arquivo_nome)
+    for key, value in novo.items():
+        if result.get(key) is None and value is not None:
+            result[key] = value
+
+def ocr_remaining_pages(pdf_path, text_lines, result, ctx=None, max_pages=None, render_lock=None):
+    """
+    OCR página a página a partir da segunda, só enquanto faltar algum campo de OCR_STOP_KEYS, até
+    max_pages páginas no total (padrão OCR_MAX_PAGES). As linhas de cada página se somam às anteriores
+    e o texto acumulado é extraído de novo; os valores já encontrados nunca são substituídos.
+    Faturas de uma página (ou já completas) não pagam nada a mais.
+    Se alguma página do PDF saiu com DPI reduzido pelo orçamento de memória, result leva NO_CACHE.
+    render_lock: lock mantido durante a renderização (ex.: pipeline, onde o PyMuPDF é usado por outra thread).
+    Retorna result (atualizado).
+    """
+    max_pages = max_pages or OCR_MAX_PAGES
+    if result.get("ERRO") or max_pages <= 1 or not missing_fields(result):
+        return mark_memory_reduced(pdf_path, result)
+    arquivo_nome = Path(pdf_path).name
+    lock = render_lock or contextlib.nullcontext()
+    owned = False
+    try:
+        with lock:
+            ctx, owned = open_context(pdf_path, ctx)
+            total = min(ctx.page_count, max_pages)
+        lines = list(text_lines)
+        for n in range(1, total):
+            with lock:
+                key, page_lines, img = prepare_page_ocr(pdf_path, ctx=ctx, page_number=n)
+            if page_lines is None:
+                if img is None: continue
+                with metrics.stage("ocr"):
+                    page_lines = run_ocr_task(img, cache_key=key, arquivo=arquivo_nome)
+                img = None
+            if not page_lines: continue
+            lines.extend(page_lines)
+            _completar_campos(result, lines, arquivo_nome)
+            faltando = missing_fields(result)
+            if not faltando:
+                logging.info(f"[OCR] {arquivo_nome}: campos completos na página {n + 1}.")
+                break
+        else:
+            if total > 1:
+                logging.info(f"[OCR] {arquivo_nome}: {total} página(s) lidas, ainda sem {missing_fields(result)}.")
+    except Exception as e:
+        logging.error(f"[OCR] Erro no OCR das páginas seguintes de {arquivo_nome}: {e}", exc_info=True)
+    finally:
+        if owned and ctx:
+            with lock: ctx.close()
+    return mark_memory_reduced(pdf_path, result)
+
+def reparse_pdf_ocr(pdf_path, max_pages=None):
+    """
+    Modo re-parse: refaz só extract_fields_from_text sobre as linhas do cache de OCR bruto, sem renderizar
+    nem rodar o OCR (o engine não é carregado). As páginas seguintes entram como em ocr_remaining_pages,
+    enquanto faltar campo. Com EXTRATOR_OCR_ROI=1 a página 1 vem das linhas guardadas pelo modo ROI
+    (roi_cache_key), que é como a execução original a leu. A página vale em qualquer DPI (o orçamento de memória pode ter reduzido a
+    resolução na execução que fez o OCR). Retorna o dict de processar_pdf_ocr.
+    """
+    arquivo_nome = Path(pdf_path).name
+    if get_ocr_cache() is None:
+        return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "Cache de OCR bruto desativado"})
+    try:
+        file_hash, modelos = _file_hash(pdf_path), model_signature()
+    except OSError as e:
+        return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": f"Arquivo ilegível: {e}"})
+    with metrics.stage("ocr"):
+        ocr_lines = cached_ocr_lines((file_hash, 0, 0, modelos + "|roi" if OCR_ROI_MODE else modelos), any_dpi=True)
+    if ocr_lines is None: return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "OCR bruto não está no cache"})
+    if not ocr_lines: return InvoiceRecord({"ARQUIVO": arquivo_nome, "ERRO": "OCR não retornou texto"})
+    with metrics.stage("parse"):
+        result = extract_fields_from_text(ocr_lines, arquivo_nome)
+    lines = list(ocr_lines)
+    for n in range(1, max_pages or OCR_MAX_PAGES):
+        if not missing_fields(result):
+            break
+        with metrics.stage("ocr"):
+            page_lines = cached_ocr_lines((file_hash, n, 0, modelos), any_dpi=True)
+        if page_lines:
+            lines.extend(page_lines)
+            _completar_campos(result, lines, arquivo_nome)
+    return result
+
+# --- OCR por regiões de interesse (ROI) ---
+# Rótulos procurados na passada de baixa resolução (os mesmos de OCR_RULES, no início do texto da caixa,
+# para que menções soltas como "total" ou "date" no meio de um parágrafo não abram regiões) e quanto (pt)
+# a região se estende abaixo de cada um
+ROI_LABEL_GROUPS = [
+    (re.compile(r"^\W*(?:n[ºo°]?\s*cliente|customer\s*no|nombre\b|name\b|n[ºo°]?\s*factura|invoice\s*no|"
+                r"fecha\s*(?:emisi[oó]n|vencimiento)|issue\s*date|due\s*date|vencimiento|hasta\s*el|until\b)",
+                re.IGNORECASE), 30),
+    (re.compile(r"^\W*(?:detalle\s+de\s+la\s+factura|invoice\s+detail|descripci[oó]n\b|description\b)", re.IGNORECASE), 200),
+    (re.compile(r"^\W*(?:base\s*imponible|tax\s*base|total\s*importe\s*factura|invoice\s*total\s*value|total\s*a\s*pagar|"
+                r"total\b|iva\b|vat\b|output\s*tax|cuota\b)", re.IGNORECASE), 40),
+    (re.compile(r"^\W*(?:observaciones|observations)\b", re.IGNORECASE), 120),
+]
+ROI_HEADER_RATIO = 0.15 # Faixa do topo sempre incluída (emissor/logotipo, fallback das primeiras linhas)
+ROI_MARGIN = 6 # pt acima e à esquerda de cada rótulo
+ROI_MERGE_GAP = 10 # pt: regiões mais próximas que isso são unidas
+
+def _ocr_boxes(engine, img):
+    """ OCR de uma imagem devolvendo [(box, texto)]. """
+    with _engine_call_lock:
+        result = engine.ocr(img, cls=False)
+    out = []
+    if result and isinstance(result, list) and result[0] is not None:
+        for line_info in result[0]:
+            if isinstance(line_info, list) and len(line_info) == 2 and isinstance(line_info[1], tuple):
+                out.append((line_info[0], str(line_info[1][0])))
+    return out
+
+def locate_roi_regions(page, engine):
+    """
+    Passada barata (ROI_PREVIEW_MATRIX) para localizar os rótulos de interesse.
+    Retorna retângulos (coordenadas da página) ordenados de cima para baixo, ou [] se nenhum rótulo for
+    encontrado. Cada região começa na margem esquerda do rótulo e vai até a borda direita da página (o valor
+    fica à direita ou abaixo do rótulo); só a faixa do topo ocupa a largura toda.
+    """
+    img = render_for_ocr(page, ROI_PREVIEW_MATRIX)
+    if img is None: return []
+    zoom_x, zoom_y = ROI_PREVIEW_MATRIX.a, ROI_PREVIEW_MATRIX.d
+    width, height = page.rect.width, page.rect.height
+    regions = [fitz.Rect(0, 0, width, height * ROI_HEADER_RATIO)]
+    found_label = False
+    for box, text in _ocr_boxes(engine, img):
+        for regex, extend in ROI_LABEL_GROUPS:
+            if regex.search(text):
+                x0 = min(p[0] for p in box) / zoom_x
+                y0 = min(p[1] for p in box) / zoom_y
+                y1 = max(p[1] for p in box) / zoom_y
+                regions.append(fitz.Rect(max(0, x0 - ROI_MARGIN), max(0, y0 - ROI_MARGIN), width, min(height, y1 + extend)))
+                found_label = True
+                break
+    if not found_label: return []
+    regions.sort(key=lambda r: r.y0)
+    merged = [regions[0]]
+    for r in regions[1:]:
+        if r.y0 <= merged[-1].y1 + ROI_MERGE_GAP:
+            merged[-1] = merged[-1] | r
+        else:
+            merged.append(r)
+    return merged
+
+def run_ocr_roi(pdf_path, ctx=None):
+    """
+    OCR por regiões: localiza as regiões dos rótulos numa imagem de baixa resolução e só elas são
+    renderizadas em PDF_RESOLUTION_MATRIX (get_pixmap(clip=...)) e enviadas ao OCR.
+    As linhas saem de cima para baixo, no mesmo formato de run_ocr_task. Sem rótulos na passada
+    barata, faz o OCR da página inteira. A saída bruta de todas as regiões fica no cache de OCR bruto
+    (roi_cache_key), para o re-parse e para as próximas execuções no modo ROI.
+    """
+    engine = get_ocr_engine()
+    if engine is None: logging.error("[OCR] Engine não disponível para run_ocr_roi."); return []
+    arquivo_nome = Path(pdf_path).name
+    key = roi_cache_key(pdf_path)
+    lines = cached_ocr_lines(key)
+    if lines is not None:
+        logging.info(f"[OCR ROI] {arquivo_nome} lido do cache de OCR bruto.")
+        return lines
+    owned = False
+    try:
+        ctx, owned = open_context(pdf_path, ctx)
+        page = ctx.page(0)
+        if page is None: logging.warning(f"[OCR] PDF sem páginas: {arquivo_nome}"); return []
+        regions = locate_roi_regions(page, engine)
+        if not regions:
+            logging.info(f"[OCR ROI] Nenhum rótulo na pré-visualização de {arquivo_nome}; OCR da página inteira.")
+            return run_ocr_task(pdf_to_img_ocr(pdf_path, ctx=ctx), cache_key=key, arquivo=arquivo_nome)
+        area_roi = sum(r.width * r.height for r in regions)
+        logging.info(f"[OCR ROI] {arquivo_nome}: {len(regions)} região(ões), "
+                     f"{area_roi / (page.rect.width * page.rect.height):.0%} da página.")
+        brutos = []
+        for rect in regions:
+            img = render_for_ocr(page, clip=rect)
+            raw = run_ocr_task_raw(img) if img is not None else []
+            img = None
+            if raw is None: # Falha do engine numa região: o resultado parcial não vai ao cache
+                key = None
+                continue
+            brutos.extend(raw)
+        store_ocr_raw(key, brutos, arquivo_nome)
+        return raw_to_lines(brutos)
+    except Exception as e:
+        logging.error(f"[OCR] Erro run_ocr_roi para {Path(pdf_path).name}: {e}", exc_info=True); return []
+    finally:
+        if owned and ctx: ctx.close()
+
+# --- OCR de recortes (extração híbrida de PDFs digitais) ---
+# Rótulo + valor dos importes dentro de um recorte (BASE e TOTAL vêm de OCR_RULES)
+HYBRID_TAX_RE = re.compile(r"(?:IVA\s*repercutido|VAT\s*Output\s*tax|Cuota|repercutido)[^\n]*?\s*€?\s*\n?.*?" + NUM_PATTERN,
+                           re.IGNORECASE | re.DOTALL)
+
+def ocr_clip_boxes(page, rect):
+    """
+    OCR de um recorte da página (renderizado em PDF_RESOLUTION_MATRIX só na área rect).
+    Retorna [(fitz.Rect em coordenadas da página, texto)] de cima para baixo, ou [] sem engine.
+    """
+    engine = get_ocr_engine()
+    if engine is None: return []
+    img = render_for_ocr(page, clip=rect)
+    if img is None: return []
+    zoom_x, zoom_y = PDF_RESOLUTION_MATRIX.a, PDF_RESOLUTION_MATRIX.d
+    out = []
+    for box, text in _ocr_boxes(engine, img):
+        xs, ys = [p[0] for p in box], [p[1] for p in box]
+        out.append((fitz.Rect(rect.x0 + min(xs) / zoom_x, rect.y0 + min(ys) / zoom_y,
+                              rect.x0 + max(xs) / zoom_x, rect.y0 + max(ys) / zoom_y), text.strip()))
+    out.sort(key=lambda b: (round(b[0].y0), b[0].x0))
+    return out
+
+def extract_amounts_from_text(text_lines):
+    """ BASE IMPONIBLE, IMPUESTOS e IMPORTE TOTAL (texto '1234.56') de linhas com rótulo + valor. """
+    full_text = "\n".join(text_lines)
+    matches = OCR_SCANNER.scan(full_text)
+    amounts = {}
+    for rule in OCR_RULES:
+        if rule.name in ("BASE IMPONIBLE", "IMPORTE TOTAL") and matches[rule.name]:
+            amounts[rule.name] = rule.normalizer(matches[rule.name])
+    tax = HYBRID_TAX_RE.search(full_text)
+    if tax:
+        amounts["IMPUESTOS"] = _clean_amount(tax)
+    return {k: v for k, v in amounts.items() if v is not None}
+
+def processar_pdfs_ocr_lote(pdf_paths, batch_size=None):
+    """
+    Versão em lote de processar_pdf_ocr: renderiza a página 1 de vários PDFs, faz o OCR de todos com
+    run_ocr_batch e extrai os campos arquivo a arquivo. Retorna um dict por PDF, na mesma ordem.
+    """
+    if OCR_ROI_MODE: # As regiões variam por arquivo: cada PDF segue o caminho ROI individual
+        logging.info(f"[OCR ROI] Modo ROI ativo: lote de {len(pdf_paths)} PDF(s) processado arquivo a arquivo, sem OCR em lote.")
+        return [processar_pdf_ocr(p) for p in pdf_paths]
+    nomes = [Path(p).name for p in pdf_paths]
+    if get_ocr_engine() is None:
+        logging.error("[OCR Wrapper] Lote OCR falhou: OCR não está disponível/funcional.")
+        return [InvoiceRecord({"ARQUIVO": n, "ERRO": "OCR não disponível/funcional"}) for n in nomes]
+
+    # Tempos por arquivo; o OCR do lote é rateado igualmente entre as imagens
+    # Páginas já no cache de OCR bruto não são renderizadas nem entram no lote
+    tempos = [{} for _ in pdf_paths]
+    chaves, linhas, validas, donos = [], [], [], []
+    for n, (p, t) in enumerate(zip(pdf_paths, tempos)):
+        with metrics.collecting(t):
+            key, ocr_lines, img = prepare_page_ocr(p)
+        chaves.append(key)
+        linhas.append(ocr_lines)
+        if img is not None:
+            validas.append(img)
+            donos.append(n)
+        img = None
+    if validas:
+        logging.info(f"[OCR Wrapper] Executando OCR em lote para {len(validas)} de {len(pdf_paths)} arquivo(s)...")
+        inicio = time.perf_counter()
+        brutos = run_ocr_batch(validas, batch_size, raw=True)
+        validas = None # As imagens são liberadas logo após o OCR
+        fatia_ocr = (time.perf_counter() - inicio) / len(donos)
+        for n, raw in zip(donos, brutos):
+            store_ocr_raw(chaves[n], raw, nomes[n])
+            linhas[n] = raw_to_lines(raw)
+            tempos[n]["ocr"] = fatia_ocr
+
+    resultados = []
+    for p, nome, ocr_lines, t in zip(pdf_paths, nomes, linhas, tempos):
+        if ocr_lines is None:
+            resultado = InvoiceRecord({"ARQUIVO": nome, "ERRO": "Falha ao gerar imagem OCR"})
+        elif not ocr_lines:
+            resultado = InvoiceRecord({"ARQUIVO": nome, "ERRO": "OCR não retornou texto"})
+        else:
+            with metrics.collecting(t):
+                with metrics.stage("parse"):
+                    resultado = extract_fields_from_text(ocr_lines, nome)
+                resultado = ocr_remaining_pages(p, ocr_lines, resultado)
+        resultados.append(metrics.attach(resultado, t, sum(t.values())))
+    return resultados
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+service.py
+Serviço HTTP local de longa duração (asyncio, só biblioteca padrão): os processos de extração ficam
+abertos com os módulos importados e o PaddleOCR já carregado, e cada fatura enviada volta em segundos.
+    python service.py --port 8765 --workers 2
+    curl --data-binary @fatura.pdf "http://127.0.0.1:8765/extract?name=fatura.pdf"
+Rotas:
+- POST /extract?name=<arquivo.pdf>&mode=auto|digital|ocr  corpo = bytes do PDF; resposta = dados_fatura (JSON)
+- GET  /metrics        métricas no formato texto do Prometheus (latência, fila, estágios)
+- GET  /metrics.json   as mesmas métricas em JSON
+- GET  /health
+Concorrência: no máximo `workers` lotes no executor ao mesmo tempo; os pedidos esperam numa fila limitada
+(max_pending). Fila cheia responde 503 com Retry-After (backpressure) em vez de acumular memória: o lugar na
+fila é reservado antes de ler o corpo, de modo que pedidos recusados não chegam a ser lidos.
+Worker morto (pool quebrado): o pool é recriado e o lote reenviado uma vez; se falhar de novo, os pedidos
+respondem 500. Enquanto o pool está sendo recriado, /health responde 503 com status "degraded".
+Lotes: quando um worker fica livre, leva de uma vez os pedidos que estão na fila (até batch_size),
+esperando no máximo batch_window segundos por mais pedidos.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from invoice_record import InvoiceRecord
+
+SERVICE_HOST = os.environ.get("EXTRATOR_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("EXTRATOR_SERVICE_PORT", "8765"))
+SERVICE_WORKERS = int(os.environ.get("EXTRATOR_SERVICE_WORKERS", "2"))
+SERVICE_MAX_PENDING = int(os.environ.get("EXTRATOR_SERVICE_MAX_PENDING", "64"))
+SERVICE_BATCH_SIZE = int(os.environ.get("EXTRATOR_SERVICE_BATCH", "4"))
+SERVICE_BATCH_WINDOW = float(os.environ.get("EXTRATOR_SERVICE_BATCH_WINDOW_MS", "20")) / 1000
+MAX_BODY_BYTES = int(os.environ.get("EXTRATOR_SERVICE_MAX_MB", "50")) * 1024 * 1024
+LATENCY_WINDOW = 2000 # Últimos pedidos usados nos percentis de latência
+
+MODES = {"auto": None, "digital": "Digital", "ocr": "OCR"}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+_NOME_INVALIDO_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+class ServiceBusy(Exception):
+    """ Fila de pedidos cheia (o cliente deve tentar de novo mais tarde). """
+
+
+class WorkerFailure(Exception):
+    """ O lote do pedido não foi processado (worker morto ou erro fora da extração). registro: dados_fatura com ERRO. """
+
+    def __init__(self, registro):
+        super().__init__(registro.get("ERRO"))
+        self.registro = registro
+
+
+# --- Funções executadas dentro dos workers ---
+def _init_worker(warm, log_level):
+    # Ctrl+C chega a todo o grupo de processos; quem encerra os workers é o processo principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main_processor # noqa: F401 - importa extratores e dependências uma única vez por processo
+    logging.getLogger().setLevel(log_level)
+    if warm:
+        import script_ocr
+        if script_ocr.get_ocr_engine() is None:
+            logging.error(f"[Serviço] Worker {os.getpid()} sem engine OCR.")
+    logging.info(f"[Serviço] Worker {os.getpid()} pronto.")
+
+
+def _processar_lote(itens):
+    """
+    itens: [(nome do arquivo, bytes do PDF, tipo forçado ou None)]. Retorna um dados_fatura por item, na
+    mesma ordem. Os tipos desconhecidos são decididos juntos (classifier.classify_many, memoizado por conteúdo)
+    e os PDFs OCR do lote vão juntos ao reconhecimento (script_ocr.processar_pdfs_ocr_lote).
+    """
+    import classifier
+    import main_processor
+    import script_ocr
+    with tempfile.TemporaryDirectory(prefix="extrator_srv_") as tmp:
+        caminhos = []
+        for n, (nome, dados, _) in enumerate(itens):
+            caminho = Path(tmp) / str(n) / nome # Pasta por item: ARQUIVO é o nome enviado
+            caminho.parent.mkdir()
+            caminho.write_bytes(dados)
+            caminhos.append(caminho)
+
+        tipos = [tipo for _, _, tipo in itens]
+        desconhecidos = [c for c, t in zip(caminhos, tipos) if t is None]
+        inicio = time.perf_counter()
+        classificados = classifier.classify_many(desconhecidos) if desconhecidos else {}
+        segundos_deteccao = (time.perf_counter() - inicio) / max(1, len(desconhecidos))
+        tipos = [t or classificados[c] for c, t in zip(caminhos, tipos)]
+
+        resultados = [None] * len(itens)
+        idx_ocr = [i for i, t in enumerate(tipos) if t == 'OCR']
+        for i, t in enumerate(tipos):
+            if t != 'OCR' or len(idx_ocr) == 1:
+                resultados[i] = main_processor.process_single_pdf(caminhos[i], t)
+        if len(idx_ocr) > 1:
+            for i, extraido in zip(idx_ocr, script_ocr.processar_pdfs_ocr_lote([caminhos[i] for i in idx_ocr])):
+                dados_fatura = main_processor.novo_registro(caminhos[i])
+                main_processor.aplicar_resultado_ocr(dados_fatura, extraido)
+                dados_fatura["SOURCE_DETECTION"] = 'OCR'
+                main_processor.finalizar_registro(dados_fatura)
+                resultados[i] = dados_fatura
+        for i, c in enumerate(caminhos):
+            if c in classificados:
+                resultados[i]["T_DETECCAO_MS"] = round(segundos_deteccao * 1000, 2)
+        return resultados
+
+
+def _nome_seguro(nome):
+    nome = _NOME_INVALIDO_RE.sub("_", Path(nome or "").name).strip(" .") or "fatura.pdf"
+    return nome if nome.lower().endswith(".pdf") else nome + ".pdf"
+
+
+class ExtractionService:
+    """
+    Extração assíncrona com executor limitado, fila com backpressure e lotes.
+        servico = ExtractionService(workers=2)
+        await servico.start()
+        dados = await servico.submit("fatura.pdf", pdf_bytes)
+        await servico.close()
+    """
+
+    def __init__(self, workers=None, max_pending=None, batch_size=None, batch_window=None, warm=True):
+        self.workers = max(1, workers or SERVICE_WORKERS)
+        self.max_pending = max(1, max_pending or SERVICE_MAX_PENDING)
+        self.batch_size = max(1, batch_size or SERVICE_BATCH_SIZE)
+        self.batch_window = SERVICE_BATCH_WINDOW if batch_window is None else batch_window
+        self.warm = warm
+        self.run_metrics = metrics.RunMetrics(workers=self.workers, modo="servico")
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.pool_restarts = 0
+        self.degraded = False
+        self.batches = 0
+        self.batched_items = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self._executor = None
+        self._queue = None
+        self._slots = None
+        self._despachante = None
+        self._tarefas = set()
+        self._reservas = 0
+        self._recriando = None
+
+    def _novo_executor(self):
+        # spawn: mesmo comportamento no Windows/executável e no Linux (ver ocr_pool)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self.warm, logging.getLogger().level))
+
+    async def _aquecer(self):
+        """ Sobe os workers já (modelos carregados antes do primeiro pedido). """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._executor, os.getpid) for _ in range(self.workers)])
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._recriando = asyncio.Lock()
+        self._executor = self._novo_executor()
+        await self._aquecer()
+        self._despachante = asyncio.create_task(self._despachar())
+        logging.info(f"[Serviço] {self.workers} worker(s), fila de até {self.max_pending} pedido(s), "
+                     f"lotes de até {self.batch_size}.")
+
+    async def close(self):
+        if self._despachante:
+            self._despachante.cancel()
+        if self._tarefas:
+            await asyncio.gather(*self._tarefas, return_exceptions=True)
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _recriar_executor(self, quebrado):
+        """
+        Troca o pool quebrado (worker morto) por um novo, já aquecido, como o run_extraction faz com os
+        pendentes. Vários lotes falham juntos quando o pool quebra: só o primeiro recria.
+        """
+        async with self._recriando:
+            if self._executor is not quebrado:
+                return
+            self.degraded = True
+            self.pool_restarts += 1
+            logging.warning(f"[Serviço] Pool de workers quebrado; recriando ({self.pool_restarts}ª vez).")
+            quebrado.shutdown(wait=False, cancel_futures=True)
+            try:
+                self._executor = self._novo_executor()
+                await self._aquecer()
+                self.degraded = False
+            except Exception as e:
+                logging.error(f"[Serviço] Falha ao recriar o pool de workers: {e}", exc_info=True)
+
+    def check_pool(self):
+        """
+        Estado do pool para o /health: True se utilizável. Pool quebrado sem pedido em andamento (worker
+        morto enquanto ocioso) é notado aqui e recriado em segundo plano, sem esperar o próximo lote.
+        """
+        if self.degraded:
+            return False
+        executor = self._executor
+        if executor is not None and getattr(executor, "_broken", False):
+            self.degraded = True
+            tarefa = asyncio.create_task(self._recriar_executor(executor))
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+            return False
+        return True
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def reserve(self):
+        """
+        Reserva um lugar na fila antes de ler o corpo do pedido (fila cheia: ServiceBusy, sem ler nada).
+        Liberar com release() logo depois da leitura; o submit feito em seguida, sem await no meio, ocupa o lugar.
+        """
+        if self._queue.qsize() + self._reservas >= self.max_pending:
+            self.requests += 1
+            self.rejected += 1
+            raise ServiceBusy()
+        self._reservas += 1
+
+    def release(self):
+        self._reservas -= 1
+
+    async def submit(self, nome, dados, tipo=None):
+        """ Enfileira um PDF e espera o dados_fatura. Fila cheia: ServiceBusy; lote não processado: WorkerFailure. """
+        self.requests += 1
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((_nome_seguro(nome), dados, tipo, futuro, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ServiceBusy()
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await futuro
+
+    async def _despachar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire() # Só forma o lote quando há worker livre: sob carga, a fila vira lote
+            lote = [await self._queue.get()]
+            limite = loop.time() + self.batch_window
+            while len(lote) < self.batch_size:
+                try:
+                    lote.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._queue.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            tarefa = asyncio.create_task(self._executar(lote))
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _executar(self, lote):
+        loop = asyncio.get_running_loop()
+        agora = time.perf_counter()
+        for *_, enfileirado in lote:
+            self.queue_waits.append(agora - enfileirado)
+        self.batches += 1
+        self.batched_items += len(lote)
+        self.in_flight += len(lote)
+        itens = [(nome, dados, tipo) for nome, dados, tipo, *_ in lote]
+        try:
+            resultados = erro = None
+            for tentativa in range(2): # Pool quebrado: recria e reenvia o lote uma vez
+                executor = self._executor
+                try:
+                    resultados = await loop.run_in_executor(executor, _processar_lote, itens)
+                    break
+                except BrokenProcessPool as e:
+                    erro = e
+                    logging.error(f"[Serviço] Worker morto ao processar lote de {len(lote)} (tentativa {tentativa + 1}): {e}")
+                    await self._recriar_executor(executor)
+                except Exception as e:
+                    erro = e
+                    logging.error(f"[Serviço] Falha no worker ao processar lote de {len(lote)}: {e}", exc_info=True)
+                    break
+            fim = time.perf_counter()
+            for n, (nome, _, _, futuro, enfileirado) in enumerate(lote):
+                self.latencies.append(fim - enfileirado)
+                if resultados is None:
+                    dados_fatura = InvoiceRecord({"ARQUIVO": nome, "SOURCE_DETECTION": "Indefinido", "SOURCE_EXTRACTION": "Falha Geral",
+                                                  "ERRO": f"Falha no worker: {erro or 'pool quebrado'}"})
+                    self.failed += 1
+                else:
+                    dados_fatura = resultados[n]
+                self.run_metrics.observe(dados_fatura)
+                if futuro.done():
+                    continue
+                if resultados is None:
+                    futuro.set_exception(WorkerFailure(dados_fatura))
+                else:
+                    futuro.set_result(dados_fatura)
+        finally:
+            self.in_flight -= len(lote)
+            self._slots.release()
+
+    def stats(self) -> dict:
+        resumo = self.run_metrics.summary()
+        latencias, esperas = list(self.latencies), list(self.queue_waits)
+
+        def ms(valores, p):
+            return round(metrics.percentile(valores, p) * 1000, 2) if valores else None
+
+        resumo.update({
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "pool_restarts": self.pool_restarts,
+            "degraded": self.degraded,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else None,
+            "latency_ms": {"p50": ms(latencias, 0.5), "p95": ms(latencias, 0.95), "p99": ms(latencias, 0.99)},
+            "queue_wait_ms": {"p50": ms(esperas, 0.5), "p95": ms(esperas, 0.95)},
+        })
+        return resumo
+
+    def prometheus_text(self, prefixo="extrator_faturas_service"):
+        r = self.stats()
+        linhas = []
+        metrics.prometheus_metric(linhas, f"{prefixo}_requests_total", "counter", "Pedidos recebidos.", [({}, r["requests"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_rejected_total", "counter", "Pedidos recusados com fila cheia.",
+                                  [({}, r["rejected"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_failed_total", "counter", "Pedidos com falha do worker (HTTP 500).",
+                                  [({}, r["failed"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_pool_restarts_total", "counter", "Pools de workers recriados.",
+                                  [({}, r["pool_restarts"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_degraded", "gauge", "1 enquanto o pool de workers é recriado.",
+                                  [({}, int(r["degraded"]))])
+        metrics.prometheus_metric(linhas, f"{prefixo}_queue_depth", "gauge", "Pedidos esperando na fila.",
+                                  [({}, r["queue_depth"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_queue_depth_max", "gauge", "Maior profundidade da fila.",
+                                  [({}, r["max_queue_depth"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_in_flight", "gauge", "Pedidos em processamento.",
+                                  [({}, r["in_flight"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_batches_total", "counter", "Lotes enviados aos workers.",
+                                  [({}, r["batches"])])
+        metrics.prometheus_metric(linhas, f"{prefixo}_latency_seconds", "gauge", "Latência dos pedidos (quantis).",
+                                  [({"quantile": q}, round((r["latency_ms"][k] or 0) / 1000, 6))
+                                   for q, k in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))])
+        metrics.prometheus_metric(linhas, f"{prefixo}_queue_wait_seconds", "gauge", "Espera na fila (quantis).",
+                                  [({"quantile": q}, round((r["queue_wait_ms"][k] or 0) / 1000, 6))
+                                   for q, k in (("0.5", "p50"), ("0.95", "p95"))])
+        return "\n".join(linhas) + "\n" + self.run_metrics.prometheus_text()
+
+
+# --- HTTP (HTTP/1.1 mínimo sobre asyncio.start_server, uma requisição por conexão) ---
+async def _ler_requisicao(reader):
+    linha = (await reader.readline()).decode("latin-1").strip()
+    if not linha:
+        return None
+    metodo, alvo, _ = linha.split(" ", 2)
+    headers = {}
+    while True:
+        linha = (await reader.readline()).decode("latin-1")
+        if linha in ("\r\n", "\n", ""):
+            break
+        chave, _, valor = linha.partition(":")
+        headers[chave.strip().lower()] = valor.strip()
+    return metodo.upper(), alvo, headers
+
+
+def _resposta(writer, status, corpo, content_type="application/json; charset=utf-8", extra_headers=None):
+    if not isinstance(corpo, bytes):
+        corpo = (corpo if isinstance(corpo, str) else json.dumps(corpo, ensure_ascii=False, default=str)).encode("utf-8")
+    cabecalho = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(corpo)}", "Connection: close"]
+    cabecalho += [f"{k}: {v}" for k, v in (extra_headers or {}).items()]
+    writer.write(("\r\n".join(cabecalho) + "\r\n\r\n").encode("latin-1") + corpo)
+
+
+async def _atender(servico, reader, writer):
+    try:
+        requisicao = await _ler_requisicao(reader)
+        if requisicao is None:
+            return
+        metodo, alvo, headers = requisicao
+        url = urlsplit(alvo)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if url.path == "/health" and metodo == "GET":
+            saudavel = servico.check_pool()
+            _resposta(writer, 200 if saudavel else 503,
+                      {"status": "ok" if saudavel else "degraded", "workers": servico.workers,
+                       "queue_depth": servico.queue_depth, "pool_restarts": servico.pool_restarts})
+        elif url.path == "/metrics" and metodo == "GET":
+            _resposta(writer, 200, servico.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/metrics.json" and metodo == "GET":
+            _resposta(writer, 200, servico.stats())
+        elif url.path == "/extract":
+            # Tudo o que recusa o pedido vem antes de ler o corpo (até MAX_BODY_BYTES por conexão)
+            tamanho = int(headers.get("content-length") or -1)
+            if metodo != "POST":
+                _resposta(writer, 405, {"erro": "Use POST com os bytes do PDF no corpo"})
+            elif tamanho < 0:
+                _resposta(writer, 411, {"erro": "Content-Length obrigatório"})
+            elif tamanho > MAX_BODY_BYTES:
+                _resposta(writer, 413, {"erro": f"PDF maior que {MAX_BODY_BYTES // (1024 * 1024)} MB"})
+            elif query.get("mode", "auto") not in MODES:
+                _resposta(writer, 400, {"erro": f"mode deve ser um de {sorted(MODES)}"})
+            else:
+                try:
+                    servico.reserve()
+                    try:
+                        corpo = await reader.readexactly(tamanho)
+                    finally:
+                        servico.release()
+                    if b"%PDF" not in corpo[:1024]:
+                        _resposta(writer, 400, {"erro": "O corpo não é um PDF"})
+                    else:
+                        nome = query.get("name") or headers.get("x-filename") or "fatura.pdf"
+                        dados_fatura = await servico.submit(nome, corpo, MODES[query.get("mode", "auto")])
+                        _resposta(writer, 200, dados_fatura.to_dict())
+                except ServiceBusy:
+                    _resposta(writer, 503, {"erro": "Fila cheia, tente novamente"}, extra_headers={"Retry-After": "1"})
+                except WorkerFailure as e:
+                    _resposta(writer, 500, {"erro": str(e), "dados_fatura": e.registro.to_dict()})
+        else:
+            _resposta(writer, 404, {"erro": "Rota inexistente"})
+    except (ValueError, asyncio.IncompleteReadError) as e:
+        _resposta(writer, 400, {"erro": f"Requisição inválida: {e}"})
+    except Exception as e:
+        logging.error(f"[Serviço] Erro ao atender requisição: {e}", exc_info=True)
+        _resposta(writer, 500, {"erro": str(e)})
+    finally:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def serve(host=None, port=None, ready=None, **opcoes):
+    """ Sobe o serviço e atende até ser cancelado. ready: asyncio.Event sinalizado quando aceita conexões. """
+    servico = ExtractionService(**opcoes)
+    await servico.start()
+    server = await asyncio.start_server(lambda r, w: _atender(servico, r, w), host or SERVICE_HOST, port or SERVICE_PORT)
+    enderecos = ", ".join(f"http://{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+    logging.info(f"[Serviço] Ouvindo em {enderecos}")
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await servico.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP local de extração de faturas.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Endereço (padrão: 127.0.0.1, só a máquina local)")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Processos de extração (modelos carregados)")
+    parser.add_argument("--max-pending", type=int, default=SERVICE_MAX_PENDING, help="Pedidos na fila antes de responder 503")
+    parser.add_argument("--batch-size", type=int, default=SERVICE_BATCH_SIZE, help="Pedidos por lote enviado a um worker")
+    parser.add_argument("--batch-window-ms", type=float, default=SERVICE_BATCH_WINDOW * 1000,
+                        help="Espera máxima por mais pedidos ao formar um lote")
+    parser.add_argument("--no-warm", action="store_true", help="Não carrega o PaddleOCR ao subir os workers")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Só avisos e erros no log")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(logging.WARNING if args.quiet else logging.INFO) # basicConfig já feito (main_processor)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          batch_size=args.batch_size, batch_window=args.batch_window_ms / 1000, warm=not args.no_warm))
+    except KeyboardInterrupt:
+        logging.info("[Serviço] Encerrado.")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
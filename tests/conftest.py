@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração dos testes: módulos da raiz no sys.path, caches SQLite em diretório temporário (nunca os
+de ~/.extratorfaturas) e uma fatura digital gerada com o PyMuPDF, no layout das faturas reais.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+_TMP = tempfile.mkdtemp(prefix="extrator-testes-")
+os.environ.setdefault("EXTRATOR_CACHE_DB", os.path.join(_TMP, "cache.sqlite"))
+os.environ.setdefault("EXTRATOR_TEMPLATES_DB", os.path.join(_TMP, "layout_templates.sqlite"))
+os.environ.setdefault("EXTRATOR_OCR_CACHE_DB", os.path.join(_TMP, "ocr_cache.sqlite"))
+
+import fitz  # noqa: E402
+import pytest  # noqa: E402
+
+# (x, y, texto) da fatura de teste; y é a linha de base
+LINHAS_FATURA = [
+    (40, 40, "Endesa Energía, S.A.U."),
+    (40, 58, "Nº Cliente: 1234500"),
+    (40, 76, "Nombre: CLIENTE 0 S.L. NIF/CIF: B1234"),
+    (40, 94, "Nº Factura: FT 24/00100"),
+    (40, 112, "Descripción"),
+    (40, 130, "Suministro item 0"),
+    (40, 148, "TOTALS"),
+    (40, 166, "BASE IMPONIBLE              1.000,00 EUR"),
+    (40, 184, "IVA repercutido 21%          210,00 EUR"),
+    (40, 202, "TOTAL importe Factura       1.210,00 EUR"),
+    (40, 220, "Observaciones"),
+    (40, 238, "Pago domiciliado 0. Nº cliente repetido: nº cliente"),
+    (300, 166, "Subtotal 1.000,00"),
+    (300, 184, "Cuota 210,00"),
+    (40, 256, "Pag. 1/1"),
+]
+
+
+def gerar_fatura(caminho, linhas=LINHAS_FATURA, paginas=1):
+    """ PDF digital com as linhas dadas (repetidas em cada página). """
+    doc = fitz.open()
+    for _ in range(paginas):
+        page = doc.new_page(width=595, height=842)
+        for x, y, texto in linhas:
+            page.insert_text((x, y), texto, fontsize=9)
+    doc.save(str(caminho))
+    doc.close()
+    return Path(caminho)
+
+
+@pytest.fixture
+def fatura_pdf(tmp_path):
+    return gerar_fatura(tmp_path / "fatura.pdf")
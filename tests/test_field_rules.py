@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+field_rules contra as buscas que substitui (user-004): TextScanner.scan dá, para cada regra, o mesmo
+match de rule.regex.search(texto); LabelMatcher.scan acha as mesmas posições que str.find por rótulo.
+"""
+import re
+
+import pytest
+
+import script_ocr
+from field_rules import FieldRule, LabelMatcher, TextScanner
+
+TEXTOS_OCR = [
+    "",
+    "Endesa Energía, S.A.U.\nNº Cliente: 1234500\nNombre: CLIENTE 0 S.L. NIF/CIF: B1234\n"
+    "Nº Factura: FT 24/00100\nFecha emisión: 01/02/2024\nFecha vencimiento: 15/02/2024\n"
+    "BASE IMPONIBLE 1.000,00 €\nIVA 21% 210,00\nTOTAL Importe Factura 1.210,00 €\n"
+    "Observaciones: Pago domiciliado.\nPag. 1/1",
+    # Rótulo sem valor antes da ocorrência que casa; maiúsculas/minúsculas misturadas
+    "base imponible\n(ver detalhe)\nTAX BASE 95,10\nInvoice TOTAL Value\n\n115,07-\nIssue Date 3/4/2024",
+    # Rótulos sobrepostos ("Vencimiento" dentro de "Fecha vencimiento") e valores em outra linha
+    "Fecha vencimiento\n10/10/2024\nVencimiento: 11/10/2024\nTOTAL A PAGAR\n€ 12.345,67\nname: ACME",
+    "IVA 0,00 % exento\nOutput tax 0.00%\nObservations\nNone\nCustomer no. 998877",
+]
+
+
+@pytest.mark.parametrize("texto", TEXTOS_OCR)
+def test_text_scanner_equivale_a_search_por_regra(texto):
+    resultado = script_ocr.OCR_SCANNER.scan(texto)
+    for regra in script_ocr.OCR_RULES:
+        esperado = regra.regex.search(texto)
+        obtido = resultado[regra.name]
+        if esperado is None:
+            assert obtido is None, regra.name
+        else:
+            assert obtido is not None, regra.name
+            assert (obtido.span(), obtido.groups()) == (esperado.span(), esperado.groups()), regra.name
+
+
+def test_text_scanner_com_regras_avulsas():
+    regras = [
+        FieldRule("A", [r"total"], r"\s*(\d+)", flags=re.IGNORECASE, literal=False),
+        FieldRule("B", [r"total\s*geral", r"soma"], r"\s*:\s*(\d+)", flags=re.IGNORECASE, literal=False),
+    ]
+    texto = "Total geral: 7\nsoma: 8\nTOTAL 9"
+    resultado = TextScanner(regras).scan(texto)
+    for regra in regras:
+        assert resultado[regra.name].span() == regra.regex.search(texto).span()
+
+
+@pytest.mark.parametrize("texto", [
+    "nº cliente: 1 / nº cliente 2",
+    "total importe factura total",
+    "base imponibleiva repercutidoiva repercutido",
+    "sem rótulo nenhum",
+])
+def test_label_matcher_equivale_a_find(texto):
+    rotulos = ["nº cliente", "nº cliente:", "total", "total importe factura", "base imponible",
+               "iva repercutido", "repercutido"]
+    esperado = set()
+    for rotulo in rotulos:
+        pos = texto.find(rotulo)
+        while pos != -1:
+            esperado.add((pos, rotulo))
+            pos = texto.find(rotulo, pos + 1)
+    assert set(LabelMatcher(rotulos).scan(texto)) == esperado
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+journal (user-011): ida e volta do diário, retomada depois de uma queda (última linha truncada) e
+preservação do diário anterior quando a execução não é uma retomada.
+"""
+import os
+
+from invoice_record import InvoiceRecord
+from journal import ResultJournal, load_journal
+
+
+def _pdfs(tmp_path, n=3):
+    pdfs = []
+    for i in range(n):
+        p = tmp_path / f"f{i}.pdf"
+        p.write_bytes(b"%PDF-1.4 " + bytes([i]))
+        pdfs.append(p)
+    return pdfs
+
+
+def test_ida_e_volta(tmp_path):
+    pdfs = _pdfs(tmp_path)
+    caminho = tmp_path / "saida.csv.journal.jsonl"
+    with ResultJournal(caminho) as journal:
+        for p in pdfs:
+            journal.append(p, InvoiceRecord({"ARQUIVO": p.name, "IMPORTE TOTAL": "1.210,00"}))
+    concluidos = load_journal(str(caminho), pdfs)
+    assert list(concluidos) == pdfs
+    assert all(isinstance(r, InvoiceRecord) for r in concluidos.values())
+    assert concluidos[pdfs[0]]["IMPORTE TOTAL"] == 1210.0
+
+
+def test_retomada_com_ultima_linha_truncada(tmp_path):
+    pdfs = _pdfs(tmp_path)
+    caminho = tmp_path / "j.jsonl"
+    with ResultJournal(caminho) as journal:
+        journal.append(pdfs[0], {"ARQUIVO": pdfs[0].name})
+        journal.append(pdfs[1], {"ARQUIVO": pdfs[1].name})
+    # Queda no meio da gravação da segunda linha
+    dados = caminho.read_bytes()
+    caminho.write_bytes(dados[:-15])
+    assert list(load_journal(str(caminho), pdfs)) == [pdfs[0]]
+
+    # A retomada continua o mesmo diário numa linha nova, sem colar na linha truncada
+    with ResultJournal(caminho, resume=True) as journal:
+        journal.append(pdfs[1], {"ARQUIVO": pdfs[1].name})
+        journal.append(pdfs[2], {"ARQUIVO": pdfs[2].name})
+    assert list(load_journal(str(caminho), pdfs)) == pdfs
+
+
+def test_arquivo_alterado_e_registro_com_erro_sao_refeitos(tmp_path):
+    pdfs = _pdfs(tmp_path)
+    caminho = tmp_path / "j.jsonl"
+    with ResultJournal(caminho) as journal:
+        journal.append(pdfs[0], {"ARQUIVO": pdfs[0].name})
+        journal.append(pdfs[1], {"ARQUIVO": pdfs[1].name, "ERRO": "Falha no worker"})
+    pdfs[0].write_bytes(b"%PDF-1.4 alterado")
+    assert load_journal(str(caminho), pdfs) == {}
+    assert list(load_journal(str(caminho), pdfs, retry_errors=False)) == [pdfs[1]]
+
+
+def test_execucao_nova_preserva_o_diario_anterior(tmp_path):
+    pdfs = _pdfs(tmp_path)
+    caminho = tmp_path / "j.jsonl"
+    with ResultJournal(caminho) as journal:
+        journal.append(pdfs[0], {"ARQUIVO": pdfs[0].name})
+    anterior = caminho.read_text(encoding="utf-8")
+    with ResultJournal(caminho, resume=False) as journal:
+        journal.append(pdfs[1], {"ARQUIVO": pdfs[1].name})
+    preservados = [p for p in os.listdir(tmp_path) if p.startswith("j.jsonl.")]
+    assert len(preservados) == 1
+    assert (tmp_path / preservados[0]).read_text(encoding="utf-8") == anterior
+    assert list(load_journal(str(caminho), pdfs)) == [pdfs[1]]
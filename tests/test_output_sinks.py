@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+output_sinks (user-012): o OrderedWriter grava na ordem dos índices o que chega fora de ordem, e os
+destinos (CSV, Parquet, XLSX) devolvem, lidos de volta, os mesmos registros no mesmo esquema.
+"""
+import pandas as pd
+import pytest
+
+import output_sinks
+from invoice_record import InvoiceRecord
+
+
+class _Lista:
+    """ Destino em memória: só write/close, como o OrderedWriter usa. """
+
+    def __init__(self):
+        self.linhas = []
+        self.fechado = False
+
+    def write(self, registro):
+        self.linhas.append(registro)
+
+    def close(self):
+        self.fechado = True
+
+
+def _registros(n):
+    return [InvoiceRecord({"ARQUIVO": f"f{i}.pdf", "EMISOR": "ENDESA S.A.", "BASE IMPONIBLE": "1.000,00",
+                           "IMPUESTOS": "210,00", "IMPORTE TOTAL": "1.210,00", "MONEDA": "EUR"})
+            for i in range(n)]
+
+
+def test_ordered_writer_grava_na_ordem_dos_indices():
+    destino = _Lista()
+    escritor = output_sinks.OrderedWriter(destino)
+    for indice in (2, 0, 3, 1, 1, 0, 5):  # repetidos são ignorados
+        escritor.put(indice, indice)
+        assert destino.linhas == sorted(destino.linhas)
+        assert len(escritor._pendentes) <= 3
+    assert destino.linhas == [0, 1, 2, 3]
+    escritor.finish()
+    assert destino.linhas == [0, 1, 2, 3, 5] and destino.fechado
+    escritor.put(6, 6)  # depois do finish nada mais é gravado
+    assert destino.linhas == [0, 1, 2, 3, 5]
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet", "xlsx"])
+def test_ida_e_volta_pelos_destinos(tmp_path, formato):
+    caminho = tmp_path / f"saida.{formato}"
+    registros = _registros(5)
+    registros[3]["IMPORTE TOTAL"] = None
+    registros[4]["ERRO"] = "Falha no worker"
+    colunas = output_sinks.default_columns(False)
+    with output_sinks.open_sink(caminho, columns=colunas) as sink:
+        escritor = output_sinks.OrderedWriter(sink)
+        for indice in (4, 1, 0, 3, 2):
+            escritor.put(indice, registros[indice])
+        escritor.finish()
+    if formato == "csv":
+        lido = pd.read_csv(caminho, encoding="utf-8-sig")
+    elif formato == "parquet":
+        lido = pd.read_parquet(caminho)
+    else:
+        lido = pd.read_excel(caminho)
+    assert list(lido.columns) == colunas
+    assert list(lido["ARQUIVO"]) == [f"f{i}.pdf" for i in range(5)]
+    assert list(lido["IMPORTE TOTAL"].iloc[:3]) == [1210.0] * 3
+    assert pd.isna(lido["IMPORTE TOTAL"].iloc[3])
+    assert lido["ERRO"].iloc[4] == "Falha no worker"
+    assert bool(lido["TOTAL_OK"].iloc[0]) is True
+
+
+def test_formato_desconhecido_cai_no_xlsx(tmp_path):
+    sink = output_sinks.open_sink(tmp_path / "saida.txt", fmt="ods")
+    assert isinstance(sink, output_sinks.XlsxSink)
+    sink.discard()
+    assert not (tmp_path / "saida.txt").exists()
+
+
+def test_record_sink_e_abstrato(tmp_path):
+    with pytest.raises(TypeError):
+        output_sinks.RecordSink(tmp_path / "saida.bin")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+page_index.PageIndex contra as chamadas do PyMuPDF que ele substitui (user-003):
+find(label) ~ page.search_for(label) e text_in(rect) ~ page.get_text("text", clip=rect).
+O índice trabalha por palavra: rótulos que cobrem parte de uma palavra têm a borda estimada pela
+proporção dos caracteres (TOLERANCIA_PT), e os recortes são comparados com as bordas entre linhas,
+como nas regiões dos extratores (o get_text corta por glifo no meio de uma linha).
+"""
+import fitz
+import pytest
+
+import script_digital
+from page_index import PageIndex
+
+TOLERANCIA_PT = 2.0
+
+
+@pytest.fixture
+def pagina(fatura_pdf):
+    doc = fitz.open(str(fatura_pdf))
+    yield doc[0]
+    doc.close()
+
+
+def _perto(a, b):
+    return all(abs(x - y) <= TOLERANCIA_PT for x, y in zip(a, b))
+
+
+@pytest.mark.parametrize("rotulo", script_digital.DIGITAL_LABEL_MATCHER.labels)
+def test_find_equivale_a_search_for(pagina, rotulo):
+    index = PageIndex(pagina)
+    esperado = pagina.search_for(rotulo)
+    obtido = index.find(rotulo)
+    assert len(obtido) == len(esperado)
+    for r_obtido, r_esperado in zip(obtido, esperado):
+        assert _perto(r_obtido, r_esperado), (rotulo, r_obtido, r_esperado)
+
+
+def test_find_e_case_insensitive_e_acha_todas_as_ocorrencias(pagina):
+    index = PageIndex(pagina)
+    assert len(index.find("nº cliente")) == len(pagina.search_for("nº cliente")) == 3
+    assert index.find("NÚMERO INEXISTENTE") == []
+
+
+def test_prime_preenche_a_mesma_tabela_que_find(pagina):
+    matcher = script_digital.DIGITAL_LABEL_MATCHER
+    preparado = PageIndex(pagina)
+    preparado.prime(matcher)
+    avulso = PageIndex(pagina)
+    for rotulo in matcher.labels:
+        assert [tuple(r) for r in preparado.find(rotulo)] == [tuple(r) for r in avulso.find(rotulo)]
+
+
+@pytest.mark.parametrize("faixa", [
+    (0, 153, 595, 171),    # linha inteira: BASE IMPONIBLE + Subtotal
+    (0, 99, 595, 243),     # do rótulo Descripción até as observações
+    (0, 0, 595, 842),      # página inteira
+])
+def test_text_in_equivale_a_get_text_clip_em_faixas_de_largura_total(pagina, faixa):
+    rect = fitz.Rect(faixa)
+    index = PageIndex(pagina)
+    esperado = [l.strip() for l in pagina.get_text("text", clip=rect).splitlines() if l.strip()]
+    obtido = [l.strip() for l in index.text_in(rect).splitlines()]
+    assert " ".join(obtido).split() == " ".join(esperado).split()
+
+
+def test_text_in_na_regiao_a_direita_do_rotulo(pagina):
+    """ Uso dos extratores: do fim do rótulo até a margem direita, na altura da linha. """
+    index = PageIndex(pagina)
+    rotulo = index.first("base imponible")
+    rect = fitz.Rect(rotulo.x1, rotulo.y0 - 2, 290, rotulo.y1 + 2)
+    assert index.text_in(rect).split() == pagina.get_text("text", clip=rect).split()
+
+
+def test_text_e_o_texto_completo_da_pagina(pagina):
+    assert PageIndex(pagina).text == pagina.get_text("text")
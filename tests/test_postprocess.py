@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+postprocess (user-023): conversão dos importes, verificações TOTAL_OK/MOEDA_OK e a ida e volta pelos
+destinos em blocos (o resultado não depende do tamanho do bloco nem de como os registros chegaram).
+"""
+import math
+
+import pandas as pd
+import pytest
+
+import output_sinks
+import postprocess
+from invoice_record import InvoiceRecord
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("1234,56", 1234.56),
+    ("12,50-", -12.5),
+    ("-12.50", -12.5),
+    ("€ 1.210,00", 1210.0),
+    ("1.210,00 EUR", 1210.0),
+    ("95", 95.0),
+])
+def test_parse_amounts_textos(texto, esperado):
+    assert postprocess.parse_amounts([texto]).tolist() == [esperado]
+
+
+@pytest.mark.parametrize("texto", ["1.234,56", "1,234.56", "1,5", "1,234", "- 3,10", "12,50-", "€ 0,99",
+                                   "1.000.000", "abc", "-", ""])
+def test_parse_amounts_segue_clean_value_do_ocr(texto):
+    import script_ocr
+    esperado = script_ocr.clean_value(texto)
+    obtido = postprocess.parse_amounts([texto]).tolist()[0]
+    if esperado is None:
+        assert math.isnan(obtido)
+    else:
+        assert obtido == float(esperado)
+
+
+def test_parse_amounts_numeros_e_vazios():
+    obtido = postprocess.parse_amounts([12.5, None, "", "sem valor", 7]).tolist()
+    assert obtido[0] == 12.5 and obtido[4] == 7.0
+    assert all(math.isnan(v) for v in obtido[1:4])
+    numerica = pd.Series([1, 2], dtype="int64")
+    assert postprocess.parse_amounts(numerica).dtype == "float64"
+
+
+def _verificar(linhas):
+    return postprocess.postprocess_frame(pd.DataFrame(linhas))
+
+
+def test_total_ok_e_impuestos_calculados():
+    df = _verificar({
+        "BASE IMPONIBLE": ["1.000,00", "100,00", "100,00", None, "100,00"],
+        "IMPUESTOS":      ["210,00",   None,     "21,00",  None, "0,00"],
+        "IMPORTE TOTAL":  ["1.210,00", "121,00", "150,00", None, "50,00"],
+    })
+    assert df["IMPUESTOS"].tolist()[:3] == [210.0, 21.0, 21.0]
+    assert df["TOTAL_OK"].tolist()[:3] == [True, True, False]
+    assert df["TOTAL_OK"].isna().tolist()[3]
+    assert not df["TOTAL_OK"].tolist()[4]  # Total menor que a base
+
+
+def test_total_ok_dentro_da_tolerancia(monkeypatch):
+    linhas = {"BASE IMPONIBLE": [100.0], "IMPUESTOS": [21.0], "IMPORTE TOTAL": [121.01]}
+    assert _verificar(dict(linhas))["TOTAL_OK"].tolist() == [True]
+    monkeypatch.setattr(postprocess, "TOTAL_TOLERANCE", 0.001)
+    assert _verificar(dict(linhas))["TOTAL_OK"].tolist() == [False]
+
+
+def test_moeda_ok(monkeypatch):
+    linhas = {"MOEDA": ["€", " eur ", "USD", "XYZ", None]}
+    df = _verificar(dict(linhas))
+    assert df["MOEDA_OK"].tolist()[:4] == [True, True, True, False]
+    assert df["MOEDA_OK"].isna().tolist()[4]
+    monkeypatch.setattr(postprocess, "EXPECTED_CURRENCY", "EUR")
+    assert _verificar(dict(linhas))["MOEDA_OK"].tolist()[:4] == [True, True, False, False]
+
+
+def _registros(n):
+    """ Dicts com importes em texto; o de índice 3 tem o total errado (TOTAL_OK falso). """
+    registros = []
+    for i in range(n):
+        total = "9,99" if i == 3 else f"{i * 1210:.2f}".replace(".", ",")
+        registros.append({"ARQUIVO": f"f{i}.pdf", "BASE IMPONIBLE": f"{i}.000,00", "IMPUESTOS": None,
+                          "IMPORTE TOTAL": total, "MOEDA": "€"})
+    return registros
+
+
+def test_invoice_record_e_dict_dao_o_mesmo_resultado():
+    dicts = _registros(6)
+    registros = [InvoiceRecord(d) for d in dicts]
+    colunas = output_sinks.default_columns(False)
+    por_coluna = postprocess.postprocess_records(registros, colunas)
+    por_linha = postprocess.postprocess_records(dicts, colunas)
+    pd.testing.assert_frame_equal(por_coluna, por_linha, check_dtype=False)
+
+
+@pytest.mark.parametrize("tamanho_bloco, espera", [(1, None), (4, None), (1000, 0.0)])
+def test_ida_e_volta_em_blocos(tmp_path, tamanho_bloco, espera):
+    registros = _registros(10)
+    colunas = output_sinks.default_columns(False)
+    sink = output_sinks.CsvSink(tmp_path / "saida.csv", colunas)
+    sink.chunk_size = tamanho_bloco
+    if espera is not None:
+        sink.max_wait = espera  # Bloco gravado a cada registro, pelo tempo
+    with sink:
+        for registro in registros:
+            sink.write(registro)
+            assert len(sink._bloco) < (1 if espera is not None else tamanho_bloco)
+    lido = pd.read_csv(tmp_path / "saida.csv", encoding="utf-8-sig")
+    esperado = postprocess.postprocess_records(registros, colunas)
+    assert list(lido.columns) == colunas
+    for coluna in postprocess.AMOUNT_COLUMNS:
+        assert lido[coluna].tolist() == pytest.approx(esperado[coluna].tolist(), nan_ok=True)
+    assert lido["TOTAL_OK"].tolist() == esperado["TOTAL_OK"].tolist() == [i != 3 for i in range(10)]
+    assert lido["MOEDA_OK"].tolist() == [True] * 10
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+result_cache.ResultCache (user-010): ida e volta dos registros, invalidação pela impressão digital
+dos extratores e registros que não podem ir ao cache.
+"""
+import sqlite3
+
+import pytest
+
+import postprocess
+import result_cache
+from invoice_record import InvoiceRecord, NO_CACHE
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "_fingerprints", {})
+    c = result_cache.ResultCache(path=str(tmp_path / "cache.sqlite"))
+    yield c
+    c.close()
+
+
+def _registro():
+    return InvoiceRecord({"ARQUIVO": "f.pdf", "EMISOR": "ENDESA S.A.", "BASE IMPONIBLE": "1.000,00",
+                          "IMPORTE TOTAL": 1210.0, "T_TOTAL_MS": 12.5})
+
+
+def test_ida_e_volta_sem_colunas_de_tempo(cache):
+    assert cache.put("h1", _registro())
+    lido = cache.get("h1")
+    assert lido["EMISOR"] == "ENDESA S.A."
+    assert lido["BASE IMPONIBLE"] == 1000.0
+    assert lido.get("T_TOTAL_MS") is None
+    assert cache.get("outro") is None
+    assert (cache.hits, cache.misses, cache.stored) == (1, 1, 1)
+
+
+def test_registros_com_erro_ou_sem_cache_nao_sao_guardados(cache):
+    com_erro = _registro()
+    com_erro["ERRO"] = "OCR não disponível/funcional"
+    sem_cache = _registro()
+    sem_cache[NO_CACHE] = "DPI reduzido pelo orçamento de memória"
+    assert not cache.put("h1", com_erro)
+    assert not cache.put("h2", sem_cache)
+    assert cache.get("h1") is None and cache.get("h2") is None
+
+
+def test_gravacoes_confirmadas_sem_fechar_o_cache(cache):
+    """ Outra conexão (outra execução) vê o que foi guardado e consegue gravar sem 'database is locked'. """
+    cache.put("h1", _registro())
+    cache.put_classification("h1", "Digital")
+    cache.file_hash(__file__)
+    outra = sqlite3.connect(cache.path, timeout=1)
+    try:
+        assert outra.execute("SELECT COUNT(*) FROM resultados").fetchone() == (1,)
+        assert outra.execute("SELECT COUNT(*) FROM classificacoes").fetchone() == (1,)
+        outra.execute("INSERT INTO classificacoes VALUES ('h2', 'x', 'OCR', 0)")
+        outra.commit()
+    finally:
+        outra.close()
+
+
+def test_mudanca_de_parametro_invalida_as_entradas(cache, monkeypatch):
+    cache.put("h1", _registro())
+    cache.put_classification("h1", "Digital")
+    monkeypatch.setattr(result_cache, "_fingerprints", {})
+    monkeypatch.setattr(postprocess, "TOTAL_TOLERANCE", postprocess.TOTAL_TOLERANCE + 1)
+    novo = result_cache.ResultCache(path=cache.path)
+    try:
+        assert novo.fingerprint != cache.fingerprint
+        assert novo.get("h1") is None
+        assert novo.get_classification("h1") is None
+        assert novo.evict() == 1 # A entrada da versão anterior sai na limpeza
+    finally:
+        novo.close()
+
+
+def test_funcoes_extras_entram_na_impressao_digital(monkeypatch):
+    monkeypatch.setattr(result_cache, "_fingerprints", {})
+
+    def montar_registro():
+        return 1
+
+    assert result_cache.extractor_fingerprint() != result_cache.extractor_fingerprint((montar_registro,))